@@ -1,5 +1,7 @@
 import argparse
 
+from gh_api import add_gh_api_args, configure_gh_api
+from gh_api import get_repo_metadata
 from gh_api import repo
 from util import get_repo_names
 
@@ -19,7 +21,11 @@ parser.add_argument('--gh_user', action = 'store', dest = 'gh_user', required =
                     help = 'GitHub username for API')
 parser.add_argument('--gh_oauth_key', action = 'store', dest = 'gh_oauth_key', required = True, 
                     help = '(String) GitHub oauth key')
+parser.add_argument('--graphql', action = 'store_true', dest = 'graphql',
+                    help = 'Fetch repo metadata for 100 repos per request from the GraphQL API')
+add_gh_api_args(parser)
 args = parser.parse_args()
+configure_gh_api(args)
 sheet = args.sheet
 json_key = args.json_key
 gh_username = args.gh_user
@@ -45,8 +51,14 @@ def get_record(repo_name):
         print(repo_name)
     
 print("Repo names with problems:\n")
-for repo_name in repo_names:
-    record = get_record(repo_name)
+if args.graphql:
+    metadata = get_repo_metadata(repo_names, gh_username, gh_oauth_key)
+    for repo_name in repo_names:
+        if metadata[repo_name] is None:
+            print(repo_name)
+else:
+    for repo_name in repo_names:
+        record = get_record(repo_name)
 
 print("\nAll done.")
 
@@ -14,3 +14,66 @@ from .requests import validate_response_found
 from .requests import get_initial_commit
 
 
+from .transport import curl_pool
+from .transport import get_response
+from .transport import CurlPool
+from .transport import gh_request
+from .rate_limit import rate_limiter
+from .rate_limit import RateLimiter
+from .rate_limit import read_rate_limit_state
+from .requests import parse_link_header
+from .requests import page_num_from_url
+from .requests import max_parallel_pages
+from .transport import set_response_cache
+from .cache import ResponseCache
+from .cli import add_gh_api_args
+from .cli import configure_gh_api
+from .transport import set_credential_pool
+from .credentials import CredentialPool
+from .credentials import read_credentials
+from .async_requests import map_concurrently
+from .async_requests import pages_per_call
+from .requests import iter_gh_pages
+from .requests import iter_commits
+from .requests import iter_pull_requests
+from .transport import endpoint_class
+from .retry import retry_policy
+from .retry import RetryPolicy
+from .retry import RetryableError
+from .retry import IncompleteResponseError
+from .retry import request_with_retries
+from .requests import add_per_page
+from .transport import wire_stats
+from .memo import memo
+from .memo import Memoizer
+from .transport import set_budget_scheduler
+from .scheduler import BudgetScheduler
+from .planner import CrawlPlan
+from .planner import get_budget
+from .planner import print_plan
+from .planner import num_pages
+from .graphql import get_repo_metadata
+from .graphql import max_repos_per_query
+from .cassette import Cassette
+from .transport import set_cassette
+from .cli import set_api_url
+from .metrics import metrics
+from .metrics import RequestMetrics
+from .requests import count_records
+from .requests import count_commits
+from .requests import count_pull_requests
+from .requests import count_contributors
+from .repo_status import RepoStatusCache
+from .transport import set_repo_status
+from .requests import get_file_info_tree
+from .requests import get_default_branch
+from .requests import get_tree_url
+from .archive import get_archive_contents
+from .archive import download_tarball
+from .archive import git_blob_sha
+from .requests import get_tarball_url
+from .requests import get_initial_commits
+from .requests import iter_commit_files
+from .requests import iter_commits_oldest_first
+from .requests import iter_new_commits
+from .requests import iter_updated_pull_requests
@@ -0,0 +1,127 @@
+""" File contents from repo archives.
+
+One tarball request returns every file of a repo at a commit, where the contents API
+needs one request per file. The archive is spooled to a temporary file, in memory while
+it is small, and read as a stream without extracting anything to disk.
+"""
+
+import hashlib
+import tarfile
+from tempfile import SpooledTemporaryFile
+
+from .requests import get_tarball_url
+from .retry import rate_limit_exhausted, request_with_retries
+from .transport import gh_request
+
+
+# Bytes of a downloaded archive kept in memory before it is spooled to disk
+max_archive_memory = 32 * 1024 * 1024
+
+
+def git_blob_sha(data):
+    """ Returns the git object name of a blob with the given contents
+
+    Args:
+        data: Blob contents as bytes
+    """
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+
+def download_tarball(repo_name, ref, gh_username, gh_oauth_key):
+    """ Returns a file object positioned at the start of the gzipped tar archive of a repo,
+    or None if the repo or ref does not exist. The caller must close it.
+    The body is not JSON, so a 403 response is recognized as a rate limit by its headers.
+
+    Args:
+        repo_name: Repo name
+        ref: Commit sha or branch name
+        gh_username: GitHub username for GitHub API
+        gh_oauth_key: (String) GitHub oauth key
+    """
+    url = get_tarball_url(repo_name, ref)
+    output = SpooledTemporaryFile(max_size = max_archive_memory)
+
+    try:
+        response, _parsed = request_with_retries('tarball', lambda: gh_request(url, gh_username, gh_oauth_key,
+                                                                               output = output),
+                                                 rate_limited = lambda response, parsed: rate_limit_exhausted(response))
+    except BaseException:
+        output.close()
+        raise
+    if response.status != 200:
+        output.close()
+        if response.status == 404:
+            return None
+        raise RuntimeError("Archive request for %s at %s failed with status %s" % (repo_name, ref, response.status))
+    output.seek(0)
+    return output
+
+
+def iter_archive_members(fileobj, wanted = None):
+    """ Yields (path, data) for the files and symlinks of a GitHub tarball, read as a stream.
+    Paths are relative to the repo root, without the top-level owner-repo-sha directory.
+    The data of a symlink is its target, as in the git blob.
+
+    Args:
+        fileobj: Binary file object of the gzipped tar archive
+        wanted: Optional function of (path, size) that says whether to read a member;
+                members it rejects are skipped without reading their data
+    """
+    with tarfile.open(fileobj = fileobj, mode = "r|gz") as archive:
+        for member in archive:
+            if "/" not in member.name:
+                continue
+            path = member.name.split("/", 1)[1]
+            if member.issym():
+                data = member.linkname.encode()
+            elif member.isfile():
+                data = None
+            else:
+                continue
+            size = len(data) if data is not None else member.size
+            if wanted is not None and not wanted(path, size):
+                continue
+            if data is None:
+                data = archive.extractfile(member).read()
+            yield path, data
+
+
+def decode_contents(data):
+    """ Returns file contents as a string, or None if they are not valid UTF-8, like get_file_contents """
+    try:
+        return data.decode()
+    except UnicodeDecodeError:
+        return None
+
+
+def get_archive_contents(repo_name, ref, file_info_records, gh_username, gh_oauth_key):
+    """ Returns dict from (path, sha) to file contents as a string, or None if the file could
+    not be decoded, for the file info records found in the repo's archive at ref.
+    A record is found if the archive has a file with its blob sha, at its path or at any
+    other path, since the sha determines the contents. Records not found, e.g. because the
+    file changed after ref, are missing from the result.
+
+    Args:
+        repo_name: Repo name
+        ref: Commit sha or branch name, normally the commit the file info was listed at
+        file_info_records: Dicts with at least 'path', 'sha' and 'size'
+        gh_username: GitHub username for GitHub API
+        gh_oauth_key: (String) GitHub oauth key
+    """
+    rtrn = {}
+    records_by_sha = {}
+    for record in file_info_records:
+        records_by_sha.setdefault(record["sha"], []).append(record)
+    wanted_paths = {record["path"] for record in file_info_records}
+    wanted_sizes = {record["size"] for record in file_info_records}
+    archive = download_tarball(repo_name, ref, gh_username, gh_oauth_key)
+    if archive is None:
+        return rtrn
+    with archive:
+        for path, data in iter_archive_members(archive, lambda p, size: p in wanted_paths or size in wanted_sizes):
+            sha = git_blob_sha(data)
+            for record in records_by_sha.pop(sha, []):
+                rtrn[(record["path"], record["sha"])] = decode_contents(data)
+            if not records_by_sha:
+                break
+    return rtrn
@@ -0,0 +1,127 @@
+""" asyncio counterparts of the functions in gh_api.requests.
+
+pycurl requests block, so each call runs on a bounded thread pool and is awaited from
+the event loop. The size of the pool is the number of requests in flight at once.
+All threads share the pooled connections, the rate limiter and any credential pool or
+response cache, so concurrent callers draw on one rate limit budget.
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import threading
+
+from . import requests
+
+
+# Maximum number of GitHub API calls running at once
+concurrency = 1
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def set_concurrency(n):
+    """ Set the maximum number of GitHub API calls running at once """
+    global concurrency, _executor
+    if n < 1:
+        raise ValueError("Concurrency must be positive")
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait = False)
+            _executor = None
+        concurrency = n
+
+
+def get_executor():
+    """ Returns the thread pool that runs the blocking calls """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers = concurrency)
+        return _executor
+
+
+def pages_per_call(num_calls):
+    """ Returns the number of pages each of num_calls concurrent calls may fetch at once,
+    so that together they make at most 'concurrency' requests at once
+
+    Args:
+        num_calls: Number of calls running at once, e.g. the size of a batch of repos
+    """
+    return max(1, min(requests.max_parallel_pages, concurrency // max(1, num_calls)))
+
+
+async def call(fn, *args, **kwargs):
+    """ Run a blocking function on the shared thread pool and return its result """
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(get_executor(), functools.partial(fn, *args, **kwargs))
+
+
+async def get_commits(repo_name, gh_username, gh_oauth_key):
+    """ Async version of gh_api.get_commits """
+    return await call(requests.get_commits, repo_name, gh_username, gh_oauth_key)
+
+
+async def get_file_info(repo_name, gh_username, gh_oauth_key, path = None):
+    """ Async version of gh_api.get_file_info """
+    return await call(requests.get_file_info, repo_name, gh_username, gh_oauth_key, path)
+
+
+async def get_file_info_tree(repo_name, gh_username, gh_oauth_key, ref = None):
+    """ Async version of gh_api.get_file_info_tree """
+    return await call(requests.get_file_info_tree, repo_name, gh_username, gh_oauth_key, ref)
+
+
+async def get_file_contents(url, gh_username, gh_oauth_key):
+    """ Async version of gh_api.get_file_contents """
+    return await call(requests.get_file_contents, url, gh_username, gh_oauth_key)
+
+
+async def get_initial_commit(repo_name, path, gh_username, gh_oauth_key):
+    """ Async version of gh_api.get_initial_commit """
+    return await call(requests.get_initial_commit, repo_name, path, gh_username, gh_oauth_key)
+
+
+async def get_pull_requests(repo_name, gh_username, gh_oauth_key, state = "all"):
+    """ Async version of gh_api.get_pull_requests """
+    return await call(requests.get_pull_requests, repo_name, gh_username, gh_oauth_key, state)
+
+
+async def get_language_bytes(repo_name, gh_username, gh_oauth_key):
+    """ Async version of gh_api.get_language_bytes """
+    return await call(requests.get_language_bytes, repo_name, gh_username, gh_oauth_key)
+
+
+async def get_license(repo_name, gh_username, gh_oauth_key):
+    """ Async version of gh_api.get_license """
+    return await call(requests.get_license, repo_name, gh_username, gh_oauth_key)
+
+
+def run_concurrently(coroutines):
+    """ Run coroutines on a new event loop and return their results in order
+    An exception raised by a coroutine is returned in place of its result.
+
+    Args:
+        coroutines: List of coroutine objects
+    """
+    async def gather_all():
+        return await asyncio.gather(*coroutines, return_exceptions = True)
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(gather_all())
+    finally:
+        loop.close()
+
+
+def map_concurrently(fn, items):
+    """ Apply a blocking function to each item with up to 'concurrency' calls at once
+    Returns the results in the order of items. An exception raised for an item is
+    returned in place of its result.
+
+    Args:
+        fn: Function of one argument
+        items: List of arguments
+    """
+    return run_concurrently([call(fn, item) for item in items])
+
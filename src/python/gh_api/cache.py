@@ -0,0 +1,132 @@
+import json
+import sqlite3
+import threading
+import time
+
+
+class ResponseCache(object):
+    """Persistent cache of GitHub API responses for conditional requests.
+
+    Stores the body, Link header and validators (ETag, Last-Modified) of each page in
+    a SQLite database, keyed by the full page URL. A cached page is requested again with
+    If-None-Match/If-Modified-Since; GitHub answers 304 Not Modified without counting
+    against the rate limit, and the cached body is used.
+    """
+
+    # Response headers stored with each body
+    stored_headers = ["etag", "last-modified", "link"]
+
+    def __init__(self, path, max_age = 30 * 24 * 60 * 60, max_bytes = 2 * 1024 ** 3, evict_every = 1000):
+        """
+        Args:
+            path: SQLite database file, created if necessary
+            max_age: Entries stored longer ago than this many seconds are evicted
+            max_bytes: Total body size above which least recently used entries are evicted
+            evict_every: Run eviction after this many new entries
+        """
+        self.path = path
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.evict_every = evict_every
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread = False)
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS responses (
+                                url TEXT PRIMARY KEY,
+                                headers TEXT,
+                                body BLOB,
+                                size INTEGER,
+                                stored REAL,
+                                used REAL)""")
+        self._conn.commit()
+        self.evict()
+
+    def lookup(self, url):
+        """ Returns (headers, body) for a cached URL, or None """
+        with self._lock:
+            row = self._conn.execute("SELECT headers, body, stored FROM responses WHERE url = ?", (url,)).fetchone()
+        if row is None or time.time() - row[2] > self.max_age:
+            return None
+        return json.loads(row[0]), bytes(row[1])
+
+    def conditional_headers(self, url):
+        """ Returns the request headers that make a request for a cached URL conditional """
+        entry = self.lookup(url)
+        if entry is None:
+            return []
+        headers, _body = entry
+        rtrn = []
+        if "etag" in headers:
+            rtrn.append("If-None-Match: %s" % headers["etag"])
+        if "last-modified" in headers:
+            rtrn.append("If-Modified-Since: %s" % headers["last-modified"])
+        return rtrn
+
+    def hit(self, url):
+        """ Returns (headers, body) for a URL the server said was not modified, and counts a hit """
+        entry = self.lookup(url)
+        if entry is not None:
+            with self._lock:
+                self.hits = self.hits + 1
+                self._conn.execute("UPDATE responses SET used = ? WHERE url = ?", (time.time(), url))
+                self._conn.commit()
+        return entry
+
+    def store(self, url, headers, body):
+        """ Cache a successful response if it has a validator, and count a miss
+
+        Args:
+            url: Full page URL
+            headers: Dict of response headers with lower case names
+            body: Response body as bytes
+        """
+        with self._lock:
+            self.misses = self.misses + 1
+        kept = {name: headers[name] for name in self.stored_headers if name in headers}
+        if "etag" not in kept and "last-modified" not in kept:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                               (url, json.dumps(kept), sqlite3.Binary(body), len(body), now, now))
+            self._conn.commit()
+            self.stores = self.stores + 1
+            run_eviction = self.stores % self.evict_every == 0
+        if run_eviction:
+            self.evict()
+
+    def evict(self):
+        """ Delete entries older than max_age, then least recently used entries until under max_bytes """
+        with self._lock:
+            cur = self._conn.execute("DELETE FROM responses WHERE stored < ?", (time.time() - self.max_age,))
+            num_deleted = cur.rowcount
+            total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if total > self.max_bytes:
+                excess = total - self.max_bytes
+                urls = []
+                for url, size in self._conn.execute("SELECT url, size FROM responses ORDER BY used, rowid"):
+                    if excess <= 0:
+                        break
+                    urls.append((url,))
+                    excess = excess - size
+                self._conn.executemany("DELETE FROM responses WHERE url = ?", urls)
+                num_deleted = num_deleted + len(urls)
+            self._conn.commit()
+            self.evictions = self.evictions + num_deleted
+
+    def stats(self):
+        """ Returns dict of hit, miss, store and eviction counters """
+        return {'hits': self.hits, 'misses': self.misses, 'stores': self.stores, 'evictions': self.evictions}
+
+    def summary(self):
+        """ Returns the counters as a printable string """
+        return "%s hits (304 Not Modified), %s misses, %s stored, %s evicted" \
+            % (self.hits, self.misses, self.stores, self.evictions)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
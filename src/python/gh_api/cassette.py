@@ -0,0 +1,119 @@
+import base64
+import json
+import os
+import threading
+from urllib.parse import urlparse
+
+
+class Cassette(object):
+    """Recorded GitHub API responses, kept in a JSON lines file.
+
+    In 'record' mode, every response received is appended to the file. In 'replay' mode,
+    requests are answered from the file without touching the network: the responses
+    recorded for a request are returned in the order they were recorded, and the last one
+    is repeated once they run out. Requests are matched on method, path and query, so a
+    cassette recorded against api.github.com can be replayed against any host.
+    Credentials are never recorded, and bodies are stored decoded, without the
+    transfer headers that describe the encoded form.
+    """
+
+    modes = ('record', 'replay')
+
+    # Response headers that describe the body on the wire rather than the decoded body
+    transfer_headers = {"set-cookie", "content-encoding", "content-length", "transfer-encoding"}
+
+    def __init__(self, path, mode = 'replay'):
+        """
+        Args:
+            path: JSON lines file; in record mode it is created or appended to
+            mode: 'record' or 'replay'
+        """
+        if mode not in self.modes:
+            raise ValueError("Cassette mode must be one of %s" % ", ".join(self.modes))
+        self.path = path
+        self.mode = mode
+        self.num_recorded = 0
+        self.num_replayed = 0
+        self.num_missing = 0
+        self._responses = {}
+        self._positions = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    if line.strip():
+                        self._add(json.loads(line))
+
+    @staticmethod
+    def key(url, data = None):
+        """ Returns the key a request is matched on: method, path and query """
+        parsed = urlparse(url)
+        path = parsed.path + ("?%s" % parsed.query if parsed.query else "")
+        if data is None:
+            return "GET", path, None
+        return "POST", path, data if isinstance(data, str) else data.decode()
+
+    def _add(self, entry):
+        key = (entry["method"], entry["path"], entry.get("data"))
+        self._responses.setdefault(key, []).append(entry)
+
+    def play(self, url, data = None):
+        """ Returns (status, headers, body) recorded for a request, or None if there is none
+
+        Args:
+            url: Request URL
+            data: Request body for a POST request
+        """
+        key = self.key(url, data)
+        with self._lock:
+            entries = self._responses.get(key)
+            if not entries:
+                self.num_missing = self.num_missing + 1
+                return None
+            position = self._positions.get(key, 0)
+            self._positions[key] = position + 1
+            self.num_replayed = self.num_replayed + 1
+        return decode_entry(entries[min(position, len(entries) - 1)])
+
+    def record(self, url, status, headers, body, data = None):
+        """ Append a response to the cassette
+
+        Args:
+            url: Request URL
+            status: HTTP status code
+            headers: Dict of response headers with lower case names
+            body: Response body as bytes
+            data: Request body for a POST request
+        """
+        method, path, data = self.key(url, data)
+        entry = {'method': method, 'path': path, 'data': data, 'status': status,
+                 'headers': {name: value for name, value in headers.items() if name not in self.transfer_headers}}
+        try:
+            entry['body'] = body.decode()
+        except UnicodeDecodeError:
+            entry['body_base64'] = base64.b64encode(body).decode()
+        line = json.dumps(entry)
+        with self._lock:
+            self._add(entry)
+            with open(self.path, "a") as f:
+                f.write(line + "\n")
+            self.num_recorded = self.num_recorded + 1
+
+    def entries(self):
+        """ Returns dict from (method, path, data) to the list of recorded (status, headers, body) """
+        with self._lock:
+            return {key: [decode_entry(entry) for entry in entries] for key, entries in self._responses.items()}
+
+    def summary(self):
+        """ Returns the record and replay counts as a printable string """
+        return "%s mode: %s responses recorded, %s replayed, %s requests not on the cassette" \
+            % (self.mode, self.num_recorded, self.num_replayed, self.num_missing)
+
+
+def decode_entry(entry):
+    """ Returns (status, headers, body bytes) of a cassette entry """
+    if 'body_base64' in entry:
+        body = base64.b64decode(entry['body_base64'])
+    else:
+        body = entry['body'].encode()
+    return entry['status'], dict(entry['headers']), body
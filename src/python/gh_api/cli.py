@@ -0,0 +1,130 @@
+import atexit
+import os
+import signal
+import sys
+
+import dateutil.parser
+
+from . import async_requests
+from . import graphql
+from . import requests
+from . import transport
+from .cache import ResponseCache
+from .cassette import Cassette
+from .credentials import CredentialPool, read_credentials
+from .memo import memo
+from .metrics import metrics
+from .repo_status import RepoStatusCache
+from .retry import retry_policy
+from .scheduler import BudgetScheduler
+from .transport import set_budget_scheduler, set_cassette, set_credential_pool, set_repo_status, set_response_cache
+from .transport import wire_stats
+
+
+def add_gh_api_args(parser):
+    """ Add the command line options shared by all scripts that use the GitHub API
+
+    Args:
+        parser: argparse.ArgumentParser
+    """
+    parser.add_argument('--concurrency', action = 'store', dest = 'concurrency', type = int, default = 1,
+                        help = 'Maximum number of GitHub API calls to run at once')
+    parser.add_argument('--gh_memo_ttl', action = 'store', dest = 'gh_memo_ttl', type = float, default = 300,
+                        help = 'Seconds to reuse results of repeated GitHub API calls within this run')
+    parser.add_argument('--gh_token_file', action = 'store', dest = 'gh_token_file', required = False,
+                        help = 'File of additional GitHub credentials, one username:oauth_key per line')
+    parser.add_argument('--gh_ledger', action = 'store', dest = 'gh_ledger', required = False,
+                        help = 'SQLite ledger shared by collector processes to divide the GitHub API budget')
+    parser.add_argument('--gh_stage', action = 'store', dest = 'gh_stage', required = False,
+                        help = 'Stage name in the ledger (default: script name)')
+    parser.add_argument('--gh_priority', action = 'store', dest = 'gh_priority', type = float, default = 1,
+                        help = 'Priority of this stage in the ledger; larger values get more budget')
+    parser.add_argument('--gh_deadline', action = 'store', dest = 'gh_deadline', required = False,
+                        help = 'Date and time by which this stage should finish, e.g. "2018-03-01 18:00"')
+    parser.add_argument('--gh_cache', action = 'store', dest = 'gh_cache', required = False,
+                        help = 'SQLite file to cache GitHub API responses in for conditional requests')
+    parser.add_argument('--gh_cache_max_age', action = 'store', dest = 'gh_cache_max_age', type = float,
+                        default = 30, help = 'Days after which cached GitHub API responses are evicted')
+    parser.add_argument('--gh_cache_max_mb', action = 'store', dest = 'gh_cache_max_mb', type = float,
+                        default = 2048, help = 'Size in MB above which cached GitHub API responses are evicted')
+    parser.add_argument('--gh_api_url', action = 'store', dest = 'gh_api_url', required = False,
+                        help = 'Base URL of the GitHub API, e.g. of a mock server (default: https://api.github.com)')
+    parser.add_argument('--gh_cassette', action = 'store', dest = 'gh_cassette', required = False,
+                        help = 'Cassette file to record GitHub API responses to or replay them from')
+    parser.add_argument('--gh_cassette_mode', action = 'store', dest = 'gh_cassette_mode', default = 'replay',
+                        choices = Cassette.modes, help = 'Whether to record or replay the cassette')
+    parser.add_argument('--gh_repo_status', action = 'store', dest = 'gh_repo_status', required = False,
+                        help = 'SQLite file of missing and renamed repos, shared between stages and runs')
+    parser.add_argument('--gh_missing_ttl', action = 'store', dest = 'gh_missing_ttl', type = float, default = 7,
+                        help = 'Days to skip a repo after the GitHub API said it was not found')
+    parser.add_argument('--gh_metrics', action = 'store', dest = 'gh_metrics', required = False,
+                        help = 'File to write GitHub API request metrics to at exit and on SIGUSR1')
+    parser.add_argument('--gh_metrics_format', action = 'store', dest = 'gh_metrics_format', default = 'json',
+                        choices = ['json', 'prometheus'], help = 'Format of the metrics file')
+    parser.add_argument('--plan', action = 'store_true', dest = 'plan',
+                        help = 'Print the estimated GitHub API cost and schedule, then exit without fetching')
+
+
+def set_api_url(base_url):
+    """ Send all GitHub API requests to another server, e.g. a mock server
+
+    Args:
+        base_url: Base URL without a trailing slash, e.g. 'http://127.0.0.1:8000'
+    """
+    requests.url_repos = "%s/repos" % base_url
+    graphql.url_graphql = "%s/graphql" % base_url
+
+
+def configure_gh_api(args):
+    """ Set up the gh_api package from the options added by add_gh_api_args
+    Summaries are printed when the script exits.
+
+    Args:
+        args: Parsed arguments
+    """
+    async_requests.set_concurrency(args.concurrency)
+    if args.gh_api_url is not None:
+        set_api_url(args.gh_api_url.rstrip("/"))
+    if args.gh_cassette is not None:
+        tape = Cassette(args.gh_cassette, args.gh_cassette_mode)
+        set_cassette(tape)
+        atexit.register(lambda: print("GitHub API cassette: %s" % tape.summary()))
+    memo.ttl = args.gh_memo_ttl
+    atexit.register(lambda: print("GitHub API repeated calls: %s" % memo.summary()))
+    atexit.register(lambda: print("GitHub API retries:\n%s" % retry_policy.summary()))
+    atexit.register(lambda: print("GitHub API transfers: %s" % wire_stats.summary()))
+    if args.gh_token_file is not None:
+        # The credentials passed with --gh_user/--gh_oauth_key join the pool
+        gh_username = getattr(args, 'gh_username', None) or getattr(args, 'gh_user', None)
+        credentials = read_credentials(args.gh_token_file)
+        if gh_username is not None and args.gh_oauth_key is not None:
+            credentials = [(gh_username, args.gh_oauth_key)] + credentials
+        pool = CredentialPool(credentials)
+        set_credential_pool(pool)
+        print("Spreading GitHub API requests over %s credentials" % len(pool))
+    if args.gh_cache is not None:
+        cache = ResponseCache(args.gh_cache, max_age = args.gh_cache_max_age * 24 * 60 * 60,
+                              max_bytes = int(args.gh_cache_max_mb * 1024 * 1024))
+        set_response_cache(cache)
+        atexit.register(lambda: print("GitHub API response cache: %s" % cache.summary()))
+    if args.gh_repo_status is not None:
+        status_cache = RepoStatusCache(args.gh_repo_status, ttl = args.gh_missing_ttl * 24 * 60 * 60)
+        set_repo_status(status_cache)
+        atexit.register(lambda: print("GitHub API missing and renamed repos: %s" % status_cache.summary()))
+    if args.gh_metrics is not None:
+        def dump_metrics(*_args):
+            metrics.dump(args.gh_metrics, args.gh_metrics_format)
+        atexit.register(dump_metrics)
+        if hasattr(signal, "SIGUSR1"):
+            signal.signal(signal.SIGUSR1, dump_metrics)
+    if args.gh_ledger is not None:
+        stage = args.gh_stage or os.path.splitext(os.path.basename(sys.argv[0]))[0]
+        deadline = dateutil.parser.parse(args.gh_deadline).timestamp() if args.gh_deadline is not None else None
+        num_keys = len(transport.credential_pool) if transport.credential_pool is not None else 1
+        scheduler = BudgetScheduler(args.gh_ledger, stage, args.gh_priority, deadline, num_keys = num_keys)
+        set_budget_scheduler(scheduler)
+        def close_scheduler():
+            print("GitHub API budget scheduler: %s" % scheduler.summary())
+            scheduler.close()
+        atexit.register(close_scheduler)
+
@@ -0,0 +1,101 @@
+import threading
+import time
+
+from .rate_limit import RateLimiter
+
+
+class Credential(object):
+    """One GitHub username and oauth key, with the rate limit state of that key"""
+
+    def __init__(self, gh_username, gh_oauth_key, reserve = 100):
+        """
+        Args:
+            gh_username: GitHub username for GitHub API
+            gh_oauth_key: (String) GitHub oauth key
+            reserve: Remaining request count below which requests with this key are paced
+        """
+        self.gh_username = gh_username
+        self.gh_oauth_key = gh_oauth_key
+        self.limiter = RateLimiter(reserve = reserve)
+
+    def headroom(self, now = None):
+        """ Number of requests left before the key is exhausted; unknown counts as the full limit """
+        now = time.time() if now is None else now
+        state = self.limiter.state()
+        if state['remaining'] is None or state['reset'] is None or now >= state['reset']:
+            return state['limit']
+        return state['remaining']
+
+    def available_at(self, now = None):
+        """ Time from which the key can be used again: now, or its reset time if exhausted """
+        now = time.time() if now is None else now
+        if self.headroom(now) > 0:
+            return now
+        return self.limiter.state()['reset']
+
+
+class CredentialPool(object):
+    """Several GitHub credentials used together to get more than one key's hourly budget.
+
+    Each request goes to the key with the most remaining budget. A key whose budget is
+    used up is skipped until its reset time, unless every key is exhausted, in which case
+    the key that resets first is used and the request waits for it.
+    """
+
+    def __init__(self, credentials):
+        """
+        Args:
+            credentials: List of (gh_username, gh_oauth_key) tuples
+        """
+        if len(credentials) == 0:
+            raise ValueError("Credential pool needs at least one credential")
+        self.credentials = [Credential(user, key) for user, key in credentials]
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.credentials)
+
+    def choose(self, now = None):
+        """ Returns the Credential to use for the next request """
+        now = time.time() if now is None else now
+        with self._lock:
+            available = [c for c in self.credentials if c.available_at(now) <= now]
+            if available:
+                return max(available, key = lambda c: c.headroom(now))
+            return min(self.credentials, key = lambda c: c.available_at(now))
+
+    def state(self):
+        """ Returns list of rate limit state dicts, one per credential, with usernames but not keys """
+        rtrn = []
+        for c in self.credentials:
+            state = c.limiter.state()
+            state['gh_username'] = c.gh_username
+            rtrn.append(state)
+        return rtrn
+
+    def total_remaining(self):
+        """ Returns the summed remaining budget over all credentials """
+        return sum(c.headroom() for c in self.credentials)
+
+
+def read_credentials(path):
+    """ Returns list of (gh_username, gh_oauth_key) tuples from a file with one credential per line
+    Each line is 'username:oauth_key' or just an oauth key. Blank lines and lines starting with # are skipped.
+
+    Args:
+        path: Credentials file
+    """
+    rtrn = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if len(line) == 0 or line.startswith("#"):
+                continue
+            if ":" in line:
+                user, key = line.split(":", 1)
+                rtrn.append((user.strip(), key.strip()))
+            else:
+                # GitHub accepts an oauth key as the username with this fixed password
+                rtrn.append((line, "x-oauth-basic"))
+    return rtrn
+
@@ -0,0 +1,138 @@
+""" Batched repo-level metadata from the GitHub GraphQL API (v4).
+
+One GraphQL query returns, for up to 100 repos, what the REST API spreads over the
+repos, languages, license and commits endpoints: one request per 100 repos instead of
+at least four per repo. Each repo is one aliased field of the query.
+"""
+
+import json
+
+from . import requests
+from .retry import rate_limit_exhausted, request_with_retries
+from .transport import gh_request, parse_json
+
+
+# The GraphQL endpoint
+url_graphql = "https://api.github.com/graphql"
+
+# Largest number of repos fetched in one query
+max_repos_per_query = 100
+
+# Fields fetched for each repo. Open issues include open pull requests and watchers are
+# stargazers, as in the REST API; subscribers are what GraphQL calls watchers.
+repo_fragment = """
+fragment RepoFields on Repository {
+  nameWithOwner
+  url
+  description
+  isFork
+  forkCount
+  stargazers { totalCount }
+  watchers { totalCount }
+  issues(states: OPEN) { totalCount }
+  pullRequests(states: OPEN) { totalCount }
+  licenseInfo { key }
+  languages(first: 100) { edges { size node { name } } }
+  defaultBranchRef { target { oid } }
+}
+"""
+
+
+def repo_query(repo_names):
+    """ Returns the GraphQL query for a list of repo names; repo i is aliased 'r<i>'
+
+    Args:
+        repo_names: List of 'owner/name' strings
+    """
+    fields = []
+    for i, repo_name in enumerate(repo_names):
+        owner, name = repo_name.split("/", 1)
+        fields.append("  r%s: repository(owner: %s, name: %s) { ...RepoFields }"
+                      % (i, json.dumps(owner), json.dumps(name)))
+    return "query {\n%s\n}\n%s" % ("\n".join(fields), repo_fragment)
+
+
+def repo_record(repo_name, data):
+    """ Returns a dict of repo metadata from the GraphQL result for one repo, with the
+    field names of the REST API, or None if the repo was not found
+
+    Args:
+        repo_name: Repo name as requested
+        data: Parsed result of the repo's aliased field
+    """
+    if data is None:
+        return None
+    branch = data.get("defaultBranchRef")
+    lic = data.get("licenseInfo")
+    return {'repo_name': repo_name,
+            'api_url': "%s/%s" % (requests.url_repos, repo_name),
+            'html_url': data.get("url"),
+            'description': data.get("description"),
+            'is_fork': data.get("isFork"),
+            'stargazers_count': data["stargazers"]["totalCount"],
+            'watchers_count': data["stargazers"]["totalCount"],
+            'forks_count': data.get("forkCount"),
+            'open_issues_count': data["issues"]["totalCount"] + data["pullRequests"]["totalCount"],
+            'subscribers_count': data["watchers"]["totalCount"],
+            'license': lic.get("key") if lic is not None else None,
+            'language_bytes': {edge["node"]["name"]: edge["size"] for edge in data["languages"]["edges"]},
+            'curr_commit_master': branch["target"]["oid"] if branch is not None else None}
+
+
+def run_query(query, gh_username, gh_oauth_key):
+    """ Returns the parsed 'data' and 'errors' of a GraphQL query
+    Rate limits are reported as RATE_LIMITED errors in a 200 response, or with status 403 and
+    no requests remaining, and are retried with the other failures by request_with_retries.
+    Other 403 responses are permission errors and raise RuntimeError.
+
+    Args:
+        query: GraphQL query string
+        gh_username: GitHub username for GitHub API
+        gh_oauth_key: (String) GitHub oauth key
+    """
+    body = json.dumps({"query": query})
+
+    def rate_limited(response, parsed):
+        return rate_limit_exhausted(response) or (type(parsed) is dict and any(e.get("type") == "RATE_LIMITED"
+                                                                                for e in parsed.get("errors", [])))
+
+    response, parsed = request_with_retries('graphql',
+                                            lambda: gh_request(url_graphql, gh_username, gh_oauth_key,
+                                                               ["Content-Type: application/json"], data = body),
+                                            lambda response: parse_json(response.body), rate_limited)
+    if response.status >= 500:
+        raise RuntimeError("GraphQL server error %s" % response.status)
+    if type(parsed) is not dict:
+        raise ValueError("GraphQL response is not a valid JSON object")
+    if response.status != 200:
+        raise RuntimeError("GraphQL request failed with status %s: %s" % (response.status, parsed.get("message")))
+    return parsed.get("data") or {}, parsed.get("errors", [])
+
+
+def get_repo_metadata(repo_names, gh_username, gh_oauth_key):
+    """ Returns dict from repo name to a dict of metadata as returned by repo_record, with
+    None for repos that do not exist or could not be read, e.g. with a FORBIDDEN error;
+    fetches max_repos_per_query repos per request. Raises RuntimeError for an error that
+    is not about one repo.
+
+    Args:
+        repo_names: List of 'owner/name' strings
+        gh_username: GitHub username for GitHub API
+        gh_oauth_key: (String) GitHub oauth key
+    """
+    rtrn = {repo_name: None for repo_name in repo_names if "/" not in repo_name}
+    valid = [repo_name for repo_name in repo_names if "/" in repo_name]
+    for i in range(0, len(valid), max_repos_per_query):
+        batch = valid[i:i + max_repos_per_query]
+        data, errors = run_query(repo_query(batch), gh_username, gh_oauth_key)
+        aliases = {"r%s" % j: repo_name for j, repo_name in enumerate(batch)}
+        for error in errors:
+            path = error.get("path") or [None]
+            if path[0] not in aliases:
+                raise RuntimeError("GraphQL error: %s" % error.get("message"))
+            if error.get("type") != "NOT_FOUND":
+                print("Skipping repo %s: GraphQL error %s: %s" % (aliases[path[0]], error.get("type"), error.get("message")))
+                data[path[0]] = None
+        for alias, repo_name in aliases.items():
+            rtrn[repo_name] = repo_record(repo_name, data.get(alias))
+    return rtrn
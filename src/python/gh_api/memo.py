@@ -0,0 +1,107 @@
+from collections import OrderedDict
+import threading
+import time
+
+
+class _Flight(object):
+    """A call in progress that other callers with the same key wait for"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class Memoizer(object):
+    """In-process memo of GitHub API results with request coalescing.
+
+    A result is kept for ttl seconds and returned to later callers with the same key.
+    While a call is in flight, concurrent callers with the same key wait for it and
+    share its result instead of making the same request. Results are shared, not
+    copied, so callers must not modify them.
+    """
+
+    def __init__(self, ttl = 300, max_entries = 10000):
+        """
+        Args:
+            ttl: Seconds a result is kept. 0 turns off memoization but keeps coalescing.
+            max_entries: Maximum number of results kept; the oldest are dropped first
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.num_calls = 0
+        self.num_hits = 0
+        self.num_coalesced = 0
+        self._results = OrderedDict()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, fn):
+        """ Returns the memoized result for key, or calls fn to compute it
+
+        Args:
+            key: Hashable key, e.g. the request URL
+            fn: Function of no arguments that computes the result
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._results.get(key)
+            if entry is not None and now - entry[0] < self.ttl:
+                self.num_hits = self.num_hits + 1
+                return entry[1]
+            flight = self._in_flight.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._in_flight[key] = flight
+                self.num_calls = self.num_calls + 1
+            else:
+                self.num_coalesced = self.num_coalesced + 1
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+        try:
+            flight.value = fn()
+            if self.ttl > 0:
+                self._store(key, flight.value)
+            return flight.value
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            flight.event.set()
+
+    def _store(self, key, value):
+        with self._lock:
+            self._results[key] = (time.time(), value)
+            self._results.move_to_end(key)
+            while len(self._results) > self.max_entries:
+                self._results.popitem(last = False)
+
+    def clear(self):
+        """ Forget all memoized results """
+        with self._lock:
+            self._results.clear()
+
+    def stats(self):
+        """ Returns dict of call counts """
+        with self._lock:
+            return {'calls': self.num_calls,
+                    'hits': self.num_hits,
+                    'coalesced': self.num_coalesced,
+                    'avoided': self.num_hits + self.num_coalesced}
+
+    def summary(self):
+        """ Returns the call counts as a printable string """
+        s = self.stats()
+        return "%s calls made, %s avoided (%s memoized, %s coalesced with a call in flight)" \
+            % (s['calls'], s['avoided'], s['hits'], s['coalesced'])
+
+
+# Memo shared by all functions in the gh_api package
+memo = Memoizer()
+
@@ -0,0 +1,202 @@
+from collections import deque
+from contextlib import contextmanager
+import json
+import threading
+import time
+
+
+class Histogram(object):
+    """Cumulative histogram of durations in seconds, with Prometheus-style buckets"""
+
+    def __init__(self, buckets):
+        """
+        Args:
+            buckets: Increasing bucket upper bounds in seconds
+        """
+        self.buckets = list(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        self.count = self.count + 1
+        self.sum = self.sum + seconds
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                self.counts[i] = self.counts[i] + 1
+
+    def to_dict(self):
+        return {'count': self.count,
+                'sum': self.sum,
+                'buckets': {str(bound): count for bound, count in zip(self.buckets, self.counts)}}
+
+
+class RequestMetrics(object):
+    """Instrumentation of GitHub API requests and of the other phases of a collection run.
+
+    Every request made by the transport is recorded with its endpoint class, status,
+    bytes, pycurl timing breakdown, the number of retries before it and the remaining
+    rate limit. Requests are aggregated into latency histograms per endpoint class, and
+    the most recent records are kept. Time spent outside requests, e.g. waiting on the
+    rate limit, decoding JSON or pushing to BigQuery, is recorded in histograms per phase.
+    The aggregates can be dumped as JSON or in the Prometheus text format.
+    """
+
+    default_buckets = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+    # Parts of a request's time, computed from the cumulative pycurl timings
+    request_phases = ('namelookup', 'connect', 'tls', 'server', 'transfer')
+
+    def __init__(self, buckets = default_buckets, keep_last = 1000):
+        """
+        Args:
+            buckets: Histogram bucket upper bounds in seconds
+            keep_last: Number of most recent request records kept
+        """
+        self.buckets = buckets
+        self.recent = deque(maxlen = keep_last)
+        self._endpoints = {}
+        self._phases = {}
+        self._remaining = None
+        self._lock = threading.Lock()
+
+    def _endpoint(self, endpoint):
+        if endpoint not in self._endpoints:
+            self._endpoints[endpoint] = {'latency': Histogram(self.buckets),
+                                         'phases': {phase: 0.0 for phase in self.request_phases},
+                                         'statuses': {},
+                                         'bytes': 0,
+                                         'retries': 0}
+        return self._endpoints[endpoint]
+
+    def observe_request(self, endpoint, status, wire_bytes, timings, retries = 0, remaining = None):
+        """ Record one request
+
+        Args:
+            endpoint: Endpoint class, e.g. 'commits'
+            status: HTTP status code
+            wire_bytes: Bytes received
+            timings: Dict of cumulative pycurl times in seconds with keys namelookup,
+                     connect, appconnect, starttransfer and total
+            retries: Number of retries of this request before this attempt
+            remaining: Remaining rate limit reported by the response, if any
+        """
+        connected = max(timings['connect'], timings['appconnect'])
+        phases = {'namelookup': timings['namelookup'],
+                  'connect': timings['connect'] - timings['namelookup'],
+                  'tls': max(0.0, timings['appconnect'] - timings['connect']),
+                  'server': max(0.0, timings['starttransfer'] - connected),
+                  'transfer': max(0.0, timings['total'] - timings['starttransfer'])}
+        record = {'time': time.time(),
+                  'endpoint': endpoint,
+                  'status': status,
+                  'bytes': wire_bytes,
+                  'total': timings['total'],
+                  'retries': retries,
+                  'remaining': remaining}
+        record.update(phases)
+        with self._lock:
+            stats = self._endpoint(endpoint)
+            stats['latency'].observe(timings['total'])
+            for phase, seconds in phases.items():
+                stats['phases'][phase] = stats['phases'][phase] + seconds
+            stats['statuses'][status] = stats['statuses'].get(status, 0) + 1
+            stats['bytes'] = stats['bytes'] + wire_bytes
+            if retries > 0:
+                stats['retries'] = stats['retries'] + 1
+            if remaining is not None:
+                self._remaining = remaining
+            self.recent.append(record)
+
+    def observe_phase(self, phase, seconds):
+        """ Record time spent in a phase outside requests, e.g. 'rate_limit_wait' """
+        with self._lock:
+            if phase not in self._phases:
+                self._phases[phase] = Histogram(self.buckets)
+            self._phases[phase].observe(seconds)
+
+    @contextmanager
+    def timer(self, phase):
+        """ Context manager that records the time spent in its body under a phase """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.observe_phase(phase, time.time() - start)
+
+    def snapshot(self):
+        """ Returns the aggregates and recent request records as a dict """
+        with self._lock:
+            endpoints = {endpoint: {'latency': stats['latency'].to_dict(),
+                                    'phases': dict(stats['phases']),
+                                    'statuses': {str(status): n for status, n in stats['statuses'].items()},
+                                    'bytes': stats['bytes'],
+                                    'retried_requests': stats['retries']}
+                         for endpoint, stats in self._endpoints.items()}
+            return {'endpoints': endpoints,
+                    'phases': {phase: h.to_dict() for phase, h in self._phases.items()},
+                    'rate_limit_remaining': self._remaining,
+                    'recent': list(self.recent)}
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent = 2)
+
+    def to_prometheus(self):
+        """ Returns the aggregates in the Prometheus text exposition format """
+        snap = self.snapshot()
+        lines = []
+
+        def histogram(name, label, value, h):
+            for bound, count in h['buckets'].items():
+                lines.append('%s_bucket{%s="%s",le="%s"} %s' % (name, label, value, bound, count))
+            lines.append('%s_bucket{%s="%s",le="+Inf"} %s' % (name, label, value, h['count']))
+            lines.append('%s_sum{%s="%s"} %s' % (name, label, value, h['sum']))
+            lines.append('%s_count{%s="%s"} %s' % (name, label, value, h['count']))
+
+        lines.append("# HELP gh_api_request_duration_seconds GitHub API request duration by endpoint class")
+        lines.append("# TYPE gh_api_request_duration_seconds histogram")
+        for endpoint, stats in sorted(snap['endpoints'].items()):
+            histogram("gh_api_request_duration_seconds", "endpoint", endpoint, stats['latency'])
+        lines.append("# HELP gh_api_request_phase_seconds_total Time in each part of GitHub API requests")
+        lines.append("# TYPE gh_api_request_phase_seconds_total counter")
+        for endpoint, stats in sorted(snap['endpoints'].items()):
+            for phase, seconds in sorted(stats['phases'].items()):
+                lines.append('gh_api_request_phase_seconds_total{endpoint="%s",phase="%s"} %s'
+                             % (endpoint, phase, seconds))
+        lines.append("# HELP gh_api_requests_total GitHub API requests by endpoint class and status")
+        lines.append("# TYPE gh_api_requests_total counter")
+        for endpoint, stats in sorted(snap['endpoints'].items()):
+            for status, n in sorted(stats['statuses'].items()):
+                lines.append('gh_api_requests_total{endpoint="%s",status="%s"} %s' % (endpoint, status, n))
+        lines.append("# HELP gh_api_response_bytes_total Bytes received by endpoint class")
+        lines.append("# TYPE gh_api_response_bytes_total counter")
+        for endpoint, stats in sorted(snap['endpoints'].items()):
+            lines.append('gh_api_response_bytes_total{endpoint="%s"} %s' % (endpoint, stats['bytes']))
+        lines.append("# HELP gh_api_retried_requests_total Requests that were retries, by endpoint class")
+        lines.append("# TYPE gh_api_retried_requests_total counter")
+        for endpoint, stats in sorted(snap['endpoints'].items()):
+            lines.append('gh_api_retried_requests_total{endpoint="%s"} %s' % (endpoint, stats['retried_requests']))
+        lines.append("# HELP gh_api_phase_duration_seconds Time spent outside requests by phase")
+        lines.append("# TYPE gh_api_phase_duration_seconds histogram")
+        for phase, h in sorted(snap['phases'].items()):
+            histogram("gh_api_phase_duration_seconds", "phase", phase, h)
+        if snap['rate_limit_remaining'] is not None:
+            lines.append("# HELP gh_api_rate_limit_remaining Remaining rate limit in the last response")
+            lines.append("# TYPE gh_api_rate_limit_remaining gauge")
+            lines.append("gh_api_rate_limit_remaining %s" % snap['rate_limit_remaining'])
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path, fmt = 'json'):
+        """ Write the metrics to a file
+
+        Args:
+            path: Output file, replaced if it exists
+            fmt: 'json' or 'prometheus'
+        """
+        text = self.to_prometheus() if fmt == 'prometheus' else self.to_json()
+        with open(path, "w") as f:
+            f.write(text)
+
+
+# Metrics recorded by all functions in the gh_api package
+metrics = RequestMetrics()
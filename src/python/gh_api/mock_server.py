@@ -0,0 +1,539 @@
+""" Local mock of the GitHub API for offline profiling and load testing of the collectors.
+
+The server answers the endpoints the gh_api package uses with synthetic repos of a
+configurable size, or with the responses on a cassette recorded from the real API.
+Like GitHub, it paginates listings with Link headers, tags responses with ETags and
+answers matching conditional requests with 304 Not Modified, counts requests against a
+rate limit reported in X-RateLimit headers, and refuses requests once the limit is used
+up until the window resets. Latency can be injected into every response.
+
+Run it with e.g.
+
+    python -m gh_api.mock_server --port 8000 --latency 0.2
+
+and point a collector at it with --gh_api_url http://127.0.0.1:8000.
+"""
+
+import argparse
+import base64
+import calendar
+import gzip
+import hashlib
+import io
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import json
+import random
+import re
+from socketserver import ThreadingMixIn
+import tarfile
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+import zlib
+
+from .archive import git_blob_sha
+from .cassette import Cassette
+
+
+def fake_sha(*parts):
+    """ Returns a deterministic 40 character hex digest of the parts """
+    return hashlib.sha1("/".join(str(part) for part in parts).encode()).hexdigest()
+
+
+class MockGitHubHandler(BaseHTTPRequestHandler):
+    """Passes each request to the MockGitHubServer and writes its response"""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self._respond(None)
+
+    def do_POST(self):
+        self._respond(self.rfile.read(int(self.headers.get("Content-Length", 0))).decode())
+
+    def _respond(self, data):
+        status, headers, body = self.server.mock.respond(self.path, dict(self.headers.items()), data)
+        if "gzip" in self.headers.get("Accept-Encoding", "") and len(body) > 1024:
+            body = gzip.compress(body)
+            headers["Content-Encoding"] = "gzip"
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class MockGitHubServer(object):
+    """Mock GitHub API server running on a background thread.
+
+    Every repo exists except those listed as missing, and all repos have the same shape:
+    commits_per_repo commits, pull_requests_per_repo pull requests, and a root directory
+    holding files_per_dir files plus dirs_per_repo subdirectories of files_per_dir files.
+    Each file was touched by one in ten commits, which list it among their changed files.
+    Requests found on the cassette, if one is given, are answered from it instead.
+    """
+
+    def __init__(self, port = 0, cassette_path = None, latency = 0.0, jitter = 0.0, rate_limit = 5000,
+                 window = 60 * 60, commits_per_repo = 250, pull_requests_per_repo = 30, dirs_per_repo = 5,
+                 files_per_dir = 10, missing_repos = (), renamed_repos = None, max_tree_entries = 100000,
+                 default_branches = None, max_commit_files = 300):
+        """
+        Args:
+            port: Port to listen on; 0 picks a free port
+            cassette_path: Optional cassette of recorded responses to serve
+            latency: Seconds added to every response
+            jitter: Maximum random seconds added on top of latency
+            rate_limit: Requests allowed per window
+            window: Length of the rate limit window in seconds
+            commits_per_repo: Number of commits in each repo
+            pull_requests_per_repo: Number of pull requests in each repo
+            dirs_per_repo: Number of subdirectories of the root directory
+            files_per_dir: Number of files in each directory
+            missing_repos: Repo names that return 404 Not Found
+            renamed_repos: Dict from old to new repo names; requests for an old name are
+                           redirected to /repositories/<id> of the new one, like GitHub does
+            max_tree_entries: Number of entries after which recursive git tree listings are truncated
+            default_branches: Dict from repo name to default branch name, for repos whose
+                              default branch is not 'master'
+            max_commit_files: Number of changed files per page of a commit, after which the
+                              files are paginated like GitHub's
+        """
+        self.cassette = Cassette(cassette_path) if cassette_path is not None else None
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit = rate_limit
+        self.window = window
+        self.commits_per_repo = commits_per_repo
+        self.pull_requests_per_repo = pull_requests_per_repo
+        self.dirs_per_repo = dirs_per_repo
+        self.files_per_dir = files_per_dir
+        self.missing_repos = set(missing_repos)
+        self.renamed_repos = dict(renamed_repos or {})
+        self.max_tree_entries = max_tree_entries
+        self.default_branches = dict(default_branches or {})
+        self.max_commit_files = max_commit_files
+        self.repo_ids = {zlib.crc32(name.encode()): name for name in self.renamed_repos.values()}
+        self.num_requests = 0
+        self.num_not_modified = 0
+        self.num_rate_limited = 0
+        self._remaining = rate_limit
+        self._reset = int(time.time()) + window
+        self._lock = threading.Lock()
+        self._server = _ThreadingHTTPServer(("127.0.0.1", port), MockGitHubHandler)
+        self._server.mock = self
+        self._thread = None
+
+    @property
+    def url(self):
+        """ Base URL of the server, to pass as --gh_api_url """
+        return "http://127.0.0.1:%s" % self._server.server_port
+
+    def start(self):
+        """ Start serving on a background thread and return self """
+        self._thread = threading.Thread(target = self._server.serve_forever, args = (0.05,), daemon = True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        """ Serve on the calling thread until interrupted """
+        self._server.serve_forever()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _rate_limit_headers(self, count):
+        """ Count a request against the limit if count is true, and return the rate limit headers """
+        now = time.time()
+        with self._lock:
+            if now >= self._reset:
+                self._remaining = self.rate_limit
+                self._reset = int(now) + self.window
+            if count and self._remaining > 0:
+                self._remaining = self._remaining - 1
+            return {"X-RateLimit-Limit": str(self.rate_limit),
+                    "X-RateLimit-Remaining": str(self._remaining),
+                    "X-RateLimit-Reset": str(self._reset),
+                    "X-RateLimit-Used": str(self.rate_limit - self._remaining),
+                    "X-RateLimit-Resource": "core"}
+
+    def respond(self, path, request_headers, data = None):
+        """ Returns (status, headers, body) for a request
+
+        Args:
+            path: Request path including any query
+            request_headers: Dict of request headers
+            data: Request body for a POST request
+        """
+        if self.latency > 0 or self.jitter > 0:
+            time.sleep(self.latency + self.jitter * random.random())
+        with self._lock:
+            self.num_requests = self.num_requests + 1
+            exhausted = self._remaining <= 0 and time.time() < self._reset
+        if path == "/rate_limit":
+            headers = self._rate_limit_headers(False)
+            core = {"limit": self.rate_limit, "remaining": int(headers["X-RateLimit-Remaining"]),
+                    "reset": self._reset}
+            return 200, dict(headers, **{"Content-Type": "application/json"}), \
+                json.dumps({"resources": {"core": core}, "rate": core}).encode()
+        if exhausted:
+            with self._lock:
+                self.num_rate_limited = self.num_rate_limited + 1
+            body = json.dumps({"message": "API rate limit exceeded for user."}).encode()
+            return 403, dict(self._rate_limit_headers(False), **{"Content-Type": "application/json"}), body
+        recorded = self.cassette.play(path, data) if self.cassette is not None else None
+        if recorded is not None:
+            status, headers, body = self._relocate(*recorded)
+        elif data is not None:
+            status, headers, body = self._graphql(data)
+        else:
+            status, headers, body = self._synthetic(path)
+        headers = dict(headers)
+        etag = headers.pop("etag", None) or '"%s"' % hashlib.sha1(body).hexdigest()
+        if status == 200 and request_headers.get("If-None-Match") == etag:
+            with self._lock:
+                self.num_not_modified = self.num_not_modified + 1
+            # Like GitHub, a 304 does not count against the rate limit
+            return 304, dict(self._rate_limit_headers(False), ETag = etag), b""
+        headers.update(self._rate_limit_headers(True))
+        headers.setdefault("Content-Type", "application/json; charset=utf-8")
+        if status == 200:
+            headers["ETag"] = etag
+        return status, headers, body
+
+    def _relocate(self, status, headers, body):
+        """ Point the URLs in a recorded response at this server and drop its rate limit headers """
+        headers = {name: value for name, value in headers.items() if not name.startswith("x-ratelimit")}
+        if "link" in headers:
+            headers["link"] = re.sub(r"<https?://[^/]+", "<%s" % self.url, headers["link"])
+        return status, headers, re.sub(rb"https://api\.github\.com", self.url.encode(), body)
+
+    def _synthetic(self, path):
+        """ Returns (status, headers, body) of a synthetic response """
+        parsed = urlparse(path)
+        query = {key: values[-1] for key, values in parse_qs(parsed.query).items()}
+        match = re.match(r"^/repositories/(\d+)(/.*)?$", parsed.path)
+        if match is not None:
+            if int(match.group(1)) not in self.repo_ids:
+                return self._json(404, {"message": "Not Found"})
+            repo_name = self.repo_ids[int(match.group(1))]
+            rest = match.group(2) or ""
+        elif parsed.path.startswith("/_codeload/"):
+            return self.tarball(*parsed.path[len("/_codeload/"):].split("/tar.gz/"))
+        else:
+            match = re.match(r"^/repos/([^/]+)/([^/]+)(/.*)?$", parsed.path)
+            if match is None:
+                return self._json(404, {"message": "Not Found"})
+            repo_name = "%s/%s" % (match.group(1), match.group(2))
+            rest = match.group(3) or ""
+        if repo_name in self.missing_repos:
+            return self._json(404, {"message": "Not Found"})
+        if repo_name in self.renamed_repos:
+            new_name = self.renamed_repos[repo_name]
+            location = "%s/repositories/%s%s%s" % (self.url, zlib.crc32(new_name.encode()), rest,
+                                                   "?%s" % parsed.query if parsed.query else "")
+            return self._json(301, {"message": "Moved Permanently", "url": location}, {"Location": location})
+        base = "%s/repos/%s" % (self.url, repo_name)
+        if rest == "":
+            return self._json(200, self.repo(repo_name))
+        if rest == "/commits/%s" % self.default_branch(repo_name):
+            return self._json(200, self.commit(repo_name, 0))
+        match = re.match(r"^/commits/([0-9a-f]{40})$", rest)
+        if match is not None:
+            shas = {fake_sha(repo_name, "commit", i): i for i in range(self.commits_per_repo)}
+            if match.group(1) not in shas:
+                return self._json(404, {"message": "Not Found"})
+            i = shas[match.group(1)]
+            commit = self.commit(repo_name, i)
+            files = [{"filename": path, "status": "modified"} for path, content in self.files(repo_name)
+                     if zlib.crc32(path.encode()) % 10 == i % 10]
+            # Each page repeats the commit with the next files
+            page = int(query.get("page", 1))
+            last = max(1, (len(files) + self.max_commit_files - 1) // self.max_commit_files)
+            commit["files"] = files[(page - 1) * self.max_commit_files:page * self.max_commit_files]
+            return self._json(200, commit, self._page_links(path, page, last))
+        if rest == "/commits":
+            indices = range(self.commits_per_repo)
+            if "path" in query:
+                offset = zlib.crc32(query["path"].encode()) % 10
+                indices = [i for i in indices if i % 10 == offset]
+            if "since" in query:
+                since = calendar.timegm(time.strptime(query["since"], "%Y-%m-%dT%H:%M:%SZ"))
+                indices = [i for i in indices if self.commit_time(i) >= since]
+            return self._page(path, query, [self.commit(repo_name, i) for i in indices])
+        if rest == "/pulls":
+            # Pull request 0 is the newest and the most recently updated
+            pulls = [self.pull_request(repo_name, i) for i in range(self.pull_requests_per_repo)]
+            if query.get("direction") == "asc":
+                pulls.reverse()
+            return self._page(path, query, pulls)
+        if rest == "/contributors":
+            return self._page(path, query, [{"login": "dev%s" % i, "id": i, "contributions": 10 - i}
+                                            for i in range(min(5, self.commits_per_repo))])
+        if rest == "/languages":
+            return self._json(200, {"Python": 1000 * len(repo_name), "R": 100 * len(repo_name)})
+        if rest == "/license":
+            return self._json(200, {"license": {"key": "mit", "name": "MIT License"}})
+        if rest.startswith("/contents"):
+            listing = self.directory(repo_name, rest[len("/contents/"):] if rest != "/contents" else "")
+            if listing is None:
+                return self._json(404, {"message": "Not Found"})
+            return self._json(200, listing)
+        match = re.match(r"^/git/trees/([^/]+)$", rest)
+        if match is not None:
+            tree = self.tree(repo_name, match.group(1), query.get("recursive") == "1")
+            if tree is None:
+                return self._json(404, {"message": "Not Found"})
+            return self._json(200, tree)
+        match = re.match(r"^/git/blobs/([0-9a-f]+)$", rest)
+        if match is not None:
+            contents = {git_blob_sha(content): content for path, content in self.files(repo_name)}
+            if match.group(1) not in contents:
+                return self._json(404, {"message": "Not Found"})
+            content = contents[match.group(1)]
+            return self._json(200, {"sha": match.group(1), "size": len(content), "encoding": "base64",
+                                    "content": base64.b64encode(content).decode(), "url": "%s%s" % (base, rest)})
+        match = re.match(r"^/tarball/([^/]+)$", rest)
+        if match is not None:
+            # Like GitHub, redirect to the download host, here a path on this server
+            location = "%s/_codeload/%s/tar.gz/%s" % (self.url, repo_name, match.group(1))
+            return 302, {"Location": location}, b""
+        return self._json(404, {"message": "Not Found"})
+
+    def _json(self, status, obj, headers = None):
+        return status, dict(headers or {}), json.dumps(obj).encode()
+
+    def _page(self, path, query, records):
+        """ Returns one page of a listing with a Link header like GitHub's """
+        per_page = min(100, int(query.get("per_page", 30)))
+        page = int(query.get("page", 1))
+        last = max(1, (len(records) + per_page - 1) // per_page)
+        return self._json(200, records[(page - 1) * per_page:page * per_page], self._page_links(path, page, last))
+
+    def _page_links(self, path, page, last):
+        """ Returns the headers with the Link header of page number page of last pages """
+        headers = {}
+        if last > 1:
+            parsed = urlparse(path)
+            params = [param for param in parsed.query.split("&") if param and not param.startswith("page=")]
+
+            def page_url(n):
+                return "%s%s?%s" % (self.url, parsed.path, "&".join(params + ["page=%s" % n]))
+            links = []
+            if page < last:
+                links = links + ['<%s>; rel="next"' % page_url(page + 1), '<%s>; rel="last"' % page_url(last)]
+            if page > 1:
+                links = links + ['<%s>; rel="first"' % page_url(1), '<%s>; rel="prev"' % page_url(page - 1)]
+            headers["Link"] = ", ".join(links)
+        return headers
+
+    def repo(self, repo_name):
+        """ Returns the synthetic repos endpoint response for a repo """
+        return {"full_name": repo_name,
+                "url": "%s/repos/%s" % (self.url, repo_name),
+                "html_url": "https://github.com/%s" % repo_name,
+                "description": "Mock repository %s" % repo_name,
+                "fork": False,
+                "stargazers_count": len(repo_name),
+                "watchers_count": len(repo_name),
+                "forks_count": 2,
+                "open_issues": 3,
+                "subscribers_count": 4,
+                "default_branch": self.default_branch(repo_name)}
+
+    def default_branch(self, repo_name):
+        """ Returns the name of the default branch of a repo """
+        return self.default_branches.get(repo_name, "master")
+
+    def commit_time(self, i):
+        """ Returns the time of synthetic commit number i in seconds since the epoch; commits are an hour apart """
+        return 1500000000 - 3600 * i
+
+    def commit(self, repo_name, i):
+        """ Returns synthetic commit number i of a repo; commit 0 is the newest """
+        sha = fake_sha(repo_name, "commit", i)
+        date = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(self.commit_time(i)))
+        person = {"login": "dev%s" % (i % 5), "id": i % 5, "url": "%s/users/dev%s" % (self.url, i % 5),
+                  "html_url": "https://github.com/dev%s" % (i % 5), "type": "User"}
+        signature = {"name": "Developer %s" % (i % 5), "email": "dev%s@example.com" % (i % 5), "date": date}
+        return {"sha": sha,
+                "url": "%s/repos/%s/commits/%s" % (self.url, repo_name, sha),
+                "html_url": "https://github.com/%s/commit/%s" % (repo_name, sha),
+                "comments_url": "%s/repos/%s/commits/%s/comments" % (self.url, repo_name, sha),
+                "commit": {"message": "Commit %s" % i, "comment_count": 0,
+                           "author": signature, "committer": signature},
+                "author": person,
+                "committer": person}
+
+    def pull_request(self, repo_name, i):
+        """ Returns synthetic pull request number i of a repo """
+        return {"id": zlib.crc32(("%s/%s" % (repo_name, i)).encode()),
+                "number": i + 1,
+                "state": "closed" if i % 3 else "open",
+                "url": "%s/repos/%s/pulls/%s" % (self.url, repo_name, i + 1),
+                "html_url": "https://github.com/%s/pull/%s" % (repo_name, i + 1),
+                "title": "Pull request %s" % i,
+                "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(self.commit_time(i))),
+                "updated_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(self.commit_time(i) + 60)),
+                "body": "Changes number %s" % i,
+                "user": {"login": "dev%s" % (i % 5), "id": i % 5}}
+
+    def directory(self, repo_name, path):
+        """ Returns the synthetic contents listing of a directory, or None if there is no such directory """
+        if path == "":
+            names = [("d%s" % i, "dir") for i in range(self.dirs_per_repo)]
+        elif re.match(r"^d\d+$", path) and int(path[1:]) < self.dirs_per_repo:
+            names = []
+        else:
+            return None
+        names = names + [("file%s.py" % i, "file") for i in range(self.files_per_dir)]
+        rtrn = []
+        for name, tp in names:
+            file_path = "%s/%s" % (path, name) if path else name
+            if tp == "dir":
+                sha = fake_sha(repo_name, file_path)
+            else:
+                sha = git_blob_sha(self.file_content(repo_name, file_path))
+            rtrn.append({"name": name,
+                         "path": file_path,
+                         "sha": sha,
+                         "size": 0 if tp == "dir" else len(self.file_content(repo_name, file_path)),
+                         "url": "%s/repos/%s/contents/%s" % (self.url, repo_name, file_path),
+                         "html_url": "https://github.com/%s/blob/master/%s" % (repo_name, file_path),
+                         "git_url": "%s/repos/%s/git/%s/%s" % (self.url, repo_name,
+                                                               "trees" if tp == "dir" else "blobs", sha),
+                         "download_url": None if tp == "dir" else
+                         "https://raw.githubusercontent.com/%s/master/%s" % (repo_name, file_path),
+                         "type": tp})
+        return rtrn
+
+    def file_content(self, repo_name, path):
+        """ Returns the synthetic contents of a file as bytes """
+        return ("# file %s in %s\n" % (path, repo_name)).encode()
+
+    def files(self, repo_name):
+        """ Returns list of (path, contents) of all files in a repo """
+        paths = [record["path"] for record in self.directory(repo_name, "") if record["type"] == "file"]
+        for i in range(self.dirs_per_repo):
+            paths = paths + [record["path"] for record in self.directory(repo_name, "d%s" % i)]
+        return [(path, self.file_content(repo_name, path)) for path in paths]
+
+    def tarball(self, repo_name, ref):
+        """ Returns the response for a download of a repo's archive, laid out like GitHub's """
+        if repo_name in self.missing_repos or "/" not in repo_name:
+            return self._json(404, {"message": "Not Found"})
+        top = "%s-%s" % (repo_name.replace("/", "-"), ref[:7])
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj = buffer, mode = "w:gz") as archive:
+            for path, content in self.files(repo_name):
+                info = tarfile.TarInfo("%s/%s" % (top, path))
+                info.size = len(content)
+                archive.addfile(info, io.BytesIO(content))
+        return 200, {"Content-Type": "application/x-gzip"}, buffer.getvalue()
+
+    def tree(self, repo_name, tree_sha, recursive):
+        """ Returns the synthetic git trees response for the tree of a subdirectory, given its sha,
+        or of the root directory, given its sha, a commit sha or the default branch name.
+        Returns None for any other sha or branch name.
+        """
+        subdirs = {fake_sha(repo_name, "d%s" % i): "d%s" % i for i in range(self.dirs_per_repo)}
+        roots = {fake_sha(repo_name, "tree"), self.default_branch(repo_name)}
+        roots.update(fake_sha(repo_name, "commit", i) for i in range(self.commits_per_repo))
+        if tree_sha not in subdirs and tree_sha not in roots:
+            return None
+        root = subdirs.get(tree_sha, "")
+        entries = []
+        pending = [root]
+        while pending:
+            path = pending.pop(0)
+            for record in self.directory(repo_name, path):
+                tp = "tree" if record["type"] == "dir" else "blob"
+                entry = {"path": record["path"][len(root) + 1:] if root else record["path"],
+                         "mode": "040000" if tp == "tree" else "100644",
+                         "type": tp,
+                         "sha": record["sha"],
+                         "url": record["git_url"]}
+                if tp == "blob":
+                    entry["size"] = record["size"]
+                entries.append(entry)
+                if tp == "tree" and recursive:
+                    pending.append(record["path"])
+        truncated = recursive and len(entries) > self.max_tree_entries
+        sha = fake_sha(repo_name, root) if root else fake_sha(repo_name, "tree")
+        return {"sha": sha,
+                "url": "%s/repos/%s/git/trees/%s" % (self.url, repo_name, sha),
+                "tree": entries[:self.max_tree_entries] if truncated else entries,
+                "truncated": truncated}
+
+    def _graphql(self, data):
+        """ Returns the response to a repo metadata query from gh_api.graphql """
+        query = json.loads(data)["query"]
+        result = {}
+        errors = []
+        for alias, owner, name in re.findall(r'(r\d+): repository\(owner: "(.*?)", name: "(.*?)"\)', query):
+            repo_name = "%s/%s" % (owner, name)
+            if repo_name in self.missing_repos:
+                result[alias] = None
+                errors.append({"type": "NOT_FOUND", "path": [alias],
+                               "message": "Could not resolve to a Repository with the name '%s'." % repo_name})
+                continue
+            rest = self.repo(repo_name)
+            result[alias] = {"nameWithOwner": repo_name,
+                             "url": rest["html_url"],
+                             "description": rest["description"],
+                             "isFork": rest["fork"],
+                             "forkCount": rest["forks_count"],
+                             "stargazers": {"totalCount": rest["stargazers_count"]},
+                             "watchers": {"totalCount": rest["subscribers_count"]},
+                             "issues": {"totalCount": rest["open_issues"] - 1},
+                             "pullRequests": {"totalCount": 1},
+                             "licenseInfo": {"key": "mit"},
+                             "languages": {"edges": [{"size": 1000 * len(repo_name), "node": {"name": "Python"}},
+                                                     {"size": 100 * len(repo_name), "node": {"name": "R"}}]},
+                             "defaultBranchRef": {"target": {"oid": fake_sha(repo_name, "commit", 0)}}}
+        body = {"data": result}
+        if errors:
+            body["errors"] = errors
+        return self._json(200, body)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Mock GitHub API server")
+    parser.add_argument('--port', action = 'store', dest = 'port', type = int, default = 8000,
+                        help = 'Port to listen on')
+    parser.add_argument('--cassette', action = 'store', dest = 'cassette', required = False,
+                        help = 'Cassette of recorded responses to serve')
+    parser.add_argument('--latency', action = 'store', dest = 'latency', type = float, default = 0,
+                        help = 'Seconds added to every response')
+    parser.add_argument('--jitter', action = 'store', dest = 'jitter', type = float, default = 0,
+                        help = 'Maximum random seconds added on top of the latency')
+    parser.add_argument('--rate_limit', action = 'store', dest = 'rate_limit', type = int, default = 5000,
+                        help = 'Requests allowed per rate limit window')
+    parser.add_argument('--window', action = 'store', dest = 'window', type = int, default = 60 * 60,
+                        help = 'Length of the rate limit window in seconds')
+    parser.add_argument('--commits', action = 'store', dest = 'commits', type = int, default = 250,
+                        help = 'Number of commits in each repo')
+    parser.add_argument('--pull_requests', action = 'store', dest = 'pull_requests', type = int, default = 30,
+                        help = 'Number of pull requests in each repo')
+    parser.add_argument('--dirs', action = 'store', dest = 'dirs', type = int, default = 5,
+                        help = 'Number of subdirectories in each repo')
+    parser.add_argument('--files', action = 'store', dest = 'files', type = int, default = 10,
+                        help = 'Number of files in each directory')
+    args = parser.parse_args()
+    server = MockGitHubServer(args.port, args.cassette, args.latency, args.jitter, args.rate_limit, args.window,
+                              args.commits, args.pull_requests, args.dirs, args.files)
+    print("Mock GitHub API listening on %s" % server.url)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
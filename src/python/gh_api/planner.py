@@ -0,0 +1,169 @@
+import math
+import time
+
+from . import async_requests
+from . import requests
+from . import transport
+from util.gh_api_util import api_rate_limit_per_hour, gh_userpwd
+
+
+# Per-repo counts assumed when there are no stored counts to estimate from
+default_commits_per_repo = 300
+default_pull_requests_per_repo = 30
+default_dirs_per_repo = 15
+
+# Typical seconds for one GitHub API request including transfer, used for the latency bound
+default_seconds_per_request = 0.5
+
+
+def num_pages(num_records, per_page = requests.max_per_page):
+    """ Number of pages needed to list num_records records; an empty listing still takes one page """
+    return max(1, int(math.ceil(num_records / per_page)))
+
+
+def get_budget(gh_username, gh_oauth_key):
+    """ Returns the current GitHub API budget as a dict with keys limit, remaining, reset and keys
+    Queries the rate_limit endpoint, which does not count against the limit. If a credential
+    pool is set, the budget is summed over its keys and reset is the latest reset time.
+
+    Args:
+        gh_username: GitHub username for GitHub API
+        gh_oauth_key: (String) GitHub oauth key
+    """
+    url = requests.url_repos.rsplit("/repos", 1)[0] + "/rate_limit"
+    pool = transport.credential_pool
+    credentials = [(gh_username, gh_oauth_key)] if pool is None \
+        else [(c.gh_username, c.gh_oauth_key) for c in pool.credentials]
+    budget = {'limit': 0, 'remaining': 0, 'reset': None, 'keys': len(credentials)}
+    for username, key in credentials:
+        response = transport.get_response(url, gh_userpwd(username, key))
+        try:
+            core = transport.parse_json(response.body)["resources"]["core"]
+            limit, remaining, reset = core["limit"], core["remaining"], core["reset"]
+        except (ValueError, KeyError, TypeError):
+            limit, remaining, reset = api_rate_limit_per_hour, api_rate_limit_per_hour, None
+        budget['limit'] = budget['limit'] + limit
+        budget['remaining'] = budget['remaining'] + remaining
+        if reset is not None:
+            budget['reset'] = reset if budget['reset'] is None else max(budget['reset'], reset)
+    return budget
+
+
+class CrawlPlan(object):
+    """Estimated GitHub API cost of one collection run.
+
+    A plan is a list of steps, each a number of requests of one kind. Given the current
+    budget, the concurrency and the time per request, it works out the schedule: how many
+    requests run in each rate limit window, and when the run is expected to finish.
+    """
+
+    def __init__(self, stage, num_items, item_name = "repos"):
+        """
+        Args:
+            stage: Name of the collection stage, e.g. 'gh_api_commits'
+            num_items: Number of items the run will process
+            item_name: Plural name of the items, e.g. 'repos' or 'files'
+        """
+        self.stage = stage
+        self.num_items = num_items
+        self.item_name = item_name
+        self.steps = []
+
+    def add(self, description, num_requests, num_pages = 0):
+        """ Add a step to the plan
+
+        Args:
+            description: What the requests fetch
+            num_requests: Estimated number of requests
+            num_pages: How many of the requests fetch pages of paginated listings
+        """
+        self.steps.append((description, int(math.ceil(num_requests)), int(math.ceil(num_pages))))
+
+    def num_requests(self):
+        return sum(step[1] for step in self.steps)
+
+    def num_pages(self):
+        return sum(step[2] for step in self.steps)
+
+    def schedule(self, budget, concurrency = 1, seconds_per_request = default_seconds_per_request, now = None):
+        """ Returns list of dicts, one per rate limit window the run spans, with keys start, end,
+        requests and items (cumulative number of items finished by the end of the window)
+
+        Requests in a window are limited both by the budget and by how many requests the
+        concurrency allows in the window's length. The first window runs until the current
+        reset; each later window is one hour with the full limit of every key.
+
+        Args:
+            budget: Dict as returned by get_budget
+            concurrency: Number of requests in flight at once
+            seconds_per_request: Time one request takes
+            now: Start time in seconds since the epoch (default: current time)
+        """
+        now = time.time() if now is None else now
+        requests_per_sec = concurrency / seconds_per_request
+        total = self.num_requests()
+        windows = []
+        done = 0
+        start = now
+        if budget['reset'] is not None and budget['reset'] > now:
+            length = budget['reset'] - now
+            capacity = min(budget['remaining'], int(requests_per_sec * length))
+        else:
+            length = 60 * 60
+            capacity = min(budget['limit'], int(requests_per_sec * length))
+        while done < total:
+            num = min(capacity, total - done)
+            done = done + num
+            end = start + length if done < total else start + num / requests_per_sec
+            windows.append({'start': start,
+                            'end': end,
+                            'requests': num,
+                            'items': int(self.num_items * done / total)})
+            start = start + length
+            length = 60 * 60
+            capacity = min(budget['limit'], int(requests_per_sec * length))
+        return windows
+
+    def report(self, budget, concurrency = 1, seconds_per_request = default_seconds_per_request, now = None,
+               max_windows = 24):
+        """ Returns the plan and its schedule as a printable string
+
+        Args:
+            budget: Dict as returned by get_budget
+            concurrency: Number of requests in flight at once
+            seconds_per_request: Time one request takes
+            now: Start time in seconds since the epoch (default: current time)
+            max_windows: Maximum number of schedule windows to list
+        """
+        now = time.time() if now is None else now
+        windows = self.schedule(budget, concurrency, seconds_per_request, now)
+        hours = (windows[-1]['end'] - now) / 3600 if windows else 0
+        lines = ["Plan for %s: %s %s" % (self.stage, self.num_items, self.item_name)]
+        for description, num_requests, num_pages in self.steps:
+            lines.append("  %10d requests (%d pages)\t%s" % (num_requests, num_pages, description))
+        lines.append("  %10d requests (%d pages)\ttotal" % (self.num_requests(), self.num_pages()))
+        lines.append("Budget: %s of %s requests remaining over %s keys; concurrency %s at %.2f s per request"
+                     % (budget['remaining'], budget['limit'], budget['keys'], concurrency, seconds_per_request))
+        lines.append("Estimated wall clock: %.1f hours in %s rate limit windows" % (hours, len(windows)))
+        for i, window in enumerate(windows[:max_windows]):
+            lines.append("  %s - %s\t%8d requests\t%s/%s %s done"
+                         % (time.strftime("%Y-%m-%d %H:%M", time.localtime(window['start'])),
+                            time.strftime("%H:%M", time.localtime(window['end'])),
+                            window['requests'], window['items'], self.num_items, self.item_name))
+        if len(windows) > max_windows:
+            lines.append("  ... %s more windows" % (len(windows) - max_windows))
+        saturating = int(math.ceil(budget['limit'] * seconds_per_request / 3600))
+        lines.append("Concurrency above %s does not help at this budget; each additional key adds %s requests per hour"
+                     % (max(1, saturating), budget['limit'] // max(1, budget['keys'])))
+        return "\n".join(lines)
+
+
+def print_plan(plan, gh_username, gh_oauth_key):
+    """ Print a plan with its schedule under the current budget and concurrency
+
+    Args:
+        plan: CrawlPlan
+        gh_username: GitHub username for GitHub API
+        gh_oauth_key: (String) GitHub oauth key
+    """
+    print(plan.report(get_budget(gh_username, gh_oauth_key), async_requests.concurrency))
@@ -0,0 +1,130 @@
+import json
+import os
+import threading
+import time
+
+from util.gh_api_util import api_rate_limit_per_hour
+
+
+class RateLimiter(object):
+    """Adaptive GitHub API rate limiter driven by the X-RateLimit-* response headers.
+
+    Requests go out at full speed while plenty of budget remains. Once the remaining
+    budget drops to the reserve, requests are spread evenly over the time left until
+    the reset. When the budget is gone, requests block until the reset time.
+    """
+
+    def __init__(self, reserve = 100, state_file = None, state_interval = 5):
+        """
+        Args:
+            reserve: Remaining request count below which requests are paced
+            state_file: Optional JSON file the current state is written to, so that
+                        other processes can see how much budget is left
+            state_interval: Minimum number of seconds between writes of the state file
+        """
+        self.reserve = reserve
+        self.state_file = state_file
+        self.state_interval = state_interval
+        self.limit = api_rate_limit_per_hour
+        self.remaining = None
+        self.reset = None
+        self.num_waits = 0
+        self.time_waited = 0.0
+        self._last_state_write = 0
+        self._lock = threading.Lock()
+
+    def delay(self, now = None):
+        """ Returns the number of seconds to wait before the next request """
+        now = time.time() if now is None else now
+        with self._lock:
+            if self.remaining is None or self.reset is None or now >= self.reset:
+                return 0.0
+            if self.remaining <= 0:
+                # Wait for the reset plus a second of slack for clock skew
+                return self.reset - now + 1
+            if self.remaining <= self.reserve:
+                return (self.reset - now) / self.remaining
+            return 0.0
+
+    def wait(self):
+        """ Block until a request can be made, then count the request against the budget """
+        delay = self.delay()
+        if delay > 0:
+            self.num_waits = self.num_waits + 1
+            self.time_waited = self.time_waited + delay
+            time.sleep(delay)
+        with self._lock:
+            if self.remaining is not None and self.remaining > 0:
+                # Count the request now so that concurrent callers see it before the response arrives
+                self.remaining = self.remaining - 1
+
+    def update(self, headers):
+        """ Update the state from the headers of a response
+        Headers for a budget other than the core REST one, e.g. GraphQL, are ignored.
+
+        Args:
+            headers: Dict of response headers with lower case names
+        """
+        if headers.get("x-ratelimit-resource", "core") != "core":
+            return
+        try:
+            remaining = int(headers["x-ratelimit-remaining"])
+            reset = int(headers["x-ratelimit-reset"])
+        except (KeyError, ValueError):
+            return
+        with self._lock:
+            if "x-ratelimit-limit" in headers:
+                self.limit = int(headers["x-ratelimit-limit"])
+            if self.reset is not None and reset == self.reset and self.remaining is not None:
+                # Same window: responses can arrive out of order, so keep the lowest count
+                self.remaining = min(self.remaining, remaining)
+            else:
+                self.remaining = remaining
+                self.reset = reset
+        self._write_state()
+
+    def exhausted(self):
+        """ Whether the budget is used up until the next reset """
+        return self.remaining is not None and self.remaining <= 0 and self.reset is not None \
+            and time.time() < self.reset
+
+    def state(self):
+        """ Returns the current state as a dict """
+        with self._lock:
+            return {'limit': self.limit,
+                    'remaining': self.remaining,
+                    'reset': self.reset,
+                    'num_waits': self.num_waits,
+                    'time_waited': self.time_waited,
+                    'pid': os.getpid(),
+                    'time': time.time()}
+
+    def _write_state(self):
+        if self.state_file is None:
+            return
+        now = time.time()
+        if now - self._last_state_write < self.state_interval:
+            return
+        self._last_state_write = now
+        tmp = "%s.%s.tmp" % (self.state_file, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(self.state(), f)
+        os.replace(tmp, self.state_file)
+
+
+def read_rate_limit_state(state_file):
+    """ Returns the state dict written by another process's RateLimiter, or None if there is none
+
+    Args:
+        state_file: The state_file of the other RateLimiter
+    """
+    try:
+        with open(state_file) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+# Rate limiter shared by all functions in the gh_api package
+rate_limiter = RateLimiter()
+
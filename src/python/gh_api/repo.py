@@ -1,4 +1,5 @@
-from gh_api import gh_curl_response, url_repos
+from gh_api import gh_curl_response
+from gh_api import requests
 
 
 class Repo(object):
@@ -13,8 +14,8 @@ class Repo(object):
 
         """
         self.repo_name = repo_name
-        self.url = "%s/%s" %(url_repos, repo_name)
-        self.response = gh_curl_response(self.url, gh_username, gh_oauth_key)
+        self.url = "%s/%s" %(requests.url_repos, repo_name)
+        self.response = gh_curl_response(self.url, gh_username, gh_oauth_key, memoize = True)
         
     def get_repo_name(self):
         return self.repo_name
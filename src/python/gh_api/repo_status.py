@@ -0,0 +1,130 @@
+import sqlite3
+import threading
+import time
+from urllib.parse import urlparse, urlunparse
+
+
+# Paths under /repos/owner/name whose 404 means the repo itself is missing. Other
+# endpoints, e.g. license, contents or commits/master, can 404 for an existing repo.
+repo_level_paths = ["", "/commits", "/pulls", "/languages", "/contributors"]
+
+
+def split_repo_url(url):
+    """ Returns (repo_name, rest of the path) for a URL under /repos/owner/name, or (None, None) """
+    parts = urlparse(url).path.split("/")
+    if len(parts) < 4 or parts[1] != "repos" or not parts[2] or not parts[3]:
+        return None, None
+    rest = "/".join(parts[4:])
+    return "%s/%s" % (parts[2], parts[3]), "/" + rest if rest else ""
+
+
+class RepoStatusCache(object):
+    """Persistent record of missing and renamed repos.
+
+    Repos whose repo-level requests returned 404 are remembered for ttl seconds; all
+    requests for them are answered with a 404 without contacting the API, so later
+    stages and re-runs do not pay for known-dead repos. Renamed repos are remembered
+    with their canonical name, and requests for the old name are sent to the new one.
+    Both are kept in a SQLite database that all stages can share.
+    """
+
+    def __init__(self, path, ttl = 7 * 24 * 60 * 60):
+        """
+        Args:
+            path: SQLite database file, created if necessary
+            ttl: Seconds a repo is considered missing after a 404
+        """
+        self.path = path
+        self.ttl = ttl
+        self.num_skipped = 0
+        self.num_rewritten = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread = False)
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS missing (
+                                repo_name TEXT PRIMARY KEY,
+                                status INTEGER,
+                                recorded REAL)""")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS renames (
+                                old_name TEXT PRIMARY KEY,
+                                new_name TEXT,
+                                recorded REAL)""")
+        self._conn.commit()
+
+    def is_missing(self, repo_name):
+        """ Whether the repo returned 404 within the last ttl seconds """
+        with self._lock:
+            row = self._conn.execute("SELECT recorded FROM missing WHERE repo_name = ?",
+                                     (repo_name.lower(),)).fetchone()
+        return row is not None and time.time() - row[0] < self.ttl
+
+    def mark_missing(self, repo_name, status = 404):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO missing VALUES (?, ?, ?)",
+                               (repo_name.lower(), status, time.time()))
+            self._conn.commit()
+
+    def canonical_name(self, repo_name):
+        """ Returns the current name of a repo, following recorded renames """
+        seen = set()
+        name = repo_name
+        with self._lock:
+            while name.lower() not in seen:
+                seen.add(name.lower())
+                row = self._conn.execute("SELECT new_name FROM renames WHERE old_name = ?", (name.lower(),)).fetchone()
+                if row is None:
+                    break
+                name = row[0]
+        return name
+
+    def record_rename(self, old_name, new_name):
+        """ Record that old_name now redirects to new_name """
+        if old_name.lower() == new_name.lower():
+            return
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO renames VALUES (?, ?, ?)",
+                               (old_name.lower(), new_name, time.time()))
+            self._conn.execute("DELETE FROM missing WHERE repo_name = ?", (new_name.lower(),))
+            self._conn.commit()
+
+    def renames(self):
+        """ Returns dict from old repo name (lower case) to canonical name """
+        with self._lock:
+            return dict(self._conn.execute("SELECT old_name, new_name FROM renames").fetchall())
+
+    def rewrite(self, url):
+        """ Returns (url, missing): the URL with a renamed repo replaced by its canonical name,
+        and whether the request can be skipped because the repo is known to be missing
+        """
+        repo_name, rest = split_repo_url(url)
+        if repo_name is None:
+            return url, False
+        canonical = self.canonical_name(repo_name)
+        if canonical != repo_name:
+            parsed = urlparse(url)
+            url = urlunparse(parsed._replace(path = "/repos/%s%s" % (canonical, rest)))
+            with self._lock:
+                self.num_rewritten = self.num_rewritten + 1
+        if self.is_missing(canonical):
+            with self._lock:
+                self.num_skipped = self.num_skipped + 1
+            return url, True
+        return url, False
+
+    def stats(self):
+        """ Returns dict of counts of skipped and rewritten requests and of known missing and renamed repos """
+        with self._lock:
+            num_missing = self._conn.execute("SELECT COUNT(*) FROM missing WHERE recorded >= ?",
+                                             (time.time() - self.ttl,)).fetchone()[0]
+            num_renamed = self._conn.execute("SELECT COUNT(*) FROM renames").fetchone()[0]
+            return {'skipped': self.num_skipped, 'rewritten': self.num_rewritten,
+                    'missing': num_missing, 'renamed': num_renamed}
+
+    def summary(self):
+        """ Returns the counts as a printable string """
+        s = self.stats()
+        return "%s requests skipped for %s known missing repos; %s requests redirected for %s renamed repos" \
+            % (s['skipped'], s['missing'], s['rewritten'], s['renamed'])
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -1,18 +1,30 @@
 import base64
-from io import BytesIO
-import json
-from json.decoder import JSONDecodeError
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from urllib.parse import parse_qs, urlparse
 
 import dateutil.parser
 
 import pycurl
-from util import gh_userpwd
-from util import sleep_gh_rate_limit
+
+from .memo import memo
+from .retry import IncompleteResponseError, request_with_retries
+from .transport import endpoint_class, gh_request, parse_json, wire_stats
 
 
 # The 'repos' endpoint
 url_repos = "https://api.github.com/repos"
 
+# Base URLs of file pages and raw file downloads, used to build file records from git trees
+url_html = "https://github.com"
+url_raw = "https://raw.githubusercontent.com"
+
+# Largest number of pages one call fetches at once; see async_requests.pages_per_call
+max_parallel_pages = 8
+
+# Largest page size the GitHub API allows
+max_per_page = 100
+
 def replace_special_chars(s):
     """ Replace special characters with their HTML URL encodings.
     Don't call on a complete URL because this function replaces the question mark.
@@ -26,6 +38,13 @@ def replace_special_chars(s):
     return rtrn
 
 
+def add_per_page(url, per_page = max_per_page):
+    """Add page size to GitHub API request"""
+    if "?" in url:
+        return "%s&per_page=%s" %(url, per_page)
+    else:
+        return "%s?per_page=%s" %(url, per_page)
+
 def add_page_num(url, page_num):
     """Add page number to GitHub API request"""
     if "?" in url:
@@ -45,7 +64,149 @@ def validate_response_found(parsed, message = ""):
         if parsed["message"] == "Not Found":
             raise ValueError("Parsed response has message: Not Found. Further information:\n%s" %message)
 
-def gh_curl_response(url, gh_username, gh_oauth_key):
+def parse_link_header(link):
+    """ Returns dict of URLs from a Link response header, keyed by rel, e.g. 'next' and 'last'
+
+    Args:
+        link: Value of the Link header, or None
+    """
+    rtrn = {}
+    if not link:
+        return rtrn
+    for part in link.split(","):
+        segs = part.split(";")
+        target = segs[0].strip().lstrip("<").rstrip(">")
+        for seg in segs[1:]:
+            seg = seg.strip()
+            if seg.startswith("rel="):
+                for rel in seg[4:].strip('"').split():
+                    rtrn[rel] = target
+    return rtrn
+
+def page_num_from_url(url):
+    """ Returns the page number in a paginated GitHub API URL, or None if there is none """
+    pages = parse_qs(urlparse(url).query).get("page")
+    if not pages:
+        return None
+    return int(pages[0])
+
+def get_page(url, page_num, gh_username, gh_oauth_key):
+    """ Returns the parsed response for one page of a GitHub API request, and the parsed Link header
+    Failed attempts are retried by request_with_retries. An empty successful response, e.g.
+    204 No Content for the contributors of an empty repo, is an empty list.
+    Raises IncompleteResponseError if the body is still not valid JSON after the retries.
+    
+    params:
+        url: URL without page number
+        page_num: Page number
+        gh_username: GitHub username for GitHub API
+        gh_oauth_key: (String) GitHub oauth key
+    """
+    page_url = add_page_num(url, page_num)
+    
+    def parse(response):
+        if 200 <= response.status < 300 and not response.body.strip():
+            return []
+        return parse_json(response.body)
+    
+    try:
+        response, parsed = request_with_retries(endpoint_class(page_url),
+                                                lambda: gh_request(page_url, gh_username, gh_oauth_key), parse)
+    except pycurl.error as e:
+        print(url)
+        raise e
+    if parsed is None:
+        raise IncompleteResponseError("Response was still not valid JSON after retrying: %s" % page_url)
+    validate_response_found(parsed, page_url)
+    return parsed, parse_link_header(response.headers.get("link"))
+
+def get_pages_parallel(url, page_nums, gh_username, gh_oauth_key, parallel_pages):
+    """ Fetch pages with up to parallel_pages requests at once and yield the parsed pages in order
+    At most parallel_pages pages are held in memory at a time.
+    
+    params:
+        url: URL without page number
+        page_nums: Page numbers to fetch
+        gh_username: GitHub username for GitHub API
+        gh_oauth_key: (String) GitHub oauth key
+        parallel_pages: Maximum number of requests in flight
+    """
+    page_nums = list(page_nums)
+    with ThreadPoolExecutor(max_workers = parallel_pages) as executor:
+        for i in range(0, len(page_nums), parallel_pages):
+            window = page_nums[i:i + parallel_pages]
+            for page in executor.map(lambda n: get_page(url, n, gh_username, gh_oauth_key)[0], window):
+                yield page
+
+def iter_pages(url, gh_username, gh_oauth_key, parallel_pages = 1):
+    """ Yield each parsed page of a GitHub API response
+    A response that is a single dict is yielded as that dict.
+    Raises IncompleteResponseError if a page is not valid JSON after retrying.
+    
+    params:
+        url: URL without page number
+        gh_username: GitHub username for GitHub API
+        gh_oauth_key: (String) GitHub oauth key
+        parallel_pages: If greater than 1 and the first page links to the last page,
+                        fetch the remaining pages with up to this many requests at once
+    """
+    page_num = 1
+    prev_response = None
+    num_records = 0
+    num_pages = 0
+    probe_saved = False
+    try:
+        while True:
+            parsed, links = get_page(url, page_num, gh_username, gh_oauth_key)
+            num_pages = num_pages + 1
+            if type(parsed) is dict:
+                yield parsed
+                return
+            if len(parsed) == 0:
+                return
+            if parsed == prev_response:
+                # Sometimes GitHub API will return the same response for any provided page num
+                return
+            prev_response = parsed
+            num_records = num_records + len(parsed)
+            yield parsed
+            if "next" not in links:
+                # Last page, or an endpoint that is not paginated
+                probe_saved = True
+                return
+            last_page = page_num_from_url(links["last"]) if "last" in links else None
+            if parallel_pages > 1 and page_num == 1 and last_page is not None:
+                probe_saved = True
+                for page in get_pages_parallel(url, range(2, last_page + 1), gh_username, gh_oauth_key,
+                                               parallel_pages):
+                    num_pages = num_pages + 1
+                    yield page
+                    num_records = num_records + len(page)
+                return
+            page_num = page_num + 1
+    finally:
+        wire_stats.add_listing(num_records, num_pages, probe_saved)
+
+def iter_gh_pages(url, gh_username, gh_oauth_key, parallel_pages = 1):
+    """ Yield the records of a paginated GitHub API response one page at a time,
+    so that callers can process a long listing without holding all of it in memory.
+    Each yielded item is a list of dicts. A response that is a single dict, e.g. an
+    error message, yields nothing. Raises IncompleteResponseError if a page is not valid
+    JSON after retrying.
+    
+    params:
+        url: URL without page number
+        gh_username: GitHub username for GitHub API
+        gh_oauth_key: (String) GitHub oauth key
+        parallel_pages: If greater than 1 and the first page links to the last page,
+                        fetch the remaining pages with up to this many requests at once
+    """
+    for page in iter_pages(url, gh_username, gh_oauth_key, parallel_pages):
+        if type(page) is dict:
+            return
+        yield page
+
+def gh_curl_response(url, gh_username, gh_oauth_key, parallel_pages = 1, memoize = False):
     """
     Returns the parsed curl response from the GitHub API
     Combines pages if applicable
@@ -54,51 +215,24 @@ def gh_curl_response(url, gh_username, gh_oauth_key):
         url: URL e.g. 'https://api.github.com/repos/samtools/samtools'
         gh_username: GitHub username for GitHub API
         gh_oauth_key: (String) GitHub oauth key
+        parallel_pages: If greater than 1 and the first page links to the last page,
+                        fetch the remaining pages with up to this many requests at once
+        memoize: Share the result with identical calls in flight and reuse it for
+                 later identical calls within the memo TTL. The result must not be modified.
         
     returns:
         Parsed API response. Returns a list of dicts, one for each record, or just one
         dict if the response was a single dict.
+        Raises IncompleteResponseError if a page is not valid JSON after retrying.
         
     """
-    page_num = 1
+    if memoize:
+        return memo.get(url, lambda: gh_curl_response(url, gh_username, gh_oauth_key, parallel_pages))
     results = []
-    prev_response = None
-    while True:
-        buffer = BytesIO()
-        c = pycurl.Curl()
-        c.setopt(c.URL, add_page_num(url, page_num))
-        c.setopt(c.USERPWD, gh_userpwd(gh_username, gh_oauth_key))
-        c.setopt(c.WRITEDATA, buffer)
-        sleep_gh_rate_limit()
-        try:
-            c.perform()
-        except pycurl.error as e:
-            print(url)
-            raise e
-        c.close()
-        body = buffer.getvalue()
-        try:
-            parsed = json.loads(body.decode())
-            if "message" in parsed:
-                if "API rate limit exceeded" in parsed["message"]:
-                    raise PermissionError(parsed["message"])
-        except JSONDecodeError:
-            print("Caught JSONDecodeError. Returning empty list for URL %s" % url)
-            return []
-        validate_response_found(parsed, add_page_num(url, page_num))
-        if type(parsed) is dict:
-            return parsed
-        else:
-            if len(parsed) == 0:
-                break
-            else:
-                if parsed == prev_response:
-                    # Sometimes GitHub API will return the same response for any provided page num
-                    break
-                else:
-                    prev_response = parsed
-                    results = results + parsed
-                    page_num = page_num + 1
+    for page in iter_pages(url, gh_username, gh_oauth_key, parallel_pages):
+        if type(page) is dict:
+            return page
+        results.extend(page)
     return results
 
 def curr_commit_master(repo_name, gh_username, gh_oauth_key):
@@ -111,27 +245,65 @@ def curr_commit_master(repo_name, gh_username, gh_oauth_key):
 
     """
     try:
-        response = gh_curl_response(get_commits_master_url(replace_special_chars(repo_name)), gh_username, gh_oauth_key)
+        response = gh_curl_response(get_commits_master_url(replace_special_chars(repo_name)), gh_username, gh_oauth_key,
+                                    memoize = True)
         return response["sha"]
     except ValueError:
         return None
     except KeyError:
         return None
 
-def get_commits_url(repo_name, path = None):
-    """ Get GitHub API URL for commits to default branch """
-    rtrn = "%s/%s/commits" % (url_repos, replace_special_chars(repo_name))
+def get_default_branch(repo_name, gh_username, gh_oauth_key):
+    """ Returns the name of the default branch of a repo, or None if the repo was not found
+    
+    Args:
+        repo_name: Repo name
+        gh_username: GitHub username for GitHub API
+        gh_oauth_key: (String) GitHub oauth key
+    """
+    try:
+        response = gh_curl_response("%s/%s" % (url_repos, replace_special_chars(repo_name)), gh_username, gh_oauth_key,
+                                    memoize = True)
+        return response["default_branch"]
+    except ValueError:
+        return None
+    except KeyError:
+        return None
+
+def get_commits_url(repo_name, path = None, per_page = max_per_page, since = None):
+    """ Get GitHub API URL for commits to default branch, optionally only those touching a path
+    or those committed at or after an ISO 8601 timestamp
+    """
+    rtrn = add_per_page("%s/%s/commits" % (url_repos, replace_special_chars(repo_name)), per_page)
     if path is not None:
-        rtrn = "%s?path=%s" % (rtrn, path)
+        rtrn = "%s&path=%s" % (rtrn, path)
+    if since is not None:
+        rtrn = "%s&since=%s" % (rtrn, replace_special_chars(since))
     return rtrn
 
+def get_commit_url(repo_name, sha):
+    """ Get GitHub API URL for one commit, including the files it changed """
+    return "%s/%s/commits/%s" % (url_repos, replace_special_chars(repo_name), sha)
+
 def get_commits_master_url(repo_name):
     """ Get GitHub API URL for latest commit to master """
-    return "%s/master" % get_commits_url(replace_special_chars(repo_name))
+    return "%s/%s/commits/master" % (url_repos, replace_special_chars(repo_name))
+
+def get_pulls_url(repo_name, state = "all", per_page = max_per_page, sort = None, direction = None):
+    """ Get GitHub API pull requests URL for given repo name, optionally sorted,
+    e.g. by 'updated' in direction 'desc'
+    """
+    rtrn = add_per_page("%s/%s/pulls?state=%s" % (url_repos, replace_special_chars(repo_name), state), per_page)
+    if sort is not None:
+        rtrn = "%s&sort=%s" % (rtrn, sort)
+    if direction is not None:
+        rtrn = "%s&direction=%s" % (rtrn, direction)
+    return rtrn
 
-def get_pulls_url(repo_name, state = "all"):
-    """ Get GitHub API pull requests URL for given repo name """
-    return "%s/%s/pulls?per_page=100&state=%s" % (url_repos, replace_special_chars(repo_name), state)
+def get_contributors_url(repo_name, anon = True, per_page = max_per_page):
+    """ Get GitHub API contributors URL for given repo name, optionally including anonymous contributors """
+    return add_per_page("%s/%s/contributors?anon=%s" % (url_repos, replace_special_chars(repo_name), int(anon)),
+                        per_page)
 
 def get_languages_url(repo_name):
     """ Get GitHub API languages URL for a given repo name """
@@ -141,6 +313,10 @@ def get_license_url(repo_name):
     """ Get GitHub licenses API URL for a given repo name """
     return "%s/%s/license" % (url_repos, replace_special_chars(repo_name))
 
+def get_tarball_url(repo_name, ref = "master"):
+    """ Get GitHub API URL for a gzipped tar archive of a repo at a commit sha or branch name """
+    return "%s/%s/tarball/%s" % (url_repos, replace_special_chars(repo_name), ref)
+
 def get_contents_url(repo_name, path = None):
     """ Git GitHub contents URL for a given repo name and optional file path
     
@@ -148,15 +324,16 @@ def get_contents_url(repo_name, path = None):
         repo_name: Repo name
         path: Optional path within repo
     """
+    rtrn = "%s/%s/contents" % (url_repos, replace_special_chars(repo_name))
     if path is not None:
-        return "%s/%s" % (get_contents_url(replace_special_chars(repo_name), None), path)
-    else:
-        return "%s/%s/contents" % (url_repos, replace_special_chars(repo_name))
+        rtrn = "%s/%s" % (rtrn, path)
+    return add_per_page(rtrn)
     
 def get_file_info(repo_name, gh_username, gh_oauth_key, path = None):
     """ Returns list of dicts, one dict containing info for each file in repo
         If a path is provided, if the path is a single file, returns info for that
         file. If path is a directory, returns files in that directory. Ignores submodules.
+        Makes one request per directory; get_file_info_tree lists a repo in one or two.
     
     Args:
         repo_name: Repo name
@@ -164,20 +341,34 @@ def get_file_info(repo_name, gh_username, gh_oauth_key, path = None):
         gh_oauth_key: (String) GitHub oauth key
         path: Optional path within repo    
     """
+    rtrn = []
+    add_file_info(repo_name, gh_username, gh_oauth_key, path, rtrn, set())
+    return rtrn
+
+def add_file_info(repo_name, gh_username, gh_oauth_key, path, rtrn, existing_paths):
+    """ Appends the file records under a path to rtrn, skipping paths already in existing_paths
+    
+    Args:
+        repo_name: Repo name
+        gh_username: GitHub username for GitHub API
+        gh_oauth_key: (String) GitHub oauth key
+        path: Path within repo, or None for the whole repo
+        rtrn: List the records are appended to
+        existing_paths: Set of the paths of the records in rtrn, updated as records are added
+    """
     response = gh_curl_response(get_contents_url(replace_special_chars(repo_name), path),
                                 gh_username, gh_oauth_key)
-    rtrn = []
     for file in response:
         try:
             tp = file["type"]
             if tp == "dir":
                 # Recursively get files in subdirectories
-                existing_paths = set([rec["path"] for rec in rtrn])
-                rtrn = rtrn + [rec for rec in get_file_info(replace_special_chars(repo_name), gh_username, gh_oauth_key,
-                                                            file["path"]) if rec["path"] not in existing_paths]
+                add_file_info(repo_name, gh_username, gh_oauth_key, file["path"], rtrn, existing_paths)
             else:
                 if tp == "file" or tp == "symlink":
-                    rtrn.append(file)
+                    if file["path"] not in existing_paths:
+                        existing_paths.add(file["path"])
+                        rtrn.append(file)
                 else:
                     if tp == "submodule": # Skip submodules
                         pass
@@ -185,6 +376,95 @@ def get_file_info(repo_name, gh_username, gh_oauth_key, path = None):
                         raise ValueError("Type not supported: %s" % tp)
         except TypeError as e:
             print("For repo %s, caught TypeError; skipping file record: %s" %(repo_name, file))
+
+def get_tree_url(repo_name, tree_sha, recursive = True):
+    """ Get GitHub API git trees URL for a tree, commit sha or branch name
+    
+    Args:
+        repo_name: Repo name
+        tree_sha: Tree sha, commit sha or branch name
+        recursive: Whether to list the whole tree rather than its top level
+    """
+    rtrn = "%s/%s/git/trees/%s" % (url_repos, replace_special_chars(repo_name), tree_sha)
+    if recursive:
+        rtrn = "%s?recursive=1" % rtrn
+    return rtrn
+
+def iter_tree_entries(repo_name, gh_username, gh_oauth_key, tree_sha, prefix = ""):
+    """ Yields the blob and submodule entries of a git tree with paths relative to the repo root
+    The whole tree is fetched with one recursive request. If GitHub truncates the listing, the
+    top level is fetched on its own and each subtree is listed the same way.
+    
+    Args:
+        repo_name: Repo name
+        gh_username: GitHub username for GitHub API
+        gh_oauth_key: (String) GitHub oauth key
+        tree_sha: Tree sha, commit sha or branch name
+        prefix: Path of the tree within the repo, ending with a slash, or ""
+    """
+    response = gh_curl_response(get_tree_url(repo_name, tree_sha), gh_username, gh_oauth_key)
+    # An empty repo has no tree
+    if type(response) is not dict or "tree" not in response:
+        return
+    if not response.get("truncated", False):
+        for entry in response["tree"]:
+            if entry["type"] != "tree":
+                yield dict(entry, path = prefix + entry["path"])
+        return
+    top = gh_curl_response(get_tree_url(repo_name, response["sha"], recursive = False), gh_username, gh_oauth_key)
+    for entry in top["tree"]:
+        if entry["type"] == "tree":
+            for sub_entry in iter_tree_entries(repo_name, gh_username, gh_oauth_key, entry["sha"],
+                                               "%s%s/" % (prefix, entry["path"])):
+                yield sub_entry
+        else:
+            yield dict(entry, path = prefix + entry["path"])
+
+def tree_entry_file_info(repo_name, ref, entry):
+    """ Returns a dict with the fields of a contents API file record for a git tree entry,
+    or None if the entry is a submodule
+    
+    Args:
+        repo_name: Repo name
+        ref: Commit sha or branch name the tree was listed at
+        entry: Tree entry with path relative to the repo root
+    """
+    if entry["type"] != "blob":
+        return None
+    path = entry["path"]
+    escaped_repo = replace_special_chars(repo_name)
+    escaped_path = replace_special_chars(path)
+    return {'name': path.rsplit("/", 1)[-1],
+            'path': path,
+            'sha': entry["sha"],
+            'size': entry.get("size"),
+            'url': "%s/%s/contents/%s?ref=%s" % (url_repos, escaped_repo, escaped_path, ref),
+            'html_url': "%s/%s/blob/%s/%s" % (url_html, escaped_repo, ref, escaped_path),
+            'git_url': "%s/%s/git/blobs/%s" % (url_repos, escaped_repo, entry["sha"]),
+            'download_url': "%s/%s/%s/%s" % (url_raw, escaped_repo, ref, escaped_path),
+            'type': "symlink" if entry.get("mode") == "120000" else "file"}
+
+def get_file_info_tree(repo_name, gh_username, gh_oauth_key, ref = None):
+    """ Returns list of dicts, one dict containing info for each file in repo, with the
+        fields returned by get_file_info. Ignores submodules.
+        Lists the repo with the git trees API: one request, or one per subtree of a tree
+        too large for GitHub to list in one response.
+    
+    Args:
+        repo_name: Repo name
+        gh_username: GitHub username for GitHub API
+        gh_oauth_key: (String) GitHub oauth key
+        ref: Commit sha or branch name to list the files at; defaults to the default branch
+    """
+    if ref is None:
+        ref = get_default_branch(repo_name, gh_username, gh_oauth_key)
+        if ref is None:
+            raise ValueError("Repo not found: %s" % repo_name)
+    rtrn = []
+    for entry in iter_tree_entries(repo_name, gh_username, gh_oauth_key, ref):
+        record = tree_entry_file_info(repo_name, ref, entry)
+        if record is not None:
+            rtrn.append(record)
     return rtrn
             
 def get_file_contents(url, gh_username, gh_oauth_key):
@@ -216,7 +496,8 @@ def get_language_bytes(repo_name, gh_username, gh_oauth_key):
         gh_username: GitHub username for GitHub API
         gh_oauth_key: (String) GitHub oauth key
     """
-    response = gh_curl_response(get_languages_url(replace_special_chars(repo_name)), gh_username, gh_oauth_key)
+    response = gh_curl_response(get_languages_url(replace_special_chars(repo_name)), gh_username, gh_oauth_key,
+                                memoize = True)
     if not response:
         return {}
     return response
@@ -231,28 +512,71 @@ def get_license(repo_name, gh_username, gh_oauth_key):
 
     """
     try:
-        response = gh_curl_response(get_license_url(replace_special_chars(repo_name)), gh_username, gh_oauth_key)
+        response = gh_curl_response(get_license_url(replace_special_chars(repo_name)), gh_username, gh_oauth_key,
+                                    memoize = True)
         return response["license"]["key"]
     except ValueError:
         return None
 
-def get_commits(repo_name, gh_username, gh_oauth_key):
+def get_commits(repo_name, gh_username, gh_oauth_key, parallel_pages = 1):
     """ Returns list of dicts; each dict is info for one commit to default branch 
     
     Params:
         repo_name: Repo name
         gh_username: GitHub username for GitHub API
         gh_oauth_key: (String) GitHub oauth key
+        parallel_pages: Maximum number of pages to fetch at once
     
     """
-    response = gh_curl_response(get_commits_url(replace_special_chars(repo_name)), gh_username, gh_oauth_key)
+    response = gh_curl_response(get_commits_url(replace_special_chars(repo_name)), gh_username, gh_oauth_key,
+                                parallel_pages)
     if not response:
         return []
     else:
         return response
 
+def iter_commits(repo_name, gh_username, gh_oauth_key, parallel_pages = 1):
+    """ Yield dicts of info for commits to default branch one at a time, fetching pages as needed
+    Yields nothing if the API returns a message instead of a list, e.g. for an empty repo.
+    
+    Params:
+        repo_name: Repo name
+        gh_username: GitHub username for GitHub API
+        gh_oauth_key: (String) GitHub oauth key
+        parallel_pages: Maximum number of pages to fetch at once
+    
+    """
+    for page in iter_gh_pages(get_commits_url(replace_special_chars(repo_name)), gh_username, gh_oauth_key,
+                              parallel_pages):
+        for commit in page:
+            yield commit
+
+def iter_new_commits(repo_name, gh_username, gh_oauth_key, last_sha, since, parallel_pages = 1):
+    """ Yield dicts of info for commits to default branch newer than a commit already seen,
+    newest first. Lists only the commits from the seen commit's date on and stops at the seen
+    commit, so a repo with few new commits costs one request. Commits dated before the seen
+    commit, e.g. from a branch merged since, are not listed.
+    
+    Params:
+        repo_name: Repo name
+        gh_username: GitHub username for GitHub API
+        gh_oauth_key: (String) GitHub oauth key
+        last_sha: Sha of the newest commit already seen
+        since: Committer date of that commit as an ISO 8601 timestamp
+        parallel_pages: Maximum number of pages to fetch at once
+    """
+    for page in iter_gh_pages(get_commits_url(replace_special_chars(repo_name), since = since), gh_username,
+                              gh_oauth_key, parallel_pages):
+        for commit in page:
+            if commit["sha"] == last_sha:
+                return
+            yield commit
+
 def get_initial_commit(repo_name, path, gh_username, gh_oauth_key):
     """ Returns date of first commit for a path as a datetime object 
+    The oldest commits are on the last page of the listing, so if the first page links to
+    the last page, only those two pages are fetched and the pages in between are counted
+    as skipped in wire_stats. Otherwise all pages are fetched.
     
     Params:
         repo_name: Repo name
@@ -261,8 +585,14 @@ def get_initial_commit(repo_name, path, gh_username, gh_oauth_key):
         gh_oauth_key: (String) GitHub oauth key
         
     """
-    response = gh_curl_response(get_commits_url(replace_special_chars(repo_name), replace_special_chars(path)),
-                                gh_username, gh_oauth_key)
+    url = get_commits_url(replace_special_chars(repo_name), replace_special_chars(path))
+    response, links = get_page(url, 1, gh_username, gh_oauth_key)
+    if "last" in links:
+        last_page = page_num_from_url(links["last"])
+        response = get_page(url, last_page, gh_username, gh_oauth_key)[0]
+        wire_stats.add_pages_skipped(max(0, last_page - 2))
+    elif "next" in links:
+        response = gh_curl_response(url, gh_username, gh_oauth_key)
     if not response:
         raise ValueError("No commits for repo %s and path %s" % (replace_special_chars(repo_name), 
                                                                  replace_special_chars(path)))
@@ -274,7 +604,95 @@ def get_initial_commit(repo_name, path, gh_username, gh_oauth_key):
             print(response)
         raise ValueError("Caught TypeError for repo %s and path %s" % (repo_name, path))
 
-def get_pull_requests(repo_name, gh_username, gh_oauth_key, state = "all"):
+def iter_commits_oldest_first(repo_name, gh_username, gh_oauth_key, parallel_pages = 1):
+    """ Yield dicts of info for commits to default branch from oldest to newest
+    The first page gives the last page number; the pages are then fetched from the last
+    back to the first, with up to parallel_pages requests at once.
+    Yields nothing if the API returns a message instead of a list, e.g. for an empty repo.
+    
+    Params:
+        repo_name: Repo name
+        gh_username: GitHub username for GitHub API
+        gh_oauth_key: (String) GitHub oauth key
+        parallel_pages: Maximum number of pages to fetch at once
+    """
+    url = get_commits_url(replace_special_chars(repo_name))
+    first, links = get_page(url, 1, gh_username, gh_oauth_key)
+    if type(first) is not list:
+        return
+    last_page = page_num_from_url(links["last"]) if "last" in links else 1
+    for page in get_pages_parallel(url, range(last_page, 1, -1), gh_username, gh_oauth_key, parallel_pages):
+        for commit in reversed(page):
+            yield commit
+    for commit in reversed(first):
+        yield commit
+
+def iter_commit_files(repo_name, sha, gh_username, gh_oauth_key):
+    """ Yield the names of the files a commit changed
+    GitHub lists up to 300 files per response and links to pages with the rest, each
+    repeating the commit, up to 3000 files in all; the pages are followed one at a time.
+    Yields nothing if the API returns something other than a commit.
+    
+    Params:
+        repo_name: Repo name
+        sha: Commit sha
+        gh_username: GitHub username for GitHub API
+        gh_oauth_key: (String) GitHub oauth key
+    """
+    url = get_commit_url(repo_name, sha)
+    page_num = 1
+    while True:
+        detail, links = get_page(url, page_num, gh_username, gh_oauth_key)
+        if type(detail) is not dict:
+            return
+        for file in detail.get("files", []):
+            yield file["filename"]
+        if "next" not in links:
+            return
+        page_num = page_num_from_url(links["next"])
+
+def get_initial_commits(repo_name, paths, gh_username, gh_oauth_key, parallel_pages = 1):
+    """ Returns dict from path to date of first commit for the path as a datetime object,
+    for the paths that appear in the history of the default branch
+    Walks the history once from the oldest commit, fetching each commit's changed files,
+    and stops as soon as every path has been seen. Each path gets the earliest committer
+    date of the commits walked that touched it; unlike get_initial_commit, which takes the
+    earliest of the oldest page of the path's listing, commits listed after the walk stops
+    are not considered, which matters only for committer dates out of history order.
+    Costs one request per page of history walked plus one per commit walked, and one more
+    per 300 files a commit changed beyond the first 300, however many paths there are.
+    
+    Params:
+        repo_name: Repo name
+        paths: File paths within repo
+        gh_username: GitHub username for GitHub API
+        gh_oauth_key: (String) GitHub oauth key
+        parallel_pages: Maximum number of pages or commits to fetch at once
+    """
+    wanted = set(paths)
+    remaining = set(paths)
+    rtrn = {}
+    commits = iter_commits_oldest_first(repo_name, gh_username, gh_oauth_key, parallel_pages)
+    
+    def changed_files(commit):
+        return list(iter_commit_files(repo_name, commit["sha"], gh_username, gh_oauth_key))
+    
+    with ThreadPoolExecutor(max_workers = parallel_pages) as executor:
+        while remaining:
+            window = list(islice(commits, parallel_pages))
+            if not window:
+                break
+            for commit, filenames in zip(window, executor.map(changed_files, window)):
+                touched = wanted.intersection(filenames)
+                if touched:
+                    timestamp = dateutil.parser.parse(commit["commit"]["committer"]["date"])
+                    for path in touched:
+                        if path not in rtrn or timestamp < rtrn[path]:
+                            rtrn[path] = timestamp
+                    remaining = remaining - touched
+    return rtrn
+
+def get_pull_requests(repo_name, gh_username, gh_oauth_key, state = "all", parallel_pages = 1):
     """ Returns list of pull requests.
     Each pull request is a dict of data.
     
@@ -283,14 +701,106 @@ def get_pull_requests(repo_name, gh_username, gh_oauth_key, state = "all"):
         gh_username: GitHub username for GitHub API
         gh_oauth_key: (String) GitHub oauth key
         state: "all", "open", or "closed"
+        parallel_pages: Maximum number of pages to fetch at once
 
     """
-    rtrn = gh_curl_response(get_pulls_url(replace_special_chars(repo_name), state), gh_username, gh_oauth_key)
+    rtrn = gh_curl_response(get_pulls_url(replace_special_chars(repo_name), state), gh_username, gh_oauth_key,
+                            parallel_pages)
     if not rtrn:
         return []
     else:
         return rtrn
 
+def iter_pull_requests(repo_name, gh_username, gh_oauth_key, state = "all", parallel_pages = 1):
+    """ Yield dicts of pull request data one at a time, fetching pages as needed
+    Yields nothing if the API returns a message instead of a list.
+    
+    Params:
+        repo_name
+        gh_username: GitHub username for GitHub API
+        gh_oauth_key: (String) GitHub oauth key
+        state: "all", "open", or "closed"
+        parallel_pages: Maximum number of pages to fetch at once
+
+    """
+    for page in iter_gh_pages(get_pulls_url(replace_special_chars(repo_name), state), gh_username, gh_oauth_key,
+                              parallel_pages):
+        for pr in page:
+            yield pr
+
+def iter_updated_pull_requests(repo_name, gh_username, gh_oauth_key, since, state = "all", parallel_pages = 1,
+                               seen_ids = ()):
+    """ Yield dicts of pull request data for pull requests updated after a time, most recently
+    updated first. Lists pull requests by update time and stops at the first one updated
+    before since, so a repo with few changes costs one request. Pull requests updated at
+    exactly since are yielded only if their ids are not in seen_ids, so a sync from the
+    latest stored update yields nothing for an unchanged repo.
+    
+    Params:
+        repo_name
+        gh_username: GitHub username for GitHub API
+        gh_oauth_key: (String) GitHub oauth key
+        since: ISO 8601 timestamp in UTC, e.g. the latest updated_at already stored
+        state: "all", "open", or "closed"
+        parallel_pages: Maximum number of pages to fetch at once
+        seen_ids: Ids, as strings, of the pull requests already stored as updated at since
+
+    """
+    url = get_pulls_url(replace_special_chars(repo_name), state, sort = "updated", direction = "desc")
+    for page in iter_gh_pages(url, gh_username, gh_oauth_key, parallel_pages):
+        for pr in page:
+            if pr["updated_at"] < since:
+                return
+            if pr["updated_at"] == since and str(pr["id"]) in seen_ids:
+                continue
+            yield pr
+
+def count_records(url, gh_username, gh_oauth_key):
+    """ Returns the number of records in a paginated listing using a single request
+    The URL must ask for one record per page, so the page number of the rel="last" link
+    is the number of records. A listing without a last link fits on the first page.
+    Returns 0 if the API returns a message instead of a list, e.g. for an empty repo.
+    
+    Params:
+        url: Listing URL with per_page=1 and without page number
+        gh_username: GitHub username for GitHub API
+        gh_oauth_key: (String) GitHub oauth key
+    """
+    parsed, links = get_page(url, 1, gh_username, gh_oauth_key)
+    if "last" in links:
+        return page_num_from_url(links["last"])
+    if type(parsed) is not list:
+        return 0
+    return len(parsed)
 
+def count_commits(repo_name, gh_username, gh_oauth_key):
+    """ Returns the number of commits to default branch with one request
+    
+    Params:
+        repo_name: Repo name
+        gh_username: GitHub username for GitHub API
+        gh_oauth_key: (String) GitHub oauth key
+    """
+    return count_records(get_commits_url(repo_name, per_page = 1), gh_username, gh_oauth_key)
 
+def count_pull_requests(repo_name, gh_username, gh_oauth_key, state = "all"):
+    """ Returns the number of pull requests with one request
+    
+    Params:
+        repo_name: Repo name
+        gh_username: GitHub username for GitHub API
+        gh_oauth_key: (String) GitHub oauth key
+        state: "all", "open", or "closed"
+    """
+    return count_records(get_pulls_url(repo_name, state, per_page = 1), gh_username, gh_oauth_key)
 
+def count_contributors(repo_name, gh_username, gh_oauth_key, anon = True):
+    """ Returns the number of contributors with one request
+    
+    Params:
+        repo_name: Repo name
+        gh_username: GitHub username for GitHub API
+        gh_oauth_key: (String) GitHub oauth key
+        anon: Whether to count anonymous contributors, identified by email address
+    """
+    return count_records(get_contributors_url(repo_name, anon, per_page = 1), gh_username, gh_oauth_key)
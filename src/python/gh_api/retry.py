@@ -0,0 +1,239 @@
+import random
+import threading
+import time
+
+import pycurl
+
+from .metrics import metrics
+
+
+class RetryableError(Exception):
+    """A failed attempt that the retry policy may try again.
+
+    If the policy gives up, it raises cause if there is one, and otherwise returns result.
+    """
+
+    def __init__(self, error_class, retry_after = None, cause = None, result = None):
+        """
+        Args:
+            error_class: Key into the policy's retry limits, e.g. 'server'
+            retry_after: Seconds the server asked us to wait, if it said
+            cause: Exception to raise when giving up
+            result: Value to return when giving up if there is no cause
+        """
+        super(RetryableError, self).__init__(error_class)
+        self.error_class = error_class
+        self.retry_after = retry_after
+        self.cause = cause
+        self.result = result
+
+
+class IncompleteResponseError(ValueError):
+    """A response body was still not valid JSON when the retries ran out; a ValueError, so
+    collectors skip the repo or file as for other bad responses"""
+
+
+# Number of retries already made of the request the current thread is attempting
+_retries = threading.local()
+
+
+def current_retries():
+    """ Returns the number of retries made so far of the request the current thread is attempting """
+    return getattr(_retries, 'count', 0)
+
+
+class RetryPolicy(object):
+    """Exponential backoff with jitter for transient GitHub API failures.
+
+    Each error class has a maximum number of retries per request and a total retry
+    budget for the process. Once the budget of a class is spent, errors of that class
+    are no longer retried, so a persistent outage fails fast instead of stalling a run.
+    A Retry-After value from the server is used as the delay when present.
+    """
+
+    # Default retries per request and per process for each error class
+    default_max_retries = {'network': 5, 'server': 5, 'truncated': 3, 'secondary_rate_limit': 5, 'rate_limit': 2}
+    default_budgets = {'network': 1000, 'server': 1000, 'truncated': 500, 'secondary_rate_limit': 1000,
+                       'rate_limit': 100}
+    # Secondary rate limits without Retry-After need at least a minute
+    default_base_delays = {'secondary_rate_limit': 60}
+
+    def __init__(self, base_delay = 1.0, max_delay = 300.0, jitter = 0.5, max_retries = None, budgets = None,
+                 base_delays = None):
+        """
+        Args:
+            base_delay: Delay in seconds before the first retry
+            max_delay: Maximum delay in seconds between retries
+            jitter: Fraction of each delay that is randomized
+            max_retries: Dict of retries per request by error class, overriding the defaults
+            budgets: Dict of total retries per process by error class, overriding the defaults
+            base_delays: Dict of first-retry delays by error class, overriding base_delay
+        """
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.max_retries = dict(self.default_max_retries)
+        self.max_retries.update(max_retries or {})
+        self.budgets = dict(self.default_budgets)
+        self.budgets.update(budgets or {})
+        self.base_delays = dict(self.default_base_delays)
+        self.base_delays.update(base_delays or {})
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def delay(self, error_class, attempt, retry_after = None):
+        """ Returns the number of seconds to wait before retry number attempt (starting at 0) """
+        if retry_after is not None:
+            return retry_after
+        base = self.base_delays.get(error_class, self.base_delay)
+        delay = min(self.max_delay, base * 2 ** attempt)
+        return delay * (1 - self.jitter * random.random())
+
+    def _allow(self, error_class, attempt):
+        """ Take one retry from the budget if another retry is allowed """
+        with self._lock:
+            if attempt >= self.max_retries.get(error_class, 0):
+                return False
+            if self.budgets.get(error_class, 0) <= 0:
+                return False
+            self.budgets[error_class] = self.budgets[error_class] - 1
+            return True
+
+    def _record(self, endpoint, error_class, outcome):
+        with self._lock:
+            counts = self._stats.setdefault(endpoint, {}).setdefault(error_class, {'retries': 0, 'gave_up': 0})
+            counts[outcome] = counts[outcome] + 1
+
+    def call(self, endpoint, fn):
+        """ Call fn until it succeeds or the retries for its error class run out
+
+        Args:
+            endpoint: Endpoint class the stats are recorded under, e.g. 'commits'
+            fn: Function of no arguments that returns a result or raises RetryableError
+
+        Returns:
+            The result of fn, or the result of the last RetryableError if the policy gave up
+            and the error has no cause
+        """
+        attempts = {}
+        while True:
+            _retries.count = sum(attempts.values())
+            try:
+                return fn()
+            except RetryableError as e:
+                attempt = attempts.get(e.error_class, 0)
+                if not self._allow(e.error_class, attempt):
+                    self._record(endpoint, e.error_class, 'gave_up')
+                    if e.cause is not None:
+                        raise e.cause
+                    return e.result
+                attempts[e.error_class] = attempt + 1
+                self._record(endpoint, e.error_class, 'retries')
+                with metrics.timer('retry_backoff'):
+                    time.sleep(self.delay(e.error_class, attempt, e.retry_after))
+            finally:
+                _retries.count = 0
+
+    def stats(self):
+        """ Returns dict of retry and give-up counts by endpoint class and error class """
+        with self._lock:
+            return {endpoint: {error_class: dict(counts) for error_class, counts in by_class.items()}
+                    for endpoint, by_class in self._stats.items()}
+
+    def summary(self):
+        """ Returns the retry counts as a printable string """
+        lines = []
+        for endpoint, by_class in sorted(self.stats().items()):
+            for error_class, counts in sorted(by_class.items()):
+                lines.append("%s/%s: %s retries, gave up %s times"
+                             % (endpoint, error_class, counts['retries'], counts['gave_up']))
+        return "\n".join(lines) if lines else "no retries"
+
+
+# libcurl errors worth retrying: DNS, connect, timeout, TLS, dropped connections and HTTP/2 stream errors
+# (not every pycurl version defines all of the constants)
+transient_curl_errors = {getattr(pycurl, name) for name in
+                         ["E_COULDNT_RESOLVE_HOST", "E_COULDNT_CONNECT", "E_OPERATION_TIMEDOUT", "E_SSL_CONNECT_ERROR",
+                          "E_GOT_NOTHING", "E_SEND_ERROR", "E_RECV_ERROR", "E_HTTP2", "E_HTTP2_STREAM"]
+                         if hasattr(pycurl, name)}
+
+
+def classify_curl_error(e):
+    """ Returns the error class of a pycurl.error, or None if it should not be retried """
+    code = e.args[0] if e.args else None
+    if code == pycurl.E_PARTIAL_FILE:
+        return 'truncated'
+    if code in transient_curl_errors:
+        return 'network'
+    return None
+
+
+def parse_retry_after(headers):
+    """ Returns the Retry-After response header in seconds, or None """
+    try:
+        return int(headers["retry-after"])
+    except (KeyError, ValueError):
+        return None
+
+
+def rate_limit_exhausted(response):
+    """ Returns whether a 403 response is a rate limit rather than a permission error, by its
+    rate limit headers """
+    return response.status == 403 and response.headers.get("x-ratelimit-remaining") == "0"
+
+
+# Retry policy shared by all functions in the gh_api package
+retry_policy = RetryPolicy()
+
+
+def request_with_retries(endpoint, request, parse = None, rate_limited = None):
+    """ Make a GitHub API request, trying again under the shared retry policy after network
+    errors, server errors, secondary rate limits, rate limits and, if parse is given, bodies
+    that do not parse
+
+    Args:
+        endpoint: Endpoint class the retry stats are recorded under, e.g. 'commits'
+        request: Function of no arguments that makes the request and returns a Response
+        parse: Optional function that returns the parsed body of a Response, raising
+               ValueError if the body cannot be parsed
+        rate_limited: Optional function of a Response and its parsed body that says whether the
+                      response is a rate limit error; 429 responses and 'API rate limit exceeded'
+                      messages always are
+
+    Returns:
+        (response, parsed body), with a parsed body of None if parse is not given. When the
+        retries of a server error, unparsed body or secondary rate limit run out, the last
+        response is returned, with None as its body if it did not parse. When the retries of
+        a rate limit run out, raises PermissionError, and of a network error, the pycurl.error.
+    """
+    def attempt():
+        try:
+            response = request()
+        except pycurl.error as e:
+            error_class = classify_curl_error(e)
+            if error_class is None:
+                raise e
+            raise RetryableError(error_class, cause = e)
+        retry_after = parse_retry_after(response.headers)
+        parsed = None
+        if parse is not None:
+            try:
+                parsed = parse(response)
+            except ValueError:
+                # Includes JSONDecodeError and UnicodeDecodeError
+                parsed = None
+        if response.status >= 500:
+            raise RetryableError('server', retry_after, result = (response, parsed))
+        if parse is not None and parsed is None:
+            raise RetryableError('truncated', retry_after, result = (response, parsed))
+        message = (parsed.get("message") or "") if type(parsed) is dict else ""
+        if "secondary rate limit" in message or "abuse detection" in message:
+            raise RetryableError('secondary_rate_limit', retry_after, result = (response, parsed))
+        if response.status == 429 or "API rate limit exceeded" in message \
+                or (rate_limited is not None and rate_limited(response, parsed)):
+            raise RetryableError('rate_limit', retry_after,
+                                 cause = PermissionError(message or "Rate limited with status %s" % response.status))
+        return response, parsed
+
+    return retry_policy.call(endpoint, attempt)
+
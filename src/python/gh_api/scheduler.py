@@ -0,0 +1,185 @@
+import os
+import sqlite3
+import threading
+import time
+
+from util.gh_api_util import api_rate_limit_per_hour
+
+
+class BudgetScheduler(object):
+    """Shares one GitHub API rate limit budget between collector processes by priority.
+
+    Every process registers its stage in a small SQLite ledger with a priority and an
+    optional deadline, and records the rate limit headers it sees. Before each request:
+
+    - Each active stage is allotted a share of the hourly limit of all pooled keys in
+      proportion to its effective priority. A stage that has used its share waits while
+      another stage with requests queued or in flight is within its own share and not
+      held back by the reserve, and runs freely otherwise, so some stage always runs.
+    - When the shared remaining budget falls below the reserve, a stage waits while any
+      stage of higher effective priority has requests queued or in flight.
+
+    A stage counts as having requests queued from acquire() until the matching release(),
+    so a stage busy with anything but GitHub API requests, e.g. BigQuery pushes or retry
+    backoff, does not hold others back.
+
+    The effective priority rises up to four-fold as a stage's deadline approaches.
+    """
+
+    def __init__(self, ledger_path, stage, priority = 1.0, deadline = None, reserve = 0.2,
+                 yield_interval = 5.0, stale_after = 120.0, deadline_horizon = 6 * 60 * 60, num_keys = 1):
+        """
+        Args:
+            ledger_path: SQLite file shared by all stages, created if necessary
+            stage: Name of this stage, e.g. 'gh_api_file_contents'
+            priority: Positive priority; larger values get more budget
+            deadline: Optional time (seconds since the epoch) by which the stage should finish
+            reserve: Fraction of the limit below which higher priority stages go first
+            yield_interval: Seconds to wait before checking again after yielding
+            stale_after: Seconds after which a stage that has not been heard from is ignored
+            deadline_horizon: Seconds before the deadline at which the priority boost starts
+            num_keys: Number of GitHub API keys the stages share, e.g. the size of a credential pool
+        """
+        if priority <= 0:
+            raise ValueError("Priority must be positive")
+        self.ledger_path = ledger_path
+        self.stage = stage
+        self.priority = priority
+        self.deadline = deadline
+        self.reserve = reserve
+        self.yield_interval = yield_interval
+        self.stale_after = stale_after
+        self.deadline_horizon = deadline_horizon
+        self.num_keys = max(1, num_keys)
+        self.num_yields = 0
+        self.time_yielded = 0.0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(ledger_path, timeout = 60, check_same_thread = False, isolation_level = None)
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS stages (
+                                stage TEXT PRIMARY KEY,
+                                pid INTEGER,
+                                priority REAL,
+                                deadline REAL,
+                                waiting INTEGER,
+                                last_seen REAL,
+                                used INTEGER,
+                                window_reset INTEGER)""")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS budget (
+                                id INTEGER PRIMARY KEY CHECK (id = 1),
+                                rate_limit INTEGER,
+                                remaining INTEGER,
+                                reset INTEGER,
+                                updated REAL)""")
+        self._conn.execute("INSERT OR REPLACE INTO stages VALUES (?, ?, ?, ?, 0, ?, 0, NULL)",
+                           (stage, os.getpid(), priority, deadline, time.time()))
+
+    def effective_priority(self, priority, deadline, now):
+        """ Priority boosted linearly up to four-fold over the deadline horizon """
+        if deadline is None:
+            return priority
+        time_left = deadline - now
+        if time_left >= self.deadline_horizon:
+            return priority
+        return priority * (1 + 3 * min(1.0, 1 - time_left / self.deadline_horizon))
+
+    def _budget(self):
+        row = self._conn.execute("SELECT rate_limit, remaining, reset FROM budget WHERE id = 1").fetchone()
+        if row is None or row[2] is None or time.time() >= row[2]:
+            return api_rate_limit_per_hour, None, None
+        return row
+
+    def should_yield(self, now = None):
+        """ Whether this stage should wait before its next request """
+        now = time.time() if now is None else now
+        with self._lock:
+            rows = self._conn.execute("SELECT stage, priority, deadline, waiting, used, window_reset FROM stages "
+                                      "WHERE last_seen >= ?", (now - self.stale_after,)).fetchall()
+            limit, remaining, reset = self._budget()
+        active = {row[0]: row for row in rows}
+        if self.stage not in active or len(active) == 1:
+            return False
+        effective = {name: self.effective_priority(row[1], row[2], now) for name, row in active.items()}
+        others_waiting = [name for name, row in active.items() if name != self.stage and row[3]]
+        if not others_waiting:
+            return False
+        waiting = others_waiting + [self.stage]
+        in_reserve = remaining is not None and remaining < self.reserve * limit
+
+        def reserve_blocked(name):
+            # Below the reserve, a stage waits for any waiting stage of higher priority
+            return in_reserve and any(effective[other] > effective[name] for other in waiting)
+
+        def over_allotment(name):
+            window_reset = active[name][5]
+            used = active[name][4] if window_reset is None or window_reset > now else 0
+            return used >= limit * self.num_keys * effective[name] / sum(effective.values())
+
+        if reserve_blocked(self.stage):
+            return True
+        # Yield a used-up share only to a stage that will run in its place, so that some
+        # waiting stage always proceeds
+        return over_allotment(self.stage) and \
+            any(not reserve_blocked(name) and not over_allotment(name) for name in others_waiting)
+
+    def acquire(self):
+        """ Count one more request of this stage as queued, and wait until it may be made.
+        Each call must be followed by a call to release() once the request is done.
+        """
+        self._update("UPDATE stages SET waiting = waiting + 1, last_seen = ?, pid = ? WHERE stage = ?",
+                     (time.time(), os.getpid(), self.stage))
+        while self.should_yield():
+            self.num_yields = self.num_yields + 1
+            self.time_yielded = self.time_yielded + self.yield_interval
+            time.sleep(self.yield_interval)
+            self._update("UPDATE stages SET last_seen = ? WHERE stage = ?", (time.time(), self.stage))
+
+    def record(self, headers):
+        """ Count a request against this stage and share the rate limit state from its response headers
+        Requests are counted in the window of the first response seen after the previous
+        window reset, so with pooled keys the count covers all keys.
+
+        Args:
+            headers: Dict of response headers with lower case names
+        """
+        now = time.time()
+        try:
+            if headers.get("x-ratelimit-resource", "core") != "core":
+                raise KeyError("x-ratelimit-resource")
+            limit = int(headers["x-ratelimit-limit"])
+            remaining = int(headers["x-ratelimit-remaining"])
+            reset = int(headers["x-ratelimit-reset"])
+        except (KeyError, ValueError):
+            self._update("UPDATE stages SET used = used + 1, last_seen = ? WHERE stage = ?", (now, self.stage))
+            return
+        self._update("INSERT OR REPLACE INTO budget VALUES (1, ?, ?, ?, ?)", (limit, remaining, reset, now))
+        self._update("UPDATE stages SET used = CASE WHEN window_reset > ? THEN used + 1 ELSE 1 END, "
+                     "window_reset = CASE WHEN window_reset > ? THEN window_reset ELSE ? END, "
+                     "last_seen = ? WHERE stage = ?", (now, now, reset, now, self.stage))
+
+    def release(self):
+        """ Count one queued request of this stage as done """
+        self._update("UPDATE stages SET waiting = MAX(waiting - 1, 0), last_seen = ? WHERE stage = ?",
+                     (time.time(), self.stage))
+
+    def _update(self, sql, params):
+        with self._lock:
+            self._conn.execute(sql, params)
+
+    def ledger(self):
+        """ Returns list of dicts, one per stage in the ledger """
+        with self._lock:
+            rows = self._conn.execute("SELECT stage, pid, priority, deadline, waiting, last_seen, used, window_reset "
+                                      "FROM stages ORDER BY priority DESC").fetchall()
+        keys = ['stage', 'pid', 'priority', 'deadline', 'waiting', 'last_seen', 'used', 'window_reset']
+        return [dict(zip(keys, row)) for row in rows]
+
+    def summary(self):
+        """ Returns this stage's yield counts as a printable string """
+        return "stage %s (priority %s) yielded %s times for %.0f s" \
+            % (self.stage, self.priority, self.num_yields, self.time_yielded)
+
+    def close(self):
+        self._update("UPDATE stages SET waiting = 0, last_seen = ? WHERE stage = ?", (time.time(), self.stage))
+        with self._lock:
+            self._conn.close()
+
@@ -0,0 +1,509 @@
+from contextlib import contextmanager
+from io import BytesIO
+import json
+import math
+import re
+import threading
+from urllib.parse import urlparse
+
+import pycurl
+from util import gh_userpwd
+
+from .metrics import metrics
+from .rate_limit import rate_limiter
+from .repo_status import repo_level_paths, split_repo_url
+from .retry import current_retries
+
+# Use a faster JSON parser if one is installed
+try:
+    import orjson as fast_json
+except ImportError:
+    try:
+        import ujson as fast_json
+    except ImportError:
+        fast_json = None
+
+
+class PooledHandle(object):
+    """A pycurl handle plus counters describing how much it has been reused"""
+
+    def __init__(self, curl):
+        self.curl = curl
+        self.num_requests = 0
+        self.num_connects = 0
+        self.connect_time = 0.0
+
+    def num_reuses(self):
+        """ Number of requests that reused an existing connection instead of opening a new one """
+        return self.num_requests - self.num_connects
+
+
+class CurlPool(object):
+    """Pool of reusable pycurl handles shared by all GitHub API requests.
+
+    libcurl keeps the connection cache with the easy handle, so reusing handles lets
+    consecutive requests to api.github.com skip the TCP and TLS handshakes.
+    """
+
+    def __init__(self, max_idle = 8, http2 = False, keepalive_idle = 60, compress = True):
+        """
+        Args:
+            max_idle: Maximum number of idle handles to keep open
+            http2: Negotiate HTTP/2 if the local libcurl supports it
+            keepalive_idle: Seconds of idle time before TCP keep-alive probes are sent
+            compress: Ask for gzip-compressed responses; libcurl decompresses them
+        """
+        self.max_idle = max_idle
+        self.http2 = http2 and http2_supported()
+        self.keepalive_idle = keepalive_idle
+        self.compress = compress
+        self._lock = threading.Lock()
+        self._idle = []
+        self._handles = []
+
+    def _new_handle(self):
+        handle = PooledHandle(pycurl.Curl())
+        with self._lock:
+            self._handles.append(handle)
+        return handle
+
+    def _configure(self, curl):
+        """ Set the options that every request shares """
+        curl.setopt(pycurl.TCP_KEEPALIVE, 1)
+        curl.setopt(pycurl.TCP_KEEPIDLE, self.keepalive_idle)
+        curl.setopt(pycurl.TCP_KEEPINTVL, self.keepalive_idle)
+        if self.http2:
+            curl.setopt(pycurl.HTTP_VERSION, pycurl.CURL_HTTP_VERSION_2_0)
+        if self.compress:
+            curl.setopt(pycurl.ACCEPT_ENCODING, "gzip")
+
+    @contextmanager
+    def handle(self):
+        """ Check out a handle for one request and return it to the pool afterwards.
+        The handle is reset, so per-request options must be set again, but its open
+        connections are kept.
+        """
+        with self._lock:
+            handle = self._idle.pop() if self._idle else None
+        if handle is None:
+            handle = self._new_handle()
+        handle.curl.reset()
+        self._configure(handle.curl)
+        try:
+            yield handle
+        finally:
+            with self._lock:
+                if len(self._idle) < self.max_idle:
+                    self._idle.append(handle)
+                    handle = None
+            if handle is not None:
+                self._discard(handle)
+
+    def _discard(self, handle):
+        handle.curl.close()
+        with self._lock:
+            self._handles.remove(handle)
+
+    def close(self):
+        """ Close all idle handles """
+        with self._lock:
+            idle = self._idle
+            self._idle = []
+        for handle in idle:
+            self._discard(handle)
+
+    def stats(self):
+        """ Returns a dict of reuse counters summed over all open handles """
+        with self._lock:
+            handles = list(self._handles)
+        num_requests = sum(h.num_requests for h in handles)
+        num_connects = sum(h.num_connects for h in handles)
+        connect_time = sum(h.connect_time for h in handles)
+        mean_handshake = connect_time / num_connects if num_connects > 0 else 0.0
+        return {'handles': len(handles),
+                'requests': num_requests,
+                'connects': num_connects,
+                'reuses': num_requests - num_connects,
+                'handshake_time': connect_time,
+                'est_handshake_time_saved': (num_requests - num_connects) * mean_handshake,
+                'per_handle_reuses': [h.num_reuses() for h in handles]}
+
+    def summary(self):
+        """ Returns the reuse counters as a printable string """
+        s = self.stats()
+        return ("%s requests over %s handles; %s new connections, %s reused. "
+                "%.1f s spent in handshakes, about %.1f s saved by reuse."
+                % (s['requests'], s['handles'], s['connects'], s['reuses'],
+                   s['handshake_time'], s['est_handshake_time_saved']))
+
+
+def http2_supported():
+    """ Whether the local libcurl was built with HTTP/2 support """
+    return bool(pycurl.version_info()[4] & pycurl.VERSION_HTTP2)
+
+
+# Handle pool shared by all functions in the gh_api package
+curl_pool = CurlPool()
+
+
+class WireStats(object):
+    """Counts of bytes and requests saved by compression and large page sizes"""
+
+    # Page size GitHub uses when per_page is not given
+    default_per_page = 30
+
+    def __init__(self):
+        self.num_requests = 0
+        self.wire_bytes = 0
+        self.decoded_bytes = 0
+        self.num_pages = 0
+        self.num_pages_default = 0
+        self.num_probes_saved = 0
+        self.num_pages_skipped = 0
+        self._lock = threading.Lock()
+
+    def add_transfer(self, wire_bytes, decoded_bytes):
+        """ Count one response of wire_bytes bytes as received that decompressed to decoded_bytes """
+        with self._lock:
+            self.num_requests = self.num_requests + 1
+            self.wire_bytes = self.wire_bytes + wire_bytes
+            self.decoded_bytes = self.decoded_bytes + decoded_bytes
+
+    def add_listing(self, num_records, num_pages, probe_saved):
+        """ Count one paginated listing
+
+        Args:
+            num_records: Number of records in the listing
+            num_pages: Number of pages requested
+            probe_saved: Whether the listing stopped at the last page without requesting an empty page
+        """
+        with self._lock:
+            self.num_pages = self.num_pages + num_pages
+            self.num_pages_default = self.num_pages_default + \
+                max(num_pages, math.ceil(num_records / self.default_per_page))
+            if probe_saved:
+                self.num_probes_saved = self.num_probes_saved + 1
+
+    def add_pages_skipped(self, num_pages):
+        """ Count pages of a listing that were not requested because only its last page was needed """
+        with self._lock:
+            self.num_pages_skipped = self.num_pages_skipped + num_pages
+
+    def stats(self):
+        """ Returns dict of byte and request counts """
+        with self._lock:
+            return {'requests': self.num_requests,
+                    'wire_bytes': self.wire_bytes,
+                    'decoded_bytes': self.decoded_bytes,
+                    'bytes_saved': self.decoded_bytes - self.wire_bytes,
+                    'requests_saved': self.num_pages_default - self.num_pages + self.num_probes_saved,
+                    'pages_skipped': self.num_pages_skipped}
+
+    def summary(self):
+        """ Returns the counts as a printable string """
+        s = self.stats()
+        return ("%s requests; %.1f MB received for %.1f MB of data (%.1f MB saved by compression); "
+                "%s requests saved by page size and Link headers; %s pages skipped by reading only last pages"
+                % (s['requests'], s['wire_bytes'] / 1e6, s['decoded_bytes'] / 1e6, s['bytes_saved'] / 1e6,
+                   s['requests_saved'], s['pages_skipped']))
+
+
+# Transfer counters for all functions in the gh_api package
+wire_stats = WireStats()
+
+
+def parse_json(body):
+    """ Parse a JSON response body with the fastest available parser
+    Raises ValueError if the body is not valid JSON.
+
+    Args:
+        body: Response body as bytes
+    """
+    with metrics.timer('json_decode'):
+        if fast_json is not None:
+            return fast_json.loads(body)
+        return json.loads(body.decode())
+
+
+class Response(object):
+    """Status, headers and body of one HTTP response"""
+
+    def __init__(self, status, headers, body):
+        """
+        Args:
+            status: HTTP status code
+            headers: Dict of response headers with lower case names
+            body: Response body as bytes
+        """
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+
+def get_response(url, userpwd, headers = None, pool = None, data = None, output = None):
+    """ Perform one GET request, or a POST request if data is given, with a pooled handle
+
+    Args:
+        url: Complete URL including any page number
+        userpwd: Credentials string from util.gh_userpwd
+        headers: Optional list of extra request header strings
+        pool: CurlPool to take the handle from. Defaults to the shared pool.
+        data: Optional request body as bytes or string to POST
+        output: Optional binary file object the body is written to as it arrives instead of
+                being kept in memory, e.g. for archive downloads. Redirects are then followed
+                by libcurl, which does not send the credentials to other hosts, and the
+                response is not recorded to a cassette.
+
+    Returns:
+        A Response, with an empty body if output is given
+    """
+    tape = cassette
+    if tape is not None and tape.mode == 'replay':
+        recorded = tape.play(url, data)
+        if recorded is None:
+            raise LookupError("Request is not on cassette %s: %s" % (tape.path, url))
+        if output is not None:
+            status, recorded_headers, body = recorded
+            output.write(body)
+            return Response(status, recorded_headers, b"")
+        return Response(*recorded)
+    pool = curl_pool if pool is None else pool
+    buffer = BytesIO()
+    response_headers = {}
+
+    def header_function(line):
+        line = line.decode('iso-8859-1').strip()
+        if line.startswith("HTTP/"):
+            # New status line, e.g. after a redirect: forget earlier headers
+            response_headers.clear()
+        elif ":" in line:
+            name, value = line.split(":", 1)
+            response_headers[name.strip().lower()] = value.strip()
+
+    with pool.handle() as handle:
+        c = handle.curl
+        c.setopt(c.URL, url)
+        c.setopt(c.USERPWD, userpwd)
+        c.setopt(c.WRITEDATA, buffer if output is None else output)
+        if output is not None:
+            c.setopt(c.FOLLOWLOCATION, 1)
+        c.setopt(c.HEADERFUNCTION, header_function)
+        if headers:
+            c.setopt(c.HTTPHEADER, headers)
+        if data is not None:
+            c.setopt(c.POSTFIELDS, data)
+        c.perform()
+        handle.num_requests = handle.num_requests + 1
+        num_connects = c.getinfo(c.NUM_CONNECTS)
+        if num_connects > 0:
+            handle.num_connects = handle.num_connects + num_connects
+            # APPCONNECT_TIME includes the TLS handshake; it is zero for plain HTTP
+            handle.connect_time = handle.connect_time + max(c.getinfo(c.APPCONNECT_TIME),
+                                                            c.getinfo(c.CONNECT_TIME))
+        status = c.getinfo(c.RESPONSE_CODE)
+        wire_bytes = c.getinfo(c.SIZE_DOWNLOAD_T) if hasattr(c, "SIZE_DOWNLOAD_T") else c.getinfo(c.SIZE_DOWNLOAD)
+        timings = {'namelookup': c.getinfo(c.NAMELOOKUP_TIME),
+                   'connect': c.getinfo(c.CONNECT_TIME),
+                   'appconnect': c.getinfo(c.APPCONNECT_TIME),
+                   'starttransfer': c.getinfo(c.STARTTRANSFER_TIME),
+                   'total': c.getinfo(c.TOTAL_TIME)}
+    body = buffer.getvalue()
+    wire_stats.add_transfer(int(wire_bytes), len(body) if output is None else int(wire_bytes))
+    remaining = response_headers.get("x-ratelimit-remaining")
+    metrics.observe_request(endpoint_class(url), status, int(wire_bytes), timings, current_retries(),
+                            int(remaining) if remaining is not None and remaining.isdigit() else None)
+    if tape is not None and output is None:
+        tape.record(url, status, response_headers, body, data)
+    return Response(status, response_headers, body)
+
+
+
+def endpoint_class(url):
+    """ Returns a short name for the kind of resource a GitHub API URL requests,
+    e.g. 'commits', 'contents' or 'pulls', or 'repo' for the repository itself
+    """
+    parts = [part for part in urlparse(url).path.split("/") if part]
+    if len(parts) > 0 and parts[0] == "repos":
+        if len(parts) <= 3:
+            return "repo"
+        return parts[3]
+    return parts[0] if parts else "root"
+
+
+# Number of times a request is repeated after waiting out an exhausted rate limit
+max_rate_limit_waits = 2
+
+# Optional ResponseCache used for conditional requests by gh_request
+response_cache = None
+
+# Optional CredentialPool; when set, gh_request ignores the credentials it is passed
+credential_pool = None
+
+# Optional BudgetScheduler shared with other collector processes
+budget_scheduler = None
+
+# Optional Cassette that get_response records responses to or replays them from
+cassette = None
+
+# Optional RepoStatusCache of missing and renamed repos
+repo_status = None
+
+# Redirect statuses gh_request follows
+redirect_statuses = (301, 302, 307, 308)
+
+
+def set_response_cache(cache):
+    """ Use a ResponseCache for all GitHub API requests, or stop caching if cache is None """
+    global response_cache
+    response_cache = cache
+
+
+def set_credential_pool(pool):
+    """ Spread all GitHub API requests over a CredentialPool, or use the passed credentials if pool is None """
+    global credential_pool
+    credential_pool = pool
+
+
+def set_budget_scheduler(scheduler):
+    """ Coordinate all GitHub API requests with other processes through a BudgetScheduler, or stop if None """
+    global budget_scheduler
+    budget_scheduler = scheduler
+
+
+def set_cassette(tape):
+    """ Record all GitHub API responses to a Cassette or replay them from it, or stop if tape is None """
+    global cassette
+    cassette = tape
+
+
+def set_repo_status(status_cache):
+    """ Skip known missing repos and rewrite renamed ones with a RepoStatusCache, or stop if None """
+    global repo_status
+    repo_status = status_cache
+
+
+def choose_credentials(gh_username, gh_oauth_key):
+    """ Returns (gh_username, gh_oauth_key, limiter) to use for the next request """
+    pool = credential_pool
+    if pool is None:
+        return gh_username, gh_oauth_key, rate_limiter
+    credential = pool.choose()
+    return credential.gh_username, credential.gh_oauth_key, credential.limiter
+
+
+def canonical_repo_name(location, response, gh_username, gh_oauth_key):
+    """ Returns the current 'owner/name' of a repo from a redirect target and the response it
+    returned, or None if it cannot be determined. A target under /repositories/<id> that is
+    not the repo itself costs one request for the repo.
+    """
+    repo_name, rest = split_repo_url(location)
+    if repo_name is not None:
+        return repo_name
+    match = re.match(r"^(.*/repositories/\d+)(/.*)?$", location.split("?")[0])
+    if match is None:
+        return None
+    if match.group(2):
+        response = gh_request(match.group(1), gh_username, gh_oauth_key)
+    try:
+        return parse_json(response.body)["full_name"]
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+def follow_redirect(url, response, gh_username, gh_oauth_key, headers = None, data = None):
+    """ Request the target of a redirect response once, and record the repo's canonical name
+    if a repo status cache is set
+
+    Returns:
+        The Response from the redirect target
+    """
+    location = response.headers["location"]
+    followed = gh_request(location, gh_username, gh_oauth_key, headers, data, follow_redirects = False)
+    status_cache = repo_status
+    repo_name, _rest = split_repo_url(url)
+    if status_cache is not None and repo_name is not None and followed.status == 200:
+        canonical = canonical_repo_name(location, followed, gh_username, gh_oauth_key)
+        if canonical is not None:
+            status_cache.record_rename(repo_name, canonical)
+    return followed
+
+
+def gh_request(url, gh_username, gh_oauth_key, headers = None, data = None, follow_redirects = True, output = None):
+    """ Perform one GitHub API request under the shared rate limiter.
+    If the response says the rate limit is exhausted, waits for the reset and tries again.
+    If a credential pool is set, the request uses the pooled key with the most headroom
+    instead of gh_username and gh_oauth_key, and moves on to another key when one runs out.
+    If a budget scheduler is set, the request first waits until the scheduler lets this
+    stage use the shared budget, and counts as queued for the scheduler until it is done.
+    A redirect, e.g. for a renamed repo, is followed once. If a repo status cache is set,
+    the new name is recorded and later requests go to it directly, and requests for a repo
+    known to be missing get a 404 response without contacting the API.
+    If a response cache is set, the request is made conditional on the cached version,
+    and a 304 Not Modified response is replaced by the cached body with status 200.
+    POST requests and requests written to an output file are never cached.
+
+    Args:
+        url: Complete URL including any page number
+        gh_username: GitHub username for GitHub API
+        gh_oauth_key: (String) GitHub oauth key
+        headers: Optional list of extra request header strings
+        data: Optional request body to POST instead of making a GET request
+        follow_redirects: Whether to follow a redirect response
+        output: Optional binary file object the body is written to, as in get_response
+
+    Returns:
+        A Response
+    """
+    status_cache = repo_status
+    if status_cache is not None:
+        url, missing = status_cache.rewrite(url)
+        if missing:
+            return Response(404, {}, b'{"message": "Not Found"}')
+    cache = response_cache if data is None and output is None else None
+    request_headers = list(headers) if headers else []
+    if cache is not None:
+        request_headers = request_headers + cache.conditional_headers(url)
+    num_attempts = max_rate_limit_waits + 1
+    if credential_pool is not None:
+        num_attempts = num_attempts + len(credential_pool)
+    scheduler = budget_scheduler
+    for _attempt in range(num_attempts):
+        if scheduler is not None:
+            with metrics.timer('budget_wait'):
+                scheduler.acquire()
+        try:
+            username, key, limiter = choose_credentials(gh_username, gh_oauth_key)
+            with metrics.timer('rate_limit_wait'):
+                limiter.wait()
+            if output is not None:
+                # Drop the body of an earlier attempt
+                output.seek(0)
+                output.truncate()
+            response = get_response(url, gh_userpwd(username, key), request_headers, data = data, output = output)
+            limiter.update(response.headers)
+            if scheduler is not None:
+                scheduler.record(response.headers)
+        finally:
+            if scheduler is not None:
+                scheduler.release()
+        if not (response.status in (403, 429) and limiter.exhausted()):
+            break
+    if response.status in redirect_statuses and follow_redirects and "location" in response.headers:
+        return follow_redirect(url, response, gh_username, gh_oauth_key, headers, data)
+    if response.status == 404 and status_cache is not None:
+        repo_name, rest = split_repo_url(url)
+        if repo_name is not None and rest in repo_level_paths:
+            status_cache.mark_missing(repo_name)
+    if cache is not None:
+        if response.status == 304:
+            entry = cache.hit(url)
+            if entry is None:
+                # Evicted since the request was made: ask again without validators
+                return gh_request(url, gh_username, gh_oauth_key, headers)
+            cached_headers, body = entry
+            merged_headers = dict(cached_headers)
+            merged_headers.update(response.headers)
+            response = Response(200, merged_headers, body)
+        elif response.status == 200:
+            cache.store(url, response.headers, response.body)
+    return response
@@ -1,13 +1,23 @@
 import argparse
+import sys
+import threading
 
 from bigquery import get_client
 
+from gh_api import add_gh_api_args, configure_gh_api
+from gh_api import metrics
 from gh_api import curr_commit_master
-from gh_api import get_commits
-from gh_api import validate_response_found
-from util import create_bq_table, push_bq_records
+from gh_api import async_requests, map_concurrently, pages_per_call
+from gh_api import count_commits, iter_commits, iter_new_commits
+from gh_api import CrawlPlan, num_pages, print_plan
+from gh_api import IncompleteResponseError
+from gh_api.planner import default_commits_per_repo
+from git_repo import GitError, cloned_repo
+from util import create_bq_table, push_bq_batches, push_bq_counts, push_bq_records
 from util import curr_time_utc
 from util import get_repo_names
+from util import mean_group_size
+from util import run_bq_query
 from util import unique_vals
 
 
@@ -26,7 +36,15 @@ parser.add_argument('--gh_user', action = 'store', dest = 'gh_username', require
                     help = 'GitHub username for API')
 parser.add_argument('--gh_oauth_key', action = 'store', dest = 'gh_oauth_key', required = True, 
                     help = '(String) GitHub oauth key')
+parser.add_argument('--counts-only', action = 'store_true', dest = 'counts_only',
+                    help = 'Write only the number of commits per repo, with one request per repo')
+parser.add_argument('--incremental', action = 'store_true', dest = 'incremental',
+                    help = 'For repos already in the table, append only the commits newer than the newest stored commit')
+parser.add_argument('--backend', action = 'store', dest = 'backend', choices = ['api', 'git'], default = 'api',
+                    help = 'api: GitHub API; git: a local clone of each repo, with no API requests')
+add_gh_api_args(parser)
 args = parser.parse_args()
+configure_gh_api(args)
  
 proj = args.proj
 json_key = args.json_key
@@ -45,11 +63,55 @@ print("There are %s repos with use_repo = 1.\n" % len(repos))
 print('\nGetting BigQuery client\n')
 client = get_client(json_key_file=json_key, readonly=False, swallow_results=True)
   
+# Newest stored commit sha and date of each repo already in the table, for an incremental sync
+latest_commits = {}
+if args.incremental and not args.counts_only and client.check_table(dataset, table):
+    for rec in run_bq_query(client, """
+    SELECT repo_name, commit_sha, committer_commit_date FROM (
+        SELECT repo_name, commit_sha, committer_commit_date,
+            ROW_NUMBER() OVER (PARTITION BY repo_name ORDER BY committer_commit_date DESC) AS row_num
+        FROM [%s:%s.%s])
+    WHERE row_num = 1
+    """ % (proj, dataset, table), 120):
+        latest_commits[rec["repo_name"]] = (rec["commit_sha"], rec["committer_commit_date"])
+    print("Getting new commits for %s repos already in the table" % len([repo for repo in repos if repo in latest_commits]))
+
 # Check which repos are already in the table
-existing_repos = unique_vals(client, proj, dataset, table, "repo_name")
-if len(existing_repos) > 0:
-    repos = [repo for repo in repos if repo not in existing_repos]
-    print("Only getting data for %s repos not yet analyzed" %len(repos))
+if not args.incremental or args.counts_only:
+    existing_repos = unique_vals(client, proj, dataset, table, "repo_name")
+    if len(existing_repos) > 0:
+        repos = [repo for repo in repos if repo not in existing_repos]
+        print("Only getting data for %s repos not yet analyzed" %len(repos))
+
+if args.plan and args.backend == 'git' and not args.counts_only:
+    print("The git backend makes no GitHub API requests. %s repos to clone." % len(repos))
+    sys.exit()
+
+# Estimate the cost from the mean commit count of repos already in the table
+if args.plan and args.counts_only:
+    plan = CrawlPlan("gh_api_commits", len(repos))
+    plan.add("commit counts", len(repos))
+    print_plan(plan, gh_username, gh_oauth_key)
+    sys.exit()
+if args.plan:
+    commits_per_repo = mean_group_size(client, proj, dataset, table, "repo_name") or default_commits_per_repo
+    num_synced = len([repo for repo in repos if repo in latest_commits])
+    num_new = len(repos) - num_synced
+    plan = CrawlPlan("gh_api_commits", len(repos))
+    plan.add("commit listing pages (%.0f commits per repo)" % commits_per_repo,
+             num_new * num_pages(commits_per_repo), num_new * num_pages(commits_per_repo))
+    if num_synced > 0:
+        plan.add("new commit listings of repos already in the table", num_synced, num_synced)
+    plan.add("current commit on master", len(repos))
+    print_plan(plan, gh_username, gh_oauth_key)
+    sys.exit()
+
+# Write only the commit count of each repo, read from the last page link of a one-commit page
+if args.counts_only:
+    print("%s\tGetting commit counts from GitHub API" % curr_time_utc())
+    push_bq_counts(client, dataset, table, repos, lambda repo_name: count_commits(repo_name, gh_username, gh_oauth_key),
+                   'commit_count', map_concurrently, lambda: metrics.timer('bigquery_push'))
+    sys.exit()
 
 # Table schema
 schema = [
@@ -117,32 +179,73 @@ def get_record(response_dict, repo_name, curr_time, curr_commit):
             'curr_commit_master': curr_commit,
             'time_accessed': curr_time}
 
-# Get list of commit records for a repo
-def get_records(repo_name):
-    data = get_commits(repo_name, gh_username, gh_oauth_key)
-    try:
-        validate_response_found(data[0])
-    except ValueError:
-        return None
-    except KeyError:
-        return None
-    curr_time = curr_time_utc()
-    curr_commit = curr_commit_master(repo_name, gh_username, gh_oauth_key)
-    return [get_record(dct, repo_name, curr_time, curr_commit) for dct in data]
+# Number of commit records to accumulate before pushing to BigQuery
+push_batch_size = 1000
+push_lock = threading.Lock()
+
+# Push a batch of commit records; the BigQuery client is shared between threads
+def push_batch(records):
+    with push_lock:
+        with metrics.timer('bigquery_push'):
+            push_bq_records(client, dataset, table, records)
+
+# Stream the commit records for a repo to BigQuery as pages arrive; for a repo already in
+# the table in an incremental sync, only the commits newer than the newest stored commit
+# Fetches up to parallel_pages pages at once; returns the number of records pushed
+def push_records(repo_name, parallel_pages = 1):
+    if repo_name in latest_commits:
+        last_sha, since = latest_commits[repo_name]
+        commits = iter_new_commits(repo_name, gh_username, gh_oauth_key, last_sha, since, parallel_pages)
+    else:
+        commits = iter_commits(repo_name, gh_username, gh_oauth_key, parallel_pages)
+
+    def records():
+        curr_time = curr_time_utc()
+        curr_commit = None
+        try:
+            for dct in commits:
+                if curr_commit is None:
+                    curr_commit = curr_commit_master(repo_name, gh_username, gh_oauth_key)
+                yield get_record(dct, repo_name, curr_time, curr_commit)
+        except IncompleteResponseError as e:
+            print("Skipping the rest of repo %s: %s" % (repo_name, e))
+        except ValueError:
+            # Repo not found
+            return
+    return push_bq_batches(records(), push_batch, push_batch_size)
+
+# Stream the commit records for a repo from a clone without file contents
+# Returns the number of records pushed
+def push_records_git(repo_name):
+    def records():
+        curr_time = curr_time_utc()
+        try:
+            with cloned_repo(repo_name, gh_username, gh_oauth_key, filter_blobs = True) as repo:
+                curr_commit = repo.head_sha()
+                for dct in repo.iter_commits():
+                    if repo_name in latest_commits and dct["sha"] == latest_commits[repo_name][0]:
+                        break
+                    yield get_record(dct, repo_name, curr_time, curr_commit)
+        except GitError as e:
+            print("Skipping repo %s: %s" % (repo_name, e))
+    return push_bq_batches(records(), push_batch, push_batch_size)
         
 print("%s\tGetting commit info from GitHub API and pushing to BigQuery table" % curr_time_utc())
 num_done = 0
 num_repos = len(repos)
-for repo_name in repos:
-    records = get_records(repo_name)
-    num_done = num_done + 1
-    if records is not None:
-        print("%s\tPushing %s commit records for repo %s/%s: %s" 
-              % (curr_time_utc(), len(records), num_done, num_repos, repo_name))
-        push_bq_records(client, dataset, table, records)
+for i in range(0, num_repos, async_requests.concurrency):
+    batch = repos[i:i + async_requests.concurrency]
+    if args.backend == 'git':
+        results = map_concurrently(push_records_git, batch)
     else:
-        print("%s\tPushing 0 commit records for repo %s/%s: %s" 
-              % (curr_time_utc(), num_done, num_repos, repo_name))
+        parallel_pages = pages_per_call(len(batch))
+        results = map_concurrently(lambda repo_name: push_records(repo_name, parallel_pages), batch)
+    for repo_name, num_pushed in zip(batch, results):
+        if isinstance(num_pushed, Exception):
+            raise num_pushed
+        num_done = num_done + 1
+        print("%s\tPushed %s commit records for repo %s/%s: %s" 
+              % (curr_time_utc(), num_pushed, num_done, num_repos, repo_name))
 
 
 
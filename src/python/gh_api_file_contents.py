@@ -1,9 +1,16 @@
 import argparse
+import sys
 from time import sleep
 
 from bigquery import get_client
 
-from gh_api import get_file_contents
+from gh_api import add_gh_api_args, configure_gh_api
+from gh_api import metrics
+from gh_api import curl_pool
+from gh_api import get_archive_contents, get_file_contents
+from gh_api import async_requests, map_concurrently
+from gh_api import CrawlPlan, print_plan
+from git_repo import GitError, cloned_repo
 from util import create_bq_table, push_bq_records
 from util import curr_time_utc
 from util import max_record_size
@@ -25,7 +32,13 @@ parser.add_argument('--gh_user', action = 'store', dest = 'gh_username', require
                     help = 'GitHub username for API')
 parser.add_argument('--gh_oauth_key', action = 'store', dest = 'gh_oauth_key', required = True, 
                     help = '(String) GitHub oauth key')
+parser.add_argument('--archive', action = 'store_true', dest = 'archive', 
+                    help = 'Download one tarball per repo at the commit the file info was listed at instead of one blob per file')
+parser.add_argument('--backend', action = 'store', dest = 'backend', choices = ['api', 'git'], default = 'api',
+                    help = 'api: GitHub API; git: a local clone of each repo, with no API requests')
+add_gh_api_args(parser)
 args = parser.parse_args()
+configure_gh_api(args)
  
 proj = args.proj
 json_key = args.json_key
@@ -50,15 +63,17 @@ schema = [
     {'name': 'time_accessed', 'type': 'STRING', 'mode': 'NULLABLE'}
 ]
 
-# Create table if necessary
-if not client.check_table(dataset, table_contents):
+# Create table if necessary; a plan leaves the dataset untouched
+if not args.plan and not client.check_table(dataset, table_contents):
     create_bq_table(client, dataset, table_contents, schema)
 
 # Get set of records already in contents table
 print("\nBuilding the set of existing records...")
-existing_contents_dicts = run_bq_query(client, """
-SELECT repo_name, path, sha FROM [%s:%s.%s]
-""" % (proj, dataset, table_contents), 120)
+existing_contents_dicts = []
+if client.check_table(dataset, table_contents):
+    existing_contents_dicts = run_bq_query(client, """
+    SELECT repo_name, path, sha FROM [%s:%s.%s]
+    """ % (proj, dataset, table_contents), 120)
 existing_contents = {(rec["repo_name"], rec["path"], rec["sha"]) for rec in existing_contents_dicts}
 num_already_done = len(existing_contents)
 if num_already_done > 0:
@@ -67,11 +82,37 @@ if num_already_done > 0:
 # Get list of file info records to download contents for 
 print("\nGetting file info records...")
 file_info_records = run_bq_query(client, """
-SELECT repo_name, file_name, path, sha, git_url, size FROM [%s:%s.%s] 
+SELECT repo_name, file_name, path, sha, git_url, size, curr_commit_master FROM [%s:%s.%s] 
 """ % (proj, dataset, table_info), 120)
 
+# Skip records already done
+records_to_do = [record for record in file_info_records 
+                 if (record["repo_name"], record["path"], record["sha"]) not in existing_contents]
+num_skipped_already_done = len(file_info_records) - len(records_to_do)
+
+# Group records by repo for archive downloads
+records_by_repo = {}
+for record in records_to_do:
+    records_by_repo.setdefault(record["repo_name"], []).append(record)
+
+if args.plan and args.backend == 'git':
+    print("The git backend makes no GitHub API requests except for files missing from the clones. %s repos to clone."
+          % len(records_by_repo))
+    sys.exit()
+if args.plan and args.archive:
+    plan = CrawlPlan("gh_api_file_contents", len(records_by_repo))
+    plan.add("repo archives", len(records_by_repo))
+    print_plan(plan, gh_username, gh_oauth_key)
+    sys.exit()
+if args.plan:
+    plan = CrawlPlan("gh_api_file_contents", len(records_to_do), "files")
+    plan.add("file contents (files under the record size limit)",
+             sum(1 for record in records_to_do if record["size"] <= max_record_size - 1000))
+    print_plan(plan, gh_username, gh_oauth_key)
+    sys.exit()
+
 # Get file contents
-def get_contents_record(file_info_record):
+def get_contents_record(file_info_record, archive_contents = None):
     repo_name = file_info_record["repo_name"]
     path = file_info_record["path"]
     git_url = file_info_record["git_url"]
@@ -79,10 +120,13 @@ def get_contents_record(file_info_record):
     contents = None
     size = file_info_record["size"]
     if size <= max_record_size - 1000:
-        try:
-            contents = get_file_contents(git_url, gh_username, gh_oauth_key)
-        except:
-            pass
+        if archive_contents is not None and (path, file_info_record["sha"]) in archive_contents:
+            contents = archive_contents[(path, file_info_record["sha"])]
+        else:
+            try:
+                contents = get_file_contents(git_url, gh_username, gh_oauth_key)
+            except:
+                pass
     return {'repo_name': repo_name,
             'file_name': file_info_record["file_name"],
             'path': path,
@@ -92,45 +136,76 @@ def get_contents_record(file_info_record):
             'time_accessed': curr_time}
     
     
-print("%s\tGetting file contents from GitHub API and pushing to file contents table" % curr_time_utc())
-num_done = 0
-num_skipped_already_done = 0
-num_to_do = len(file_info_records) - num_already_done
-recs_to_push = []
-for record in file_info_records:
-    # Skip if already done
-    if (record["repo_name"], record["path"], record["sha"]) in existing_contents:
-        num_skipped_already_done = num_skipped_already_done + 1
-        continue
-    recs_to_push.append(get_contents_record(record))
-    num_done = num_done + 1
-    if num_done % 100 == 0:
-        print("%s\tFinished %s/%s records. Pushing %s records to BigQuery."
-              % (curr_time_utc(), num_done, num_to_do, len(recs_to_push)))
-        try:
-            # Push the entire batch
-            push_bq_records(client, dataset, table_contents, recs_to_push, print_failed_records = False)
-        except RuntimeError:
-            # Try records individually
-            print("Batch push failed. Trying records individually every 2 seconds due to BigQuery rate limit.")
-            for rec in recs_to_push:
-                sleep(2.1)
+# Push a batch of contents records
+def push_contents_records(recs_to_push):
+    try:
+        # Push the entire batch
+        push_bq_records(client, dataset, table_contents, recs_to_push, print_failed_records = False)
+    except RuntimeError:
+        # Try records individually
+        print("Batch push failed. Trying records individually every 2 seconds due to BigQuery rate limit.")
+        for rec in recs_to_push:
+            sleep(2.1)
+            try:
+                push_bq_records(client, dataset, table_contents, [rec], print_failed_records = False)
+            except RuntimeError:
+                # Try setting contents to null
+                rec["contents"] = None
                 try:
                     push_bq_records(client, dataset, table_contents, [rec], print_failed_records = False)
                 except RuntimeError:
-                    # Try setting contents to null
-                    rec["contents"] = None
-                    try:
-                        push_bq_records(client, dataset, table_contents, [rec], print_failed_records = False)
-                    except RuntimeError:
-                        # Finally skip the record
-                        print("Skipping record. Repo: %s. File: %s." % (rec["repo_name"], rec["path"]))
-        recs_to_push.clear()
+                    # Finally skip the record
+                    print("Skipping record. Repo: %s. File: %s." % (rec["repo_name"], rec["path"]))
     
-# Final batch
-print("%s\tFinished %s/%s records. Pushing %s records to BigQuery."
-    % (curr_time_utc(), num_done, num_to_do, len(recs_to_push)))
-push_bq_records(client, dataset, table_contents, recs_to_push, print_failed_records = False)
+# Get contents records for a repo from its archive or a clone of its default branch;
+# files not found there are fetched individually
+def get_repo_contents_records(repo_name):
+    records = records_by_repo[repo_name]
+    wanted = [record for record in records if record["size"] <= max_record_size - 1000]
+    if args.backend == 'git':
+        try:
+            with cloned_repo(repo_name, gh_username, gh_oauth_key, depth = 1) as repo:
+                archive_contents = repo.get_contents(wanted)
+        except GitError as e:
+            print("Could not clone repo %s; getting files individually: %s" % (repo_name, e))
+            archive_contents = {}
+    else:
+        archive_contents = get_archive_contents(repo_name, records[0]["curr_commit_master"] or "master", wanted,
+                                                gh_username, gh_oauth_key)
+    return [get_contents_record(record, archive_contents) for record in records]
+
+num_done = 0
+num_to_do = len(records_to_do)
+if args.archive or args.backend == 'git':
+    print("%s\tGetting file contents from repo %s and pushing to file contents table"
+          % (curr_time_utc(), "clones" if args.backend == 'git' else "archives"))
+    repos = sorted(records_by_repo.keys())
+    for i in range(0, len(repos), async_requests.concurrency):
+        batch = repos[i:i + async_requests.concurrency]
+        for repo_name, recs in zip(batch, map_concurrently(get_repo_contents_records, batch)):
+            if isinstance(recs, Exception):
+                raise recs
+            num_done = num_done + len(recs)
+            print("%s\tFinished %s/%s records. Pushing %s records for repo %s to BigQuery."
+                  % (curr_time_utc(), num_done, num_to_do, len(recs), repo_name))
+            with metrics.timer('bigquery_push'):
+                for j in range(0, len(recs), 100):
+                    push_contents_records(recs[j:j + 100])
+    print("%s\tConnection reuse: %s" % (curr_time_utc(), curl_pool.summary()))
+    sys.exit()
+
+print("%s\tGetting file contents from GitHub API and pushing to file contents table" % curr_time_utc())
+for i in range(0, num_to_do, 100):
+    recs_to_push = map_concurrently(get_contents_record, records_to_do[i:i + 100])
+    for rec in recs_to_push:
+        if isinstance(rec, Exception):
+            raise rec
+    num_done = num_done + len(recs_to_push)
+    print("%s\tFinished %s/%s records. Pushing %s records to BigQuery."
+          % (curr_time_utc(), num_done, num_to_do, len(recs_to_push)))
+    with metrics.timer('bigquery_push'):
+        push_contents_records(recs_to_push)
+print("%s\tConnection reuse: %s" % (curr_time_utc(), curl_pool.summary()))
 
 
 
@@ -1,12 +1,21 @@
 import argparse
+import sys
 
 from bigquery import get_client
 
+from gh_api import add_gh_api_args, configure_gh_api
+from gh_api import metrics
 from gh_api import curr_commit_master
-from gh_api import get_file_info
+from gh_api import async_requests, map_concurrently
+from gh_api import get_file_info, get_file_info_tree
+from gh_api import CrawlPlan, print_plan
+from gh_api import IncompleteResponseError
+from gh_api.planner import default_dirs_per_repo
+from git_repo import GitError, cloned_repo
 from util import create_bq_table, push_bq_records
 from util import curr_time_utc
 from util import get_repo_names
+from util import mean_group_size
 from util import unique_vals
 
 
@@ -25,7 +34,13 @@ parser.add_argument('--gh_user', action = 'store', dest = 'gh_username', require
                     help = 'GitHub username for API')
 parser.add_argument('--gh_oauth_key', action = 'store', dest = 'gh_oauth_key', required = True, 
                     help = '(String) GitHub oauth key')
+parser.add_argument('--contents_api', action = 'store_true', dest = 'contents_api', 
+                    help = 'List files with one contents API request per directory instead of one git trees request per repo')
+parser.add_argument('--backend', action = 'store', dest = 'backend', choices = ['api', 'git'], default = 'api',
+                    help = 'api: GitHub API; git: a local clone of each repo, with no API requests')
+add_gh_api_args(parser)
 args = parser.parse_args()
+configure_gh_api(args)
  
 proj = args.proj
 json_key = args.json_key
@@ -49,6 +64,26 @@ existing_repos = unique_vals(client, proj, dataset, table, "repo_name")
 if len(existing_repos) > 0:
     repos = [repo for repo in repos if repo not in existing_repos]
     print("Only getting data for %s repos not yet analyzed" %len(repos))
+
+if args.plan and args.backend == 'git':
+    print("The git backend makes no GitHub API requests. %s repos to clone." % len(repos))
+    sys.exit()
+
+# Estimate the cost from the mean directory count of repos already in the table
+if args.plan and args.contents_api:
+    dirs_per_repo = mean_group_size(client, proj, dataset, table, "repo_name",
+                                    "COUNT(DISTINCT REGEXP_EXTRACT(path, r'^(.*)/')) + 1") or default_dirs_per_repo
+    plan = CrawlPlan("gh_api_file_info", len(repos))
+    plan.add("directory listings (%.0f directories per repo)" % dirs_per_repo, len(repos) * dirs_per_repo)
+    plan.add("current commit on master", len(repos))
+    print_plan(plan, gh_username, gh_oauth_key)
+    sys.exit()
+if args.plan:
+    plan = CrawlPlan("gh_api_file_info", len(repos))
+    plan.add("git tree listings", len(repos))
+    plan.add("current commit on master", len(repos))
+    print_plan(plan, gh_username, gh_oauth_key)
+    sys.exit()
  
 # Table schema
 schema = [
@@ -72,9 +107,31 @@ if not client.check_table(dataset, table):
 
 # Get list of file info records for a repo
 def get_file_info_records(repo_name):
-    data = get_file_info(repo_name, gh_username, gh_oauth_key)
-    curr_time = curr_time_utc()
+    if args.backend == 'git':
+        try:
+            with cloned_repo(repo_name, gh_username, gh_oauth_key, depth = 1) as repo:
+                curr_commit = repo.head_sha()
+                data = repo.file_info(curr_commit)
+        except GitError as e:
+            print("Skipping repo %s: %s" % (repo_name, e))
+            return []
+        return file_info_records(repo_name, data, curr_commit)
     curr_commit = curr_commit_master(repo_name, gh_username, gh_oauth_key)
+    if args.contents_api:
+        data = get_file_info(repo_name, gh_username, gh_oauth_key)
+    else:
+        # List the files at the commit recorded with them, or on the default branch if there is
+        # no master branch; if the tree cannot be listed, fall back to the contents API
+        try:
+            data = get_file_info_tree(repo_name, gh_username, gh_oauth_key, curr_commit)
+        except ValueError as e:
+            print("Listing repo %s with the contents API: %s" % (repo_name, str(e).splitlines()[0]))
+            data = get_file_info(repo_name, gh_username, gh_oauth_key)
+    return file_info_records(repo_name, data, curr_commit)
+
+# Get table records from file info dicts
+def file_info_records(repo_name, data, curr_commit):
+    curr_time = curr_time_utc()
     return [{'repo_name': repo_name,
              'file_name': record['name'],
              'path': record['path'],
@@ -91,12 +148,19 @@ def get_file_info_records(repo_name):
 print("%s\tGetting file info from GitHub API and pushing to file info table" % curr_time_utc())
 num_done = 0
 num_repos = len(repos)
-for repo_name in repos:
-    file_info_records = get_file_info_records(repo_name)
-    num_done = num_done + 1
-    print("%s\tPushing %s file info records for repo %s/%s: %s" 
-          % (curr_time_utc(), len(file_info_records), num_done, num_repos, repo_name))
-    push_bq_records(client, dataset, table, file_info_records)
+for i in range(0, num_repos, async_requests.concurrency):
+    batch = repos[i:i + async_requests.concurrency]
+    for repo_name, file_info_records in zip(batch, map_concurrently(get_file_info_records, batch)):
+        num_done = num_done + 1
+        if isinstance(file_info_records, IncompleteResponseError):
+            print("Skipping repo %s: %s" % (repo_name, file_info_records))
+            continue
+        if isinstance(file_info_records, Exception):
+            raise file_info_records
+        print("%s\tPushing %s file info records for repo %s/%s: %s" 
+              % (curr_time_utc(), len(file_info_records), num_done, num_repos, repo_name))
+        with metrics.timer('bigquery_push'):
+            push_bq_records(client, dataset, table, file_info_records)
 
 
 
@@ -1,8 +1,16 @@
 import argparse
+import sys
 
 from bigquery import get_client
 
-from gh_api import get_initial_commit
+from gh_api import add_gh_api_args, configure_gh_api
+from gh_api import metrics
+from gh_api import get_initial_commit, get_initial_commits
+from gh_api import count_commits
+from gh_api import async_requests, map_concurrently, pages_per_call
+from gh_api import CrawlPlan, num_pages, print_plan
+from gh_api.planner import default_commits_per_repo
+from git_repo import GitError, cloned_repo
 import pycurl
 from util import create_bq_table, push_bq_records
 from util import curr_time_utc
@@ -24,7 +32,16 @@ parser.add_argument('--gh_user', action = 'store', dest = 'gh_username', require
                     help = 'GitHub username for API')
 parser.add_argument('--gh_oauth_key', action = 'store', dest = 'gh_oauth_key', required = True, 
                     help = '(String) GitHub oauth key')
+parser.add_argument('--mode', action = 'store', dest = 'mode', choices = ['file', 'repo', 'auto'], default = 'auto',
+                    help = 'file: list the commits of each file; repo: walk each repo\'s history once from the oldest commit, '
+                    'with one request per commit walked, until every file is seen, taking the earliest date among the '
+                    'commits walked, so a commit with an earlier date listed later is not considered; '
+                    'auto: choose per repo from its commit count, whichever takes fewer requests')
+parser.add_argument('--backend', action = 'store', dest = 'backend', choices = ['api', 'git'], default = 'api',
+                    help = 'api: GitHub API; git: a local clone of each repo, with no API requests')
+add_gh_api_args(parser)
 args = parser.parse_args()
+configure_gh_api(args)
  
 proj = args.proj
 json_key = args.json_key
@@ -47,15 +64,17 @@ schema = [
     {'name': 'init_commit_timestamp', 'type': 'STRING', 'mode': 'NULLABLE'}
 ]
 
-# Create table if necessary
-if not client.check_table(dataset, table_init_commit):
+# Create table if necessary; a plan leaves the dataset untouched
+if not args.plan and not client.check_table(dataset, table_init_commit):
     create_bq_table(client, dataset, table_init_commit, schema)
 
 # Get set of records already in table
 print("\nBuilding the set of existing records...")
-existing_records_dicts = run_bq_query(client, """
-SELECT repo_name, path, sha FROM [%s:%s.%s]
-""" % (proj, dataset, table_init_commit), 120)
+existing_records_dicts = []
+if client.check_table(dataset, table_init_commit):
+    existing_records_dicts = run_bq_query(client, """
+    SELECT repo_name, path, sha FROM [%s:%s.%s]
+    """ % (proj, dataset, table_init_commit), 120)
 existing_records = {(rec["repo_name"], rec["path"], rec["sha"]) for rec in existing_records_dicts}
 num_already_done = len(existing_records)
 if num_already_done > 0:
@@ -67,6 +86,44 @@ file_info_records = run_bq_query(client, """
 SELECT repo_name, file_name, path, sha FROM [%s:%s.%s] 
 """ % (proj, dataset, table_info), 120)
 
+# Skip records already done
+records_to_do = [record for record in file_info_records 
+                 if (record["repo_name"], record["path"], record["sha"]) not in existing_records]
+num_skipped_already_done = len(file_info_records) - len(records_to_do)
+
+# Group records by repo for history walks
+records_by_repo = {}
+for record in records_to_do:
+    records_by_repo.setdefault(record["repo_name"], []).append(record)
+
+# Requests to walk a repo's history: one per page of commits plus one per commit
+def walk_cost(num_commits):
+    return num_pages(num_commits) + num_commits
+
+if args.plan and args.backend == 'git':
+    print("The git backend makes no GitHub API requests. %s repos to clone." % len(records_by_repo))
+    sys.exit()
+
+# Each file takes one paginated listing of the commits that touched it; most fit on one page.
+# A walk costs at most walk_cost requests and stops once all of the repo's files are seen.
+if args.plan:
+    plan = CrawlPlan("gh_api_file_init_commit", len(records_to_do), "files")
+    if args.mode == 'file':
+        plan.add("commit listings by path", len(records_to_do), len(records_to_do))
+    else:
+        walk = walk_cost(default_commits_per_repo)
+        if args.mode == 'auto':
+            plan.add("commit counts", len(records_by_repo))
+            walked = [repo for repo, recs in records_by_repo.items() if walk < len(recs)]
+        else:
+            walked = list(records_by_repo.keys())
+        num_by_path = len(records_to_do) - sum(len(records_by_repo[repo]) for repo in walked)
+        plan.add("history walks (%s commits per repo)" % default_commits_per_repo,
+                 len(walked) * walk, len(walked) * num_pages(default_commits_per_repo))
+        plan.add("commit listings by path", num_by_path, num_by_path)
+    print_plan(plan, gh_username, gh_oauth_key)
+    sys.exit()
+
 # Get initial commit
 def get_init_commit(file_info_record):
     repo_name = file_info_record["repo_name"]
@@ -77,34 +134,102 @@ def get_init_commit(file_info_record):
             'sha': file_info_record["sha"],
             'init_commit_timestamp': get_initial_commit(repo_name, path, gh_username, gh_oauth_key).isoformat()}
     
-    
-print("%s\tGetting file initial commit times from GitHub API and pushing to table" % curr_time_utc())
+
+# Get initial commits for all files of a repo from one walk of its history, fetching up to
+# parallel_pages pages or commits at once. Paths the walk did not find, e.g. paths first added
+# in a merge commit, are looked up one at a time. Returns the records and the number of paths
+# looked up one at a time.
+def get_repo_init_commits(repo_name, parallel_pages = 1):
+    recs = records_by_repo[repo_name]
+    paths = [rec["path"] for rec in recs]
+    if args.backend == 'git':
+        try:
+            with cloned_repo(repo_name, gh_username, gh_oauth_key, filter_blobs = True) as repo:
+                init_commits = repo.initial_commits(paths)
+                missing = [path for path in paths if path not in init_commits]
+                for path in missing:
+                    init_commit = repo.initial_commit(path)
+                    if init_commit is None:
+                        print("No commits for repo %s and path %s; skipping" % (repo_name, path))
+                    else:
+                        init_commits[path] = init_commit
+        except GitError as e:
+            raise ValueError("Could not clone repo %s: %s" % (repo_name, e))
+    else:
+        init_commits = get_initial_commits(repo_name, paths, gh_username, gh_oauth_key, parallel_pages)
+        missing = [path for path in paths if path not in init_commits]
+        for path in missing:
+            try:
+                init_commits[path] = get_initial_commit(repo_name, path, gh_username, gh_oauth_key)
+            except ValueError as e:
+                print("Caught ValueError; skipping repo %s and path %s. Error:\n%s" % (repo_name, path, e))
+    records = [{'repo_name': repo_name,
+                'file_name': rec["file_name"],
+                'path': rec["path"],
+                'sha': rec["sha"],
+                'init_commit_timestamp': init_commits[rec["path"]].isoformat()}
+               for rec in recs if rec["path"] in init_commits]
+    return records, len(missing)
+
+# Choose the repos to walk
+walk_repos = []
+if args.mode == 'repo' or args.backend == 'git':
+    walk_repos = sorted(records_by_repo.keys())
+elif args.mode == 'auto':
+    print("%s\tCounting commits to choose between history walks and listings by path" % curr_time_utc())
+    repos = sorted(records_by_repo.keys())
+    for i in range(0, len(repos), async_requests.concurrency):
+        batch = repos[i:i + async_requests.concurrency]
+        for repo_name, num_commits in zip(batch, map_concurrently(lambda repo_name: count_commits(repo_name, gh_username, gh_oauth_key), batch)):
+            if isinstance(num_commits, Exception):
+                print("Caught %s counting commits for repo %s; getting files by path" % (type(num_commits).__name__, repo_name))
+            elif walk_cost(num_commits) < len(records_by_repo[repo_name]):
+                walk_repos.append(repo_name)
+    print("Walking the history of %s of %s repos" % (len(walk_repos), len(records_by_repo)))
+
 num_done = 0
-num_skipped_already_done = 0
-num_to_do = len(file_info_records) - num_already_done
-recs_to_push = []
-for record in file_info_records:
-    # Skip if already done
-    if (record["repo_name"], record["path"], record["sha"]) in existing_records:
-        num_skipped_already_done = num_skipped_already_done + 1
-        continue
-    try:
-        recs_to_push.append(get_init_commit(record))
-    except ValueError as e:
-        print("Caught ValueError; skipping repo %s and path %s. Error:\n%s" % (record["repo_name"], record["path"], e))
-    except pycurl.error as e:
-        print("Caught pycurl.error; skipping repo %s and path %s. Error:\n%s" % (record["repo_name"], record["path"], e))
-    num_done = num_done + 1
-    if num_done % 100 == 0:
-        print("%s\tFinished %s/%s records. Pushing %s records to BigQuery."
-              % (curr_time_utc(), num_done, num_to_do, len(recs_to_push)))
+num_to_do = len(records_to_do)
+if len(walk_repos) > 0:
+    print("%s\tWalking commit histories and pushing initial commit times to table" % curr_time_utc())
+    for i in range(0, len(walk_repos), async_requests.concurrency):
+        batch = walk_repos[i:i + async_requests.concurrency]
+        parallel_pages = pages_per_call(len(batch))
+        results = map_concurrently(lambda repo_name: get_repo_init_commits(repo_name, parallel_pages), batch)
+        for repo_name, result in zip(batch, results):
+            num_done = num_done + len(records_by_repo[repo_name])
+            if isinstance(result, (ValueError, pycurl.error)):
+                print("Caught %s; skipping repo %s. Error:\n%s" % (type(result).__name__, repo_name, result))
+                continue
+            if isinstance(result, Exception):
+                raise result
+            records, num_missing = result
+            print("%s\tFinished %s/%s records. Pushing %s records for repo %s to BigQuery; "
+                  "%s paths were not found in the walk and were looked up by path."
+                  % (curr_time_utc(), num_done, num_to_do, len(records), repo_name, num_missing))
+            with metrics.timer('bigquery_push'):
+                for j in range(0, len(records), 100):
+                    push_bq_records(client, dataset, table_init_commit, records[j:j + 100], print_failed_records = True)
+    walked = set(walk_repos)
+    records_to_do = [record for record in records_to_do if record["repo_name"] not in walked]
+
+print("%s\tGetting file initial commit times from GitHub API and pushing to table" % curr_time_utc())
+for i in range(0, len(records_to_do), 100):
+    batch = records_to_do[i:i + 100]
+    recs_to_push = []
+    for record, result in zip(batch, map_concurrently(get_init_commit, batch)):
+        if isinstance(result, ValueError):
+            print("Caught ValueError; skipping repo %s and path %s. Error:\n%s" % (record["repo_name"], record["path"], result))
+        elif isinstance(result, pycurl.error):
+            print("Caught pycurl.error; skipping repo %s and path %s. Error:\n%s" % (record["repo_name"], record["path"], result))
+        elif isinstance(result, Exception):
+            raise result
+        else:
+            recs_to_push.append(result)
+    num_done = num_done + len(batch)
+    print("%s\tFinished %s/%s records. Pushing %s records to BigQuery."
+          % (curr_time_utc(), num_done, num_to_do, len(recs_to_push)))
+    with metrics.timer('bigquery_push'):
         push_bq_records(client, dataset, table_init_commit, recs_to_push, print_failed_records = True)
-        recs_to_push.clear()
-    
-# Final batch
-print("%s\tFinished %s/%s records. Pushing %s records to BigQuery."
-    % (curr_time_utc(), num_done, num_to_do, len(recs_to_push)))
-push_bq_records(client, dataset, table_init_commit, recs_to_push, print_failed_records = True)
 
 
 
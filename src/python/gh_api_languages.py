@@ -1,9 +1,15 @@
 import argparse
+import sys
 
 from bigquery import get_client
 
+from gh_api import add_gh_api_args, configure_gh_api
+from gh_api import metrics
 from gh_api import curr_commit_master
 from gh_api import get_language_bytes
+from gh_api import map_concurrently
+from gh_api import CrawlPlan, num_pages, print_plan
+from gh_api import get_repo_metadata, max_repos_per_query
 from util import curr_time_utc
 from util import delete_bq_table, create_bq_table, push_bq_records
 from util import get_repo_names
@@ -22,7 +28,11 @@ parser.add_argument('--gh_user', action = 'store', dest = 'gh_username', require
                     help = 'GitHub username for API')
 parser.add_argument('--gh_oauth_key', action = 'store', dest = 'gh_oauth_key', required = True, 
                     help = '(String) GitHub oauth key')
+parser.add_argument('--graphql', action = 'store_true', dest = 'graphql',
+                    help = 'Fetch repo metadata for 100 repos per request from the GraphQL API')
+add_gh_api_args(parser)
 args = parser.parse_args()
+configure_gh_api(args)
  
 dataset = args.ds
 json_key = args.json_key
@@ -40,6 +50,16 @@ print("There are %s repos with use_repo = 1.\n" % len(repos))
 print('\nGetting BigQuery client\n')
 client = get_client(json_key_file=json_key, readonly=False, swallow_results=True)
  
+if args.plan:
+    plan = CrawlPlan("gh_api_languages", len(repos))
+    if args.graphql:
+        plan.add("GraphQL queries of %s repos" % max_repos_per_query, num_pages(len(repos), max_repos_per_query))
+    else:
+        plan.add("language breakdowns", len(repos))
+        plan.add("current commit on master", len(repos))
+    print_plan(plan, gh_username, gh_oauth_key)
+    sys.exit()
+
 # Delete the output table if it exists
 delete_bq_table(client, dataset, table)
  
@@ -63,22 +83,45 @@ def get_records(repo_name):
              'language_bytes': data[key],
              'curr_commit_master': curr_commit,
              'time_accessed': curr_time} for key in data.keys()]
+
+# Get language records for a batch of repos with one GraphQL query
+def get_records_graphql(batch):
+    metadata = get_repo_metadata(batch, gh_username, gh_oauth_key)
+    curr_time = curr_time_utc()
+    records = []
+    for repo_name in batch:
+        m = metadata[repo_name]
+        if m is None:
+            print("Skipping repo %s: not found" % repo_name)
+            continue
+        records.extend([{'repo_name': repo_name,
+                         'language_name': key,
+                         'language_bytes': m['language_bytes'][key],
+                         'curr_commit_master': m['curr_commit_master'],
+                         'time_accessed': curr_time} for key in m['language_bytes'].keys()])
+    return records
     
 print("Getting language info from GitHub API")
 records = []
 num_done = 0
-for repo_name in repos:
-    try:
-        for record in get_records(repo_name):
-            records.append(record)
-    except UnicodeEncodeError:
-        print("Skipping repo %s" % repo_name)
-    num_done = num_done + 1
-    if num_done % 100 == 0:
-        print("Finished %s repos. Pushing records." % num_done)
+for i in range(0, len(repos), 100):
+    batch = repos[i:i + 100]
+    if args.graphql:
+        records = get_records_graphql(batch)
+    else:
+        for repo_name, result in zip(batch, map_concurrently(get_records, batch)):
+            if isinstance(result, UnicodeEncodeError):
+                print("Skipping repo %s" % repo_name)
+            elif isinstance(result, Exception):
+                raise result
+            else:
+                for record in result:
+                    records.append(record)
+    num_done = num_done + len(batch)
+    print("Finished %s repos. Pushing records." % num_done)
+    with metrics.timer('bigquery_push'):
         push_bq_records(client, dataset, table, records)
-        records.clear()
-push_bq_records(client, dataset, table, records) # Last batch
+    records.clear()
 
 
 
@@ -1,11 +1,20 @@
 import argparse
+import sys
 
 from bigquery import get_client
 
+from gh_api import add_gh_api_args, configure_gh_api
+from gh_api import metrics
 from gh_api import curr_commit_master
-from gh_api import get_pull_requests
-from util import create_bq_table, push_bq_records
-from util import get_repo_names, curr_time_utc
+from gh_api import async_requests, map_concurrently, pages_per_call
+from gh_api import count_pull_requests, get_pull_requests, iter_updated_pull_requests
+from gh_api import CrawlPlan, num_pages, print_plan
+from gh_api import IncompleteResponseError
+from gh_api.planner import default_pull_requests_per_repo
+from util import add_bq_columns, create_bq_table, create_bq_view, push_bq_counts, push_bq_records
+from util import get_repo_names, curr_time_utc, iso_time_utc
+from util import mean_group_size
+from util import run_bq_query
 from util import unique_vals
 
 
@@ -24,7 +33,14 @@ parser.add_argument('--gh_user', action = 'store', dest = 'gh_username', require
                     help = 'GitHub username for API')
 parser.add_argument('--gh_oauth_key', action = 'store', dest = 'gh_oauth_key', required = True, 
                     help = '(String) GitHub oauth key')
+parser.add_argument('--counts-only', action = 'store_true', dest = 'counts_only',
+                    help = 'Write only the number of pull requests per repo, with one request per repo')
+parser.add_argument('--incremental', action = 'store_true', dest = 'incremental',
+                    help = 'For repos already in the table, append only the pull requests updated since the latest stored update; '
+                           'the <table>_latest view has the current row of each pull request')
+add_gh_api_args(parser)
 args = parser.parse_args()
+configure_gh_api(args)
 
 proj = args.proj
 json_key = args.json_key
@@ -43,11 +59,68 @@ print("There are %s repos with use_repo = 1.\n" % len(repos))
 print('\nGetting BigQuery client\n')
 client = get_client(json_key_file=json_key, readonly=False, swallow_results=True)
 
+# Latest stored update time of each repo already in the table, with the ids of the pull
+# requests stored as updated at that time, for an incremental sync. Repos stored before
+# updated_at was recorded are synced from the latest time they were accessed.
+latest_updates = {}
+access_times = {}
+incremental = args.incremental and not args.counts_only
+if incremental and client.check_table(dataset, table):
+    if 'updated_at' in [field['name'] for field in client.get_table_schema(dataset, table)]:
+        for rec in run_bq_query(client, """
+        SELECT repo_name, updated_at, GROUP_CONCAT(pr_id) AS pr_ids
+        FROM (SELECT repo_name, pr_id, updated_at, MAX(updated_at) OVER (PARTITION BY repo_name) AS latest
+              FROM [%s:%s.%s])
+        WHERE updated_at = latest
+        GROUP BY repo_name, updated_at
+        """ % (proj, dataset, table), 120):
+            if rec["updated_at"] is not None:
+                latest_updates[rec["repo_name"]] = (rec["updated_at"], set(rec["pr_ids"].split(",")))
+    # time_accessed is not sortable as a string, so the latest is found here
+    for rec in run_bq_query(client, "SELECT repo_name, time_accessed FROM [%s:%s.%s] GROUP BY repo_name, time_accessed"
+                            % (proj, dataset, table), 120):
+        if rec["repo_name"] not in latest_updates:
+            accessed = iso_time_utc(rec["time_accessed"])
+            if accessed > access_times.get(rec["repo_name"], ""):
+                access_times[rec["repo_name"]] = accessed
+    for repo_name, accessed in access_times.items():
+        latest_updates[repo_name] = (accessed, set())
+    print("Getting updated pull requests for %s repos already in the table"
+          % len([repo for repo in repos if repo in latest_updates]))
+
 # Check which repos are already in the table
-existing_repos = unique_vals(client, proj, dataset, table, "repo_name")
-if len(existing_repos) > 0:
-    repos = [repo for repo in repos if repo not in existing_repos]
-    print("Only getting data for %s repos not yet analyzed" %len(repos))
+if not incremental:
+    existing_repos = unique_vals(client, proj, dataset, table, "repo_name")
+    if len(existing_repos) > 0:
+        repos = [repo for repo in repos if repo not in existing_repos]
+        print("Only getting data for %s repos not yet analyzed" %len(repos))
+
+# Estimate the cost from the mean pull request count of repos already in the table
+if args.plan and args.counts_only:
+    plan = CrawlPlan("gh_api_pr_data", len(repos))
+    plan.add("pull request counts", len(repos))
+    print_plan(plan, gh_username, gh_oauth_key)
+    sys.exit()
+if args.plan:
+    prs_per_repo = mean_group_size(client, proj, dataset, table, "repo_name") or default_pull_requests_per_repo
+    num_synced = len([repo for repo in repos if repo in latest_updates])
+    num_new = len(repos) - num_synced
+    plan = CrawlPlan("gh_api_pr_data", len(repos))
+    plan.add("pull request listing pages (%.0f pull requests per repo)" % prs_per_repo,
+             num_new * num_pages(prs_per_repo), num_new * num_pages(prs_per_repo))
+    if num_synced > 0:
+        plan.add("updated pull request listings of repos already in the table", num_synced, num_synced)
+    plan.add("current commit on master", len(repos))
+    print_plan(plan, gh_username, gh_oauth_key)
+    sys.exit()
+
+# Write only the pull request count of each repo, read from the last page link of a one-record page
+if args.counts_only:
+    print("%s\tGetting pull request counts from GitHub API" % curr_time_utc())
+    push_bq_counts(client, dataset, table, repos,
+                   lambda repo_name: count_pull_requests(repo_name, gh_username, gh_oauth_key, "all"),
+                   'pr_count', map_concurrently, lambda: metrics.timer('bigquery_push'))
+    sys.exit()
 
 # Table schema
 schema = [
@@ -60,16 +133,25 @@ schema = [
     {'name': 'body', 'type': 'STRING', 'mode': 'NULLABLE'},
     {'name': 'user_login', 'type': 'STRING', 'mode': 'NULLABLE'},
     {'name': 'user_id', 'type': 'STRING', 'mode': 'NULLABLE'},
+    {'name': 'updated_at', 'type': 'STRING', 'mode': 'NULLABLE'},
     {'name': 'curr_commit_master', 'type': 'STRING', 'mode': 'NULLABLE'},
     {'name': 'time_accessed', 'type': 'STRING', 'mode': 'NULLABLE'}
 ]
-# Create table if necessary
+# Create table if necessary, or add columns added to the schema since it was created
 if not client.check_table(dataset, table):
     create_bq_table(client, dataset, table, schema)
+else:
+    add_bq_columns(client, dataset, table, schema)
+# View of the current version of each pull request, its most recently updated row
+columns = ", ".join(field['name'] for field in schema)
+create_bq_view(client, dataset, "%s_latest" % table, """
+SELECT %s
+FROM (SELECT %s, ROW_NUMBER() OVER (PARTITION BY repo_name, pr_id ORDER BY updated_at DESC) AS row_num
+      FROM [%s:%s.%s])
+WHERE row_num = 1
+""" % (columns, columns, proj, dataset, table))
 
-def get_record(repo_name, pr_data):
-    curr_time = curr_time_utc()
-    curr_commit = curr_commit_master(repo_name, gh_username, gh_oauth_key)
+def get_record(repo_name, pr_data, curr_commit, curr_time):
     return {'repo_name': repo_name,
             'pr_id': pr_data['id'],
             'state': pr_data['state'],
@@ -79,27 +161,55 @@ def get_record(repo_name, pr_data):
             'body': pr_data['body'],
             'user_login': pr_data['user']['login'],
             'user_id': pr_data['user']['id'],
+            'updated_at': pr_data.get('updated_at'),
             'curr_commit_master': curr_commit,
             'time_accessed': curr_time}
     
+# Get the records of all pull requests of a repo, or in an incremental sync of a repo already
+# in the table, of those updated since the latest stored update, leaving out the pull requests
+# stored with that update time, so an unchanged repo appends nothing. BigQuery streaming inserts
+# only append, so a changed pull request is stored again, and the <table>_latest view keeps
+# only its most recently updated row. Fetches up to parallel_pages pages at once.
+def get_records(repo_name, parallel_pages = 1):
+    if repo_name in latest_updates:
+        since, seen_ids = latest_updates[repo_name]
+        pulls = list(iter_updated_pull_requests(repo_name, gh_username, gh_oauth_key, since,
+                                                parallel_pages = parallel_pages, seen_ids = seen_ids))
+    else:
+        pulls = get_pull_requests(repo_name, gh_username, gh_oauth_key, "all", parallel_pages)
+    if len(pulls) == 0:
+        return []
+    # The head commit and access time are the same for all pull requests of the repo
+    curr_time = curr_time_utc()
+    curr_commit = curr_commit_master(repo_name, gh_username, gh_oauth_key)
+    return [get_record(repo_name, pr, curr_commit, curr_time) for pr in pulls]
+    
 print("Getting pull request info from GitHub API")
 num_done = 0
 num_repos = len(repos)
-for repo_name in repos:
-    num_done = num_done + 1
-    try:
-        records = [get_record(repo_name, pr) for pr in get_pull_requests(repo_name, gh_username, gh_oauth_key, "all")]
-        if records is not None:
-            print("%s\tPushing %s pull request records for repo %s/%s: %s" 
-                  % (curr_time_utc(), len(records), num_done, num_repos, repo_name))
-            push_bq_records(client = client, dataset = dataset, table = table, records = records, max_batch = 10)
-        else:
-            print("%s\tPushing 0 pull request records for repo %s/%s: %s" 
-                  % (curr_time_utc(), num_done, num_repos, repo_name))
-    except KeyError:
-        print("Skipping repo %s: %s" % (repo_name, pr['message']))
-    except UnicodeEncodeError as e:
-        print("Skipping repo %s: %s" % (repo_name, str(e)))
+for i in range(0, num_repos, async_requests.concurrency):
+    batch = repos[i:i + async_requests.concurrency]
+    parallel_pages = pages_per_call(len(batch))
+    for repo_name, records in zip(batch, map_concurrently(lambda repo_name: get_records(repo_name, parallel_pages),
+                                                          batch)):
+        num_done = num_done + 1
+        try:
+            if isinstance(records, Exception):
+                raise records
+            if records is not None:
+                print("%s\tPushing %s pull request records for repo %s/%s: %s" 
+                      % (curr_time_utc(), len(records), num_done, num_repos, repo_name))
+                with metrics.timer('bigquery_push'):
+                    push_bq_records(client = client, dataset = dataset, table = table, records = records, max_batch = 10)
+            else:
+                print("%s\tPushing 0 pull request records for repo %s/%s: %s" 
+                      % (curr_time_utc(), num_done, num_repos, repo_name))
+        except KeyError as e:
+            print("Skipping repo %s: %s" % (repo_name, str(e)))
+        except IncompleteResponseError as e:
+            print("Skipping repo %s: %s" % (repo_name, str(e)))
+        except UnicodeEncodeError as e:
+            print("Skipping repo %s: %s" % (repo_name, str(e)))
 
 
 
@@ -1,9 +1,15 @@
 import argparse
+import sys
 
 from bigquery import get_client
 
+from gh_api import add_gh_api_args, configure_gh_api
+from gh_api import metrics
 from gh_api import curr_commit_master
+from gh_api import map_concurrently
 from gh_api import repo
+from gh_api import CrawlPlan, num_pages, print_plan
+from gh_api import get_repo_metadata, max_repos_per_query
 from util import create_bq_table, push_bq_records
 from util import get_repo_names, curr_time_utc
 from util import unique_vals
@@ -24,7 +30,11 @@ parser.add_argument('--gh_user', action = 'store', dest = 'gh_username', require
                     help = 'GitHub username for API')
 parser.add_argument('--gh_oauth_key', action = 'store', dest = 'gh_oauth_key', required = True, 
                     help = '(String) GitHub oauth key')
+parser.add_argument('--graphql', action = 'store_true', dest = 'graphql',
+                    help = 'Fetch repo metadata for 100 repos per request from the GraphQL API')
+add_gh_api_args(parser)
 args = parser.parse_args()
+configure_gh_api(args)
 
 proj = args.proj
 json_key = args.json_key
@@ -49,6 +59,16 @@ if len(existing_repos) > 0:
     repos = [repo for repo in repos if repo not in existing_repos]
     print("Only getting data for %s repos not yet analyzed" %len(repos))
 
+if args.plan:
+    plan = CrawlPlan("gh_api_repo_metrics", len(repos))
+    if args.graphql:
+        plan.add("GraphQL queries of %s repos" % max_repos_per_query, num_pages(len(repos), max_repos_per_query))
+    else:
+        plan.add("repository metadata", len(repos))
+        plan.add("current commit on master", len(repos))
+    print_plan(plan, gh_username, gh_oauth_key)
+    sys.exit()
+
 # Create the output table if necessary
 schema = [
     {'name': 'repo_name', 'type': 'STRING', 'mode': 'NULLABLE'},
@@ -84,20 +104,50 @@ def get_record(repo_name):
             'curr_commit_master': curr_commit,
             'time_accessed': curr_time}
     
+# Get records for a batch of repos with one GraphQL query
+def get_records_graphql(batch):
+    metadata = get_repo_metadata(batch, gh_username, gh_oauth_key)
+    curr_time = curr_time_utc()
+    records = []
+    for repo_name in batch:
+        m = metadata[repo_name]
+        if m is None:
+            print("Skipping repo %s: not found" % repo_name)
+            continue
+        records.append({'repo_name': repo_name,
+                        'api_url': m['api_url'],
+                        'html_url': m['html_url'],
+                        'description': m['description'],
+                        'is_fork': m['is_fork'],
+                        'stargazers_count': m['stargazers_count'],
+                        'watchers_count': m['watchers_count'],
+                        'forks_count': m['forks_count'],
+                        'open_issues_count': m['open_issues_count'],
+                        'subscribers_count': m['subscribers_count'],
+                        'curr_commit_master': m['curr_commit_master'],
+                        'time_accessed': curr_time})
+    return records
+    
 print("Getting repo info from GitHub API")
 records = []
 num_done = 0
-for repo_name in repos:
-    try:
-        records.append(get_record(repo_name))
-    except UnicodeEncodeError:
-        print("Skipping repo %s" % repo_name)
-    num_done = num_done + 1
-    if num_done % 100 == 0:
-        print("Finished %s repos. Pushing records." % num_done)
+for i in range(0, len(repos), 100):
+    batch = repos[i:i + 100]
+    if args.graphql:
+        records = get_records_graphql(batch)
+    else:
+        for repo_name, result in zip(batch, map_concurrently(get_record, batch)):
+            if isinstance(result, UnicodeEncodeError):
+                print("Skipping repo %s" % repo_name)
+            elif isinstance(result, Exception):
+                raise result
+            else:
+                records.append(result)
+    num_done = num_done + len(batch)
+    print("Finished %s repos. Pushing records." % num_done)
+    with metrics.timer('bigquery_push'):
         push_bq_records(client, dataset, table, records)
-        records.clear()
-push_bq_records(client, dataset, table, records) # Last batch
+    records.clear()
 
 
 
@@ -0,0 +1,6 @@
+from .clone import GitError
+from .clone import clone_repo
+from .clone import run_git
+from .clone import url_clone
+from .local_repo import LocalRepo
+from .local_repo import cloned_repo
@@ -0,0 +1,67 @@
+import base64
+import os
+import subprocess
+
+
+# Base URL repos are cloned from
+url_clone = "https://github.com"
+
+
+class GitError(RuntimeError):
+    """A git command failed, e.g. because the repo to clone does not exist"""
+
+
+def git_env(gh_username = None, gh_oauth_key = None):
+    """ Returns the environment for git commands: no prompts, dates in UTC, and the GitHub
+    credentials, if given, as an HTTP header passed through the environment rather than
+    the command line, so they are not visible in the process list
+    """
+    env = dict(os.environ, GIT_TERMINAL_PROMPT = "0", TZ = "UTC")
+    if gh_username is not None and gh_oauth_key is not None:
+        token = base64.b64encode(("%s:%s" % (gh_username, gh_oauth_key)).encode()).decode()
+        env.update(GIT_CONFIG_COUNT = "1",
+                   GIT_CONFIG_KEY_0 = "http.extraHeader",
+                   GIT_CONFIG_VALUE_0 = "Authorization: Basic %s" % token)
+    return env
+
+
+def run_git(args, cwd = None, env = None):
+    """ Runs a git command and returns its output as bytes
+    Raises GitError if the command fails.
+
+    Args:
+        args: Arguments after 'git'
+        cwd: Directory to run in
+        env: Environment, by default git_env()
+    """
+    result = subprocess.run(["git"] + list(args), cwd = cwd, env = env if env is not None else git_env(),
+                            stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+    if result.returncode != 0:
+        raise GitError("git %s failed: %s" % (" ".join(args[:2]), result.stderr.decode(errors = "replace").strip()))
+    return result.stdout
+
+
+def clone_repo(repo_name, dest, gh_username = None, gh_oauth_key = None, url = None, depth = None,
+               filter_blobs = False):
+    """ Makes a bare clone of a repo and returns its path
+
+    Args:
+        repo_name: Repo name
+        dest: Directory to clone into; must not exist
+        gh_username: Optional GitHub username, for private repos and higher limits
+        gh_oauth_key: Optional (String) GitHub oauth key
+        url: URL or path to clone from. Defaults to the repo on url_clone.
+        depth: If given, clone only this many commits of history, e.g. 1 for the files at the head
+        filter_blobs: Make a partial clone without file contents, for history only.
+                      Commands that read file contents or sizes would fetch them one at a time.
+    """
+    if url is None:
+        url = "%s/%s.git" % (url_clone, repo_name)
+    args = ["clone", "--bare", "--quiet"]
+    if depth is not None:
+        args = args + ["--depth", str(depth)]
+    if filter_blobs:
+        args = args + ["--filter=blob:none"]
+    run_git(args + [url, dest], env = git_env(gh_username, gh_oauth_key))
+    return dest
+
@@ -0,0 +1,228 @@
+from contextlib import contextmanager
+import os
+import subprocess
+import tempfile
+import threading
+
+import dateutil.parser
+
+from gh_api.requests import get_commit_url, replace_special_chars, tree_entry_file_info, url_html
+
+from .clone import GitError, clone_repo, git_env, run_git
+
+
+# Date format of the GitHub API, used for dates read from git
+date_format = "format-local:%Y-%m-%dT%H:%M:%SZ"
+
+
+def iter_split(stream, separator, chunk_size = 1 << 16):
+    """ Yields the parts of a binary stream between separators, reading it in chunks """
+    rest = b""
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        parts = (rest + chunk).split(separator)
+        rest = parts.pop()
+        for part in parts:
+            yield part
+    if rest:
+        yield rest
+
+
+class LocalRepo(object):
+    """A local clone of a GitHub repo, usually bare.
+
+    Produces the same records as the GitHub API functions of the gh_api package from the
+    clone, with no requests and no rate limit: file info as from gh_api.get_file_info_tree,
+    file contents, commits as from gh_api.iter_commits and initial commits as from
+    gh_api.get_initial_commits. Fields that only GitHub knows, e.g. the GitHub accounts of
+    commit authors, are None.
+    """
+
+    def __init__(self, path, repo_name):
+        """
+        Args:
+            path: Path of the clone
+            repo_name: Name of the repo on GitHub, used to build the URLs in records
+        """
+        self.path = path
+        self.repo_name = repo_name
+        self.env = git_env()
+
+    def git(self, *args):
+        """ Runs a git command in the clone and returns its output as bytes """
+        return run_git(args, cwd = self.path, env = self.env)
+
+    @contextmanager
+    def _popen(self, *args, stdin = None):
+        """ Context manager that runs a git command in the clone and yields the process,
+        whose output is read as a stream
+        """
+        proc = subprocess.Popen(["git"] + list(args), cwd = self.path, env = self.env, stdin = stdin,
+                                stdout = subprocess.PIPE, stderr = subprocess.DEVNULL)
+        try:
+            yield proc
+        finally:
+            proc.stdout.close()
+            if proc.wait() not in (0, -13):
+                # -13 is SIGPIPE, from closing the output before the command finished
+                raise GitError("git %s failed with status %s" % (args[0], proc.returncode))
+
+    def head_sha(self, ref = "HEAD"):
+        """ Returns the sha of the commit a ref points to, e.g. the current commit on the default branch """
+        return self.git("rev-parse", "--verify", "%s^{commit}" % ref).decode().strip()
+
+    def file_info(self, ref = None):
+        """ Returns list of dicts, one dict containing info for each file at a commit, with the
+        fields returned by gh_api.get_file_info. Ignores submodules. Lists the tree with
+        'git ls-tree -r -l', so the clone must include the file contents.
+
+        Args:
+            ref: Commit sha or branch name; defaults to the head commit, which the URLs in
+                 the records then point to
+        """
+        ref = ref if ref is not None else self.head_sha()
+        rtrn = []
+        for line in self.git("ls-tree", "-r", "-l", "-z", ref).split(b"\0"):
+            if not line:
+                continue
+            meta, path = line.decode().split("\t", 1)
+            mode, tp, sha, size = meta.split()
+            entry = {'path': path, 'mode': mode, 'type': tp, 'sha': sha, 'size': int(size) if size != "-" else None}
+            record = tree_entry_file_info(self.repo_name, ref, entry)
+            if record is not None:
+                rtrn.append(record)
+        return rtrn
+
+    def iter_blobs(self, shas):
+        """ Yields (sha, contents as bytes) for the blobs with the given shas that are in the
+        clone, read with one 'git cat-file --batch' process
+        """
+        with self._popen("cat-file", "--batch", stdin = subprocess.PIPE) as proc:
+
+            def write():
+                try:
+                    for sha in shas:
+                        proc.stdin.write(("%s\n" % sha).encode())
+                    proc.stdin.close()
+                except BrokenPipeError:
+                    pass
+            writer = threading.Thread(target = write, daemon = True)
+            writer.start()
+            for header in iter(proc.stdout.readline, b""):
+                fields = header.decode().split()
+                if fields[-1] == "missing":
+                    continue
+                data = proc.stdout.read(int(fields[2]))
+                proc.stdout.read(1)
+                if fields[1] == "blob":
+                    yield fields[0], data
+            writer.join()
+
+    def get_contents(self, file_info_records):
+        """ Returns dict from (path, sha) to file contents as a string, or None if the file could
+        not be decoded, for the file info records whose blobs are in the clone, as returned by
+        gh_api.get_archive_contents
+
+        Args:
+            file_info_records: Dicts with at least 'path' and 'sha'
+        """
+        records_by_sha = {}
+        for record in file_info_records:
+            records_by_sha.setdefault(record["sha"], []).append(record)
+        rtrn = {}
+        for sha, data in self.iter_blobs(list(records_by_sha.keys())):
+            try:
+                contents = data.decode()
+            except UnicodeDecodeError:
+                contents = None
+            for record in records_by_sha[sha]:
+                rtrn[(record["path"], sha)] = contents
+        return rtrn
+
+    def iter_commits(self, ref = "HEAD"):
+        """ Yields dicts of info for commits reachable from a ref, newest first, shaped like the
+        commits of gh_api.iter_commits. The GitHub accounts of authors and committers and
+        comment counts are None.
+        """
+        escaped = replace_special_chars(self.repo_name)
+        with self._popen("log", "-z", "--date=%s" % date_format,
+                         "--format=%H%x1f%an%x1f%ae%x1f%ad%x1f%cn%x1f%ce%x1f%cd%x1f%B", ref) as proc:
+            for record in iter_split(proc.stdout, b"\0"):
+                fields = record.decode(errors = "replace").split("\x1f", 7)
+                sha = fields[0]
+                url = get_commit_url(self.repo_name, sha)
+                yield {'sha': sha,
+                       'url': url,
+                       'html_url': "%s/%s/commit/%s" % (url_html, escaped, sha),
+                       'comments_url': "%s/comments" % url,
+                       'commit': {'message': fields[7].rstrip("\n"),
+                                  'comment_count': None,
+                                  'author': {'name': fields[1], 'email': fields[2], 'date': fields[3]},
+                                  'committer': {'name': fields[4], 'email': fields[5], 'date': fields[6]}},
+                       'author': None,
+                       'committer': None}
+
+    def initial_commits(self, paths, ref = "HEAD"):
+        """ Returns dict from path to date of first commit for the path as a datetime object, for
+        the paths that appear in the history, as returned by gh_api.get_initial_commits
+        Reads the history once, oldest first, with 'git log --name-status --reverse', and stops
+        once every path has been seen. Renames count as adding the new path, as in the path
+        filter of the GitHub API, so the clone need not include file contents.
+
+        Args:
+            paths: File paths within repo
+            ref: Commit sha or branch name whose history is read
+        """
+        remaining = set(paths)
+        rtrn = {}
+        timestamp = None
+        expect_path = False
+        with self._popen("log", "-z", "--reverse", "--no-renames", "--name-status", "--date=%s" % date_format,
+                         "--format=%x1e%H%x1f%cd", ref) as proc:
+            for token in iter_split(proc.stdout, b"\0"):
+                token = token.decode(errors = "surrogateescape")
+                if expect_path:
+                    expect_path = False
+                    if token in remaining:
+                        rtrn[token] = timestamp
+                        remaining.discard(token)
+                        if not remaining:
+                            break
+                elif token.startswith("\x1e"):
+                    timestamp = dateutil.parser.parse(token.split("\x1f")[1])
+                elif token.strip("\n"):
+                    # A status letter, followed by the path
+                    expect_path = True
+        return rtrn
+
+    def initial_commit(self, path, ref = "HEAD"):
+        """ Returns date of first commit for one path as a datetime object, or None if the path
+        is not in the history, as returned by gh_api.get_initial_commit. Unlike initial_commits,
+        finds paths first added in a merge commit.
+
+        Args:
+            path: File path within repo
+            ref: Commit sha or branch name whose history is read
+        """
+        dates = self.git("log", "--full-history", "-m", "--reverse", "--date=%s" % date_format, "--format=%cd",
+                         ref, "--", path).split()
+        if not dates:
+            return None
+        return dateutil.parser.parse(dates[0].decode())
+
+
+@contextmanager
+def cloned_repo(repo_name, gh_username = None, gh_oauth_key = None, url = None, depth = None,
+                filter_blobs = False, parent_dir = None):
+    """ Context manager that clones a repo into a temporary directory, yields a LocalRepo for
+    it and deletes the clone afterwards. Arguments are as for clone_repo.
+
+    Args:
+        parent_dir: Directory to make the temporary directory in; defaults to the system's
+    """
+    with tempfile.TemporaryDirectory(dir = parent_dir) as tmp_dir:
+        path = clone_repo(repo_name, os.path.join(tmp_dir, "repo.git"), gh_username, gh_oauth_key, url, depth,
+                          filter_blobs)
+        yield LocalRepo(path, repo_name)
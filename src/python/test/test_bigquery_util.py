@@ -0,0 +1,94 @@
+import unittest
+
+from util import create_bq_view, push_bq_batches, push_bq_counts
+from util import iso_time_utc
+
+
+class FakeClient(object):
+
+    def __init__(self):
+        self.tables = {}
+        self.rows = []
+
+    def check_table(self, dataset, table):
+        return (dataset, table) in self.tables
+
+    def create_table(self, dataset, table, schema):
+        self.tables[(dataset, table)] = schema
+        return True
+
+    def create_view(self, dataset, view, query):
+        self.tables[(dataset, view)] = query
+        return True
+
+    def push_rows(self, dataset, table, records):
+        self.rows.extend(records)
+        return True
+
+
+def map_catching(fn, items):
+    rtrn = []
+    for item in items:
+        try:
+            rtrn.append(fn(item))
+        except Exception as e:
+            rtrn.append(e)
+    return rtrn
+
+
+class PushCountsTest(unittest.TestCase):
+
+    def test_push_counts(self):
+        client = FakeClient()
+        counts = {"a/b": 3, "c/d": 0}
+
+        def count(repo_name):
+            if repo_name not in counts:
+                raise ValueError("Not Found")
+            return counts[repo_name]
+        push_bq_counts(client, "ds", "counts", ["a/b", "missing/repo", "c/d"], count, 'commit_count', map_catching,
+                       batch_size = 2)
+        self.assertEqual([field['name'] for field in client.tables[("ds", "counts")]],
+                         ['repo_name', 'commit_count', 'time_accessed'])
+        self.assertEqual([(row['repo_name'], row['commit_count']) for row in client.rows], [("a/b", 3), ("c/d", 0)])
+
+
+class PushBatchesTest(unittest.TestCase):
+
+    def test_push_batches(self):
+        num_read = []
+        pushed = []
+
+        def records():
+            for i in range(2500):
+                num_read.append(i)
+                yield {'i': i}
+
+        def push(batch):
+            # Each batch is pushed as soon as it is full, before more records are read
+            self.assertEqual(len(num_read), len(pushed) * 1000 + len(batch))
+            pushed.append(len(batch))
+        self.assertEqual(push_bq_batches(records(), push, 1000), 2500)
+        self.assertEqual(pushed, [1000, 1000, 500])
+        self.assertEqual(push_bq_batches(iter([]), push, 1000), 0)
+        self.assertEqual(pushed, [1000, 1000, 500])
+
+
+class CreateViewTest(unittest.TestCase):
+
+    def test_create_view_once(self):
+        client = FakeClient()
+        create_bq_view(client, "ds", "latest", "SELECT 1")
+        create_bq_view(client, "ds", "latest", "SELECT 2")
+        self.assertEqual(client.tables[("ds", "latest")], "SELECT 1")
+
+
+class IsoTimeTest(unittest.TestCase):
+
+    def test_iso_time_utc(self):
+        self.assertEqual(iso_time_utc("05 Mar 2017 14:02:09 GMT"), "2017-03-05T14:02:09Z")
+        self.assertEqual(iso_time_utc("05 Mar 2017 14:02:09 UTC"), "2017-03-05T14:02:09Z")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,912 @@
+import gzip
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import unittest
+
+from gh_api import gh_curl_response, page_num_from_url, parse_link_header
+from gh_api import set_response_cache, ResponseCache
+from gh_api import CredentialPool, read_credentials
+from gh_api import async_requests, map_concurrently
+from gh_api import retry_policy, RetryPolicy, RetryableError, IncompleteResponseError, request_with_retries
+from gh_api import wire_stats
+from gh_api import Memoizer
+from gh_api import BudgetScheduler
+from gh_api import CrawlPlan, get_budget, num_pages
+from gh_api import requests as gh_requests
+from gh_api import get_repo_metadata, graphql
+from gh_api import Cassette, set_api_url, set_cassette
+from gh_api import curr_commit_master, get_commits, get_file_info, get_file_info_tree, get_language_bytes, memo
+from gh_api import get_archive_contents, get_file_contents
+from gh_api import get_initial_commit, get_initial_commits, iter_new_commits
+from gh_api import get_pull_requests, iter_updated_pull_requests
+from gh_api import RequestMetrics
+from gh_api import count_commits, count_contributors, count_pull_requests
+from gh_api import RepoStatusCache, set_repo_status
+from gh_api import metrics as gh_api_metrics
+from gh_api.requests import get_commits_master_url, get_commits_url, get_contents_url
+from gh_api.rate_limit import RateLimiter
+from gh_api.retry import rate_limit_exhausted
+from gh_api.mock_server import MockGitHubServer
+from gh_api.transport import CurlPool, Response, get_response
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Answers every GET with a small JSON body over a keep-alive connection"""
+
+    protocol_version = "HTTP/1.1"
+
+    # Number of pages served for paths containing 'commits'
+    num_pages = 3
+
+    # Number of requests seen per path
+    counts = {}
+
+    def do_GET(self):
+        link = None
+        self.counts[self.path] = self.counts.get(self.path, 0) + 1
+        if "flaky" in self.path and self.counts[self.path] == 1:
+            body = b"<html>Bad gateway</html>"
+            self.send_response(502)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        if "nocontent" in self.path:
+            self.send_response(204)
+            self.end_headers()
+            return
+        if "truncated" in self.path:
+            body = b'[{"page": 1'
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        if "etag" in self.path:
+            if self.headers.get("If-None-Match") == '"v1"':
+                self.send_response(304)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+        if "commits" in self.path:
+            page = page_num_from_url(self.path)
+            body = json.dumps([{"page": page, "i": i} for i in range(2)]).encode()
+            base = "http://%s:%s%s" % (self.server.server_address + (self.path.split("?")[0],))
+            if page < self.num_pages:
+                link = '<%s?page=%s>; rel="next", <%s?page=%s>; rel="last"' % (base, page + 1, base, self.num_pages)
+        elif self.path == "/rate_limit":
+            body = json.dumps({"resources": {"core": {"limit": 5000, "remaining": 1234, "reset": 2000000000}}}).encode()
+        else:
+            body = json.dumps({"path": self.path}).encode()
+        gzipped = "gzip" in self.path and "gzip" in self.headers.get("Accept-Encoding", "")
+        if gzipped:
+            body = gzip.compress(json.dumps({"path": self.path, "pad": "x" * 5000}).encode())
+        self.send_response(200)
+        if gzipped:
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("X-Test", "yes")
+        if link is not None:
+            self.send_header("Link", link)
+        if "etag" in self.path:
+            self.send_header("ETag", '"v1"')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        self.counts[self.path] = self.counts.get(self.path, 0) + 1
+        query = json.loads(self.rfile.read(int(self.headers["Content-Length"])).decode())["query"]
+        if "denied" in self.path:
+            body = b'{"message": "Resource not accessible by integration"}'
+            self.send_response(403)
+            self.send_header("X-RateLimit-Remaining", "4000")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        data = {}
+        errors = []
+        for alias, owner, name in re.findall(r'(r\d+): repository\(owner: "(.*?)", name: "(.*?)"\)', query):
+            if owner == "missing":
+                data[alias] = None
+                errors.append({"type": "NOT_FOUND", "path": [alias], "message": "Not found"})
+                continue
+            if owner == "forbidden":
+                data[alias] = None
+                errors.append({"type": "FORBIDDEN", "path": [alias], "message": "Forbidden"})
+                continue
+            data[alias] = {"nameWithOwner": "%s/%s" % (owner, name), "url": "https://github.com/%s/%s" % (owner, name),
+                           "description": None, "isFork": False, "forkCount": 3,
+                           "stargazers": {"totalCount": 10}, "watchers": {"totalCount": 2},
+                           "issues": {"totalCount": 4}, "pullRequests": {"totalCount": 1},
+                           "licenseInfo": {"key": "mit"},
+                           "languages": {"edges": [{"size": 100, "node": {"name": "Python"}}]},
+                           "defaultBranchRef": {"target": {"oid": "abc"}}}
+        body = json.dumps({"data": data, "errors": errors}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class TransportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+        self.url = "http://127.0.0.1:%s" % self.server.server_port
+        self.thread = threading.Thread(target = self.server.serve_forever, args = (0.05,), daemon = True)
+        self.thread.start()
+        self.pool = CurlPool()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.pool.close()
+        self.tmp_dir.cleanup()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_get_response(self):
+        response = get_response("%s/repos/a/b" % self.url, "user:key", pool = self.pool)
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.headers["x-test"], "yes")
+        self.assertEqual(json.loads(response.body.decode())["path"], "/repos/a/b")
+
+    def test_connection_reuse(self):
+        for i in range(5):
+            get_response("%s/repos/a/b?page=%s" % (self.url, i), "user:key", pool = self.pool)
+        stats = self.pool.stats()
+        self.assertEqual(stats["handles"], 1)
+        self.assertEqual(stats["requests"], 5)
+        self.assertEqual(stats["connects"], 1)
+        self.assertEqual(stats["per_handle_reuses"], [4])
+
+    def test_pages_sequential(self):
+        results = gh_curl_response("%s/repos/a/b/commits" % self.url, "user", "key")
+        self.assertEqual([(r["page"], r["i"]) for r in results], [(1, 0), (1, 1), (2, 0), (2, 1), (3, 0), (3, 1)])
+
+    def test_pages_parallel(self):
+        sequential = gh_curl_response("%s/repos/a/b/commits" % self.url, "user", "key")
+        parallel = gh_curl_response("%s/repos/a/b/commits" % self.url, "user", "key", parallel_pages = 4)
+        self.assertEqual(parallel, sequential)
+
+    def test_pages_streamed(self):
+        pages = gh_requests.iter_gh_pages("%s/repos/a/stream/commits" % self.url, "user", "key")
+        self.assertEqual([r["page"] for r in next(pages)], [1, 1])
+        # Only the page yielded has been requested
+        self.assertEqual(sorted(p for p in StubHandler.counts if p.startswith("/repos/a/stream/")),
+                         ["/repos/a/stream/commits?page=1"])
+        self.assertEqual([[r["page"] for r in page] for page in pages], [[2, 2], [3, 3]])
+
+    def test_pages_parallel_window(self):
+        num_pages, StubHandler.num_pages = StubHandler.num_pages, 10
+        try:
+            num_consumed = 0
+            for page in gh_requests.iter_gh_pages("%s/repos/a/window/commits" % self.url, "user", "key",
+                                                  parallel_pages = 3):
+                num_consumed = num_consumed + 1
+                num_fetched = len([p for p in StubHandler.counts if p.startswith("/repos/a/window/")])
+                # Pages fetched but not yet consumed, including this one
+                self.assertLessEqual(num_fetched - num_consumed + 1, 3)
+        finally:
+            StubHandler.num_pages = num_pages
+        self.assertEqual(num_consumed, 10)
+
+    def test_unpaginated_single_request(self):
+        response = gh_curl_response("%s/repos/a/b" % self.url, "user", "key")
+        self.assertEqual(response["path"], "/repos/a/b?page=1")
+
+    def test_conditional_request_cache(self):
+        cache = ResponseCache(os.path.join(self.tmp_dir.name, "cache.db"))
+        set_response_cache(cache)
+        try:
+            first = gh_curl_response("%s/repos/a/etag" % self.url, "user", "key")
+            second = gh_curl_response("%s/repos/a/etag" % self.url, "user", "key")
+        finally:
+            set_response_cache(None)
+        self.assertEqual(first, second)
+        self.assertEqual(cache.stats()["misses"], 1)
+        self.assertEqual(cache.stats()["hits"], 1)
+        cache.close()
+
+    def test_get_budget(self):
+        url_repos = gh_requests.url_repos
+        gh_requests.url_repos = "%s/repos" % self.url
+        try:
+            budget = get_budget("user", "key")
+        finally:
+            gh_requests.url_repos = url_repos
+        self.assertEqual(budget, {'limit': 5000, 'remaining': 1234, 'reset': 2000000000, 'keys': 1})
+
+    def test_graphql_repo_metadata(self):
+        url_graphql = graphql.url_graphql
+        graphql.url_graphql = "%s/graphql" % self.url
+        repo_names = ["owner/repo%s" % i for i in range(150)] + ["missing/repo", "forbidden/repo", "no_slash"]
+        StubHandler.counts.pop("/graphql", None)
+        try:
+            metadata = get_repo_metadata(repo_names, "user", "key")
+        finally:
+            graphql.url_graphql = url_graphql
+        self.assertEqual(StubHandler.counts["/graphql"], 2)
+        self.assertIsNone(metadata["missing/repo"])
+        self.assertIsNone(metadata["forbidden/repo"])
+        self.assertIsNone(metadata["no_slash"])
+        record = metadata["owner/repo149"]
+        self.assertEqual(record["repo_name"], "owner/repo149")
+        self.assertEqual(record["html_url"], "https://github.com/owner/repo149")
+        self.assertEqual(record["open_issues_count"], 5)
+        self.assertEqual(record["subscribers_count"], 2)
+        self.assertEqual(record["watchers_count"], 10)
+        self.assertEqual(record["license"], "mit")
+        self.assertEqual(record["language_bytes"], {"Python": 100})
+        self.assertEqual(record["curr_commit_master"], "abc")
+
+    def test_graphql_forbidden_not_retried(self):
+        url_graphql = graphql.url_graphql
+        graphql.url_graphql = "%s/graphql-denied" % self.url
+        try:
+            self.assertRaises(RuntimeError, graphql.run_query, "query { viewer { login } }", "user", "key")
+        finally:
+            graphql.url_graphql = url_graphql
+        self.assertEqual(StubHandler.counts["/graphql-denied"], 1)
+
+    def test_cache_eviction(self):
+        cache = ResponseCache(os.path.join(self.tmp_dir.name, "cache.db"), max_bytes = 15)
+        cache.store("u1", {"etag": '"a"'}, b"0123456789")
+        cache.store("u2", {"etag": '"b"'}, b"0123456789")
+        cache.store("u3", {}, b"no validator")
+        cache.evict()
+        self.assertIsNone(cache.lookup("u1"))
+        self.assertEqual(cache.lookup("u2"), ({"etag": '"b"'}, b"0123456789"))
+        self.assertIsNone(cache.lookup("u3"))
+        self.assertEqual(cache.conditional_headers("u2"), ['If-None-Match: "b"'])
+        cache.close()
+
+    def test_retry_server_error(self):
+        base_delay = retry_policy.base_delay
+        retry_policy.base_delay = 0
+        try:
+            response = gh_curl_response("%s/repos/a/b/flaky" % self.url, "user", "key")
+        finally:
+            retry_policy.base_delay = base_delay
+        self.assertEqual(response["path"], "/repos/a/b/flaky?page=1")
+        self.assertEqual(retry_policy.stats()["flaky"]["server"]["retries"], 1)
+
+    def test_empty_and_truncated_bodies(self):
+        self.assertEqual(gh_curl_response("%s/repos/a/b/nocontent" % self.url, "user", "key"), [])
+        self.assertEqual(StubHandler.counts["/repos/a/b/nocontent?page=1"], 1)
+        base_delay = retry_policy.base_delay
+        retry_policy.base_delay = 0
+        try:
+            self.assertRaises(IncompleteResponseError, gh_curl_response, "%s/repos/a/b/truncated" % self.url,
+                              "user", "key")
+            # Collectors skip a repo or file on ValueError
+            self.assertRaises(ValueError, gh_curl_response, "%s/repos/a/b/truncated" % self.url, "user", "key")
+        finally:
+            retry_policy.base_delay = base_delay
+        self.assertEqual(StubHandler.counts["/repos/a/b/truncated?page=1"], 2 * (1 + retry_policy.max_retries['truncated']))
+
+    def test_gzip(self):
+        before = wire_stats.stats()
+        response = gh_curl_response("%s/repos/a/gzip" % self.url, "user", "key")
+        after = wire_stats.stats()
+        self.assertEqual(len(response["pad"]), 5000)
+        self.assertGreater(after["bytes_saved"] - before["bytes_saved"], 4000)
+
+    def test_parse_link_header(self):
+        links = parse_link_header('<https://api.github.com/x?page=2>; rel="next", '
+                                  '<https://api.github.com/x?page=9>; rel="last"')
+        self.assertEqual(links["next"], "https://api.github.com/x?page=2")
+        self.assertEqual(page_num_from_url(links["last"]), 9)
+        self.assertEqual(parse_link_header(None), {})
+
+
+class RateLimiterTest(unittest.TestCase):
+
+    def headers(self, remaining, reset):
+        return {"x-ratelimit-limit": "5000", "x-ratelimit-remaining": str(remaining),
+                "x-ratelimit-reset": str(reset)}
+
+    def test_no_delay_before_first_response(self):
+        self.assertEqual(RateLimiter().delay(), 0.0)
+
+    def test_full_speed_with_budget(self):
+        limiter = RateLimiter(reserve = 100)
+        limiter.update(self.headers(4000, 2000))
+        self.assertEqual(limiter.delay(now = 1000), 0.0)
+
+    def test_paced_near_exhaustion(self):
+        limiter = RateLimiter(reserve = 100)
+        limiter.update(self.headers(50, 2000))
+        self.assertAlmostEqual(limiter.delay(now = 1000), 20.0)
+
+    def test_blocks_when_exhausted(self):
+        limiter = RateLimiter(reserve = 100)
+        limiter.update(self.headers(0, 2000))
+        self.assertAlmostEqual(limiter.delay(now = 1000), 1001.0)
+        self.assertEqual(limiter.delay(now = 2000), 0.0)
+
+    def test_out_of_order_responses(self):
+        limiter = RateLimiter()
+        limiter.update(self.headers(10, 2000))
+        limiter.update(self.headers(12, 2000))
+        self.assertEqual(limiter.state()["remaining"], 10)
+        limiter.update(self.headers(5000, 5600))
+        self.assertEqual(limiter.state()["remaining"], 5000)
+
+
+class CredentialPoolTest(unittest.TestCase):
+
+    def headers(self, remaining, reset):
+        return {"x-ratelimit-remaining": str(remaining), "x-ratelimit-reset": str(reset)}
+
+    def test_most_headroom(self):
+        pool = CredentialPool([("a", "ka"), ("b", "kb")])
+        pool.credentials[0].limiter.update(self.headers(100, 2000))
+        pool.credentials[1].limiter.update(self.headers(3000, 2000))
+        self.assertEqual(pool.choose(now = 1000).gh_username, "b")
+
+    def test_skip_exhausted_until_reset(self):
+        pool = CredentialPool([("a", "ka"), ("b", "kb")])
+        pool.credentials[0].limiter.update(self.headers(0, 2000))
+        pool.credentials[1].limiter.update(self.headers(0, 1500))
+        self.assertEqual(pool.choose(now = 1000).gh_username, "b")
+        pool.credentials[1].limiter.update(self.headers(10, 1500))
+        self.assertEqual(pool.choose(now = 1000).gh_username, "b")
+        self.assertEqual(pool.choose(now = 2001).gh_username, "a")
+
+    def test_read_credentials(self):
+        with tempfile.NamedTemporaryFile("w", suffix = ".txt", delete = False) as f:
+            f.write("# tokens\nuser1:key1\n\nkey2\n")
+        try:
+            self.assertEqual(read_credentials(f.name), [("user1", "key1"), ("key2", "x-oauth-basic")])
+        finally:
+            os.remove(f.name)
+
+
+class AsyncRequestsTest(unittest.TestCase):
+
+    def tearDown(self):
+        async_requests.set_concurrency(1)
+
+    def test_map_concurrently(self):
+        def slow_square(x):
+            if x == 3:
+                raise ValueError("three")
+            time.sleep(0.2)
+            return x * x
+        async_requests.set_concurrency(8)
+        start = time.time()
+        results = map_concurrently(slow_square, list(range(8)))
+        self.assertLess(time.time() - start, 1.0)
+        self.assertEqual([r for r in results if not isinstance(r, Exception)], [0, 1, 4, 16, 25, 36, 49])
+        self.assertIsInstance(results[3], ValueError)
+
+    def test_pages_per_call(self):
+        self.assertEqual(async_requests.pages_per_call(1), 1)
+        async_requests.set_concurrency(6)
+        self.assertEqual(async_requests.pages_per_call(6), 1)
+        self.assertEqual(async_requests.pages_per_call(2), 3)
+        async_requests.set_concurrency(100)
+        self.assertEqual(async_requests.pages_per_call(1), gh_requests.max_parallel_pages)
+
+
+class RetryPolicyTest(unittest.TestCase):
+
+    def test_gives_up_after_max_retries(self):
+        policy = RetryPolicy(base_delay = 0, max_retries = {'server': 2})
+        calls = []
+        def fail():
+            calls.append(1)
+            raise RetryableError('server', result = "fallback")
+        self.assertEqual(policy.call("commits", fail), "fallback")
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(policy.stats(), {"commits": {"server": {"retries": 2, "gave_up": 1}}})
+
+    def test_raises_cause(self):
+        policy = RetryPolicy(base_delay = 0)
+        def fail():
+            raise RetryableError('rate_limit', cause = PermissionError("API rate limit exceeded"))
+        self.assertRaises(PermissionError, policy.call, "repo", fail)
+
+    def test_budget(self):
+        policy = RetryPolicy(base_delay = 0, budgets = {'network': 1})
+        outcomes = iter([RetryableError('network', result = 1), "ok"])
+        def flaky():
+            outcome = next(outcomes)
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+        def always_fail():
+            raise RetryableError('network', result = "budget spent")
+        self.assertEqual(policy.call("pulls", flaky), "ok")
+        self.assertEqual(policy.call("pulls", always_fail), "budget spent")
+        self.assertEqual(policy.stats()["pulls"]["network"], {"retries": 1, "gave_up": 1})
+
+    def test_retry_after(self):
+        policy = RetryPolicy()
+        self.assertEqual(policy.delay('secondary_rate_limit', 0, retry_after = 7), 7)
+        self.assertGreaterEqual(policy.delay('secondary_rate_limit', 0), 30)
+
+    def test_request_with_retries(self):
+        responses = iter([Response(502, {}, b"<html>"), Response(200, {}, b'[{"a": 1'), Response(200, {}, b'[1]')])
+        base_delay = retry_policy.base_delay
+        retry_policy.base_delay = 0
+        try:
+            response, parsed = request_with_retries("test", lambda: next(responses), lambda r: json.loads(r.body))
+            self.assertEqual(parsed, [1])
+            limited = Response(429, {}, b'{"message": "API rate limit exceeded for user"}')
+            self.assertRaises(PermissionError, request_with_retries, "test", lambda: limited,
+                              lambda r: json.loads(r.body))
+            forbidden = Response(403, {}, b"")
+            self.assertEqual(request_with_retries("test", lambda: forbidden), (forbidden, None))
+            self.assertFalse(rate_limit_exhausted(forbidden))
+            self.assertTrue(rate_limit_exhausted(Response(403, {"x-ratelimit-remaining": "0"}, b"")))
+        finally:
+            retry_policy.base_delay = base_delay
+        self.assertEqual(retry_policy.stats()["test"]["server"]["retries"], 1)
+        self.assertEqual(retry_policy.stats()["test"]["truncated"]["retries"], 1)
+
+
+class UrlTest(unittest.TestCase):
+
+    def test_max_page_size(self):
+        self.assertEqual(get_commits_url("a/b"), "https://api.github.com/repos/a/b/commits?per_page=100")
+        self.assertEqual(get_commits_url("a/b", "src/x y.c"),
+                         "https://api.github.com/repos/a/b/commits?per_page=100&path=src/x y.c")
+        self.assertEqual(get_commits_master_url("a/b"), "https://api.github.com/repos/a/b/commits/master")
+        self.assertEqual(get_contents_url("a/b", "src"), "https://api.github.com/repos/a/b/contents/src?per_page=100")
+
+
+class MemoizerTest(unittest.TestCase):
+
+    def test_memoized_within_ttl(self):
+        memo = Memoizer(ttl = 60)
+        calls = []
+        self.assertEqual(memo.get("url", lambda: calls.append(1) or "sha"), "sha")
+        self.assertEqual(memo.get("url", lambda: calls.append(1) or "sha"), "sha")
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(memo.stats()["avoided"], 1)
+
+    def test_coalesced_in_flight(self):
+        memo = Memoizer(ttl = 0)
+        calls = []
+        def slow():
+            calls.append(1)
+            time.sleep(0.2)
+            return "sha"
+        threads = [threading.Thread(target = memo.get, args = ("url", slow)) for i in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(memo.stats()["coalesced"], 4)
+
+    def test_errors_not_memoized(self):
+        memo = Memoizer(ttl = 60)
+        def not_found():
+            raise ValueError("Not Found")
+        self.assertRaises(ValueError, memo.get, "url", not_found)
+        self.assertEqual(memo.get("url", lambda: "found"), "found")
+
+
+class BudgetSchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        ledger = os.path.join(self.tmp_dir.name, "ledger.db")
+        self.high = BudgetScheduler(ledger, "file_contents", priority = 3)
+        self.low = BudgetScheduler(ledger, "file_init_commit", priority = 1)
+        self.reset = int(time.time()) + 3600
+
+    def tearDown(self):
+        self.high.close()
+        self.low.close()
+        self.tmp_dir.cleanup()
+
+    def headers(self, remaining):
+        return {"x-ratelimit-limit": "100", "x-ratelimit-remaining": str(remaining),
+                "x-ratelimit-reset": str(self.reset)}
+
+    def test_alone_never_yields(self):
+        self.low.acquire()
+        self.assertFalse(self.low.should_yield())
+
+    def test_low_priority_yields_near_exhaustion(self):
+        self.high.acquire()
+        self.low.acquire()
+        self.low.record(self.headers(90))
+        self.assertFalse(self.low.should_yield())
+        self.high.record(self.headers(10))
+        self.assertTrue(self.low.should_yield())
+        self.assertFalse(self.high.should_yield())
+        self.high.release()
+        self.assertFalse(self.low.should_yield())
+
+    def test_allotment_by_priority(self):
+        self.high.acquire()
+        self.low.acquire()
+        for i in range(25):
+            self.low.record(self.headers(80))
+        self.assertTrue(self.low.should_yield())
+        self.assertFalse(self.high.should_yield())
+
+    def test_allotment_scaled_by_keys(self):
+        self.low.num_keys = 2
+        self.high.acquire()
+        self.low.acquire()
+        for i in range(25):
+            self.low.record(self.headers(80))
+        self.assertFalse(self.low.should_yield())
+        for i in range(25):
+            self.low.record(self.headers(80))
+        self.assertTrue(self.low.should_yield())
+
+    def test_queued_until_released(self):
+        self.high.acquire()
+        self.high.acquire()
+        self.low.acquire()
+        for i in range(25):
+            self.low.record(self.headers(80))
+        self.high.release()
+        self.assertTrue(self.low.should_yield())
+        self.high.release()
+        self.assertFalse(self.low.should_yield())
+
+    def test_no_stall_when_all_blocked(self):
+        # The higher priority stage is over its share, and the lower is held back by the reserve
+        low = BudgetScheduler(os.path.join(self.tmp_dir.name, "stall.db"), "a", priority = 1)
+        high = BudgetScheduler(os.path.join(self.tmp_dir.name, "stall.db"), "b", priority = 2)
+        try:
+            low.acquire()
+            high.acquire()
+            reset = int(time.time()) + 3600
+            low.record({"x-ratelimit-limit": "5000", "x-ratelimit-remaining": "900", "x-ratelimit-reset": str(reset)})
+            low._update("UPDATE stages SET used = 600, window_reset = ? WHERE stage = 'a'", (reset,))
+            high._update("UPDATE stages SET used = 3500, window_reset = ? WHERE stage = 'b'", (reset,))
+            self.assertTrue(low.should_yield())
+            self.assertFalse(high.should_yield())
+        finally:
+            low.close()
+            high.close()
+
+    def test_deadline_boost(self):
+        now = time.time()
+        self.assertEqual(self.low.effective_priority(1, None, now), 1)
+        self.assertEqual(self.low.effective_priority(1, now + 7 * 60 * 60, now), 1)
+        self.assertEqual(self.low.effective_priority(1, now, now), 4)
+
+
+class PlannerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.plan = CrawlPlan("stage", 1000, "files")
+        self.plan.add("listings", 9000, 9000)
+        self.plan.add("metadata", 1000)
+
+    def test_num_pages(self):
+        self.assertEqual(num_pages(0), 1)
+        self.assertEqual(num_pages(100), 1)
+        self.assertEqual(num_pages(101), 2)
+
+    def test_totals(self):
+        self.assertEqual(self.plan.num_requests(), 10000)
+        self.assertEqual(self.plan.num_pages(), 9000)
+
+    def test_schedule_budget_bound(self):
+        budget = {'limit': 5000, 'remaining': 1000, 'reset': 1800, 'keys': 1}
+        windows = self.plan.schedule(budget, concurrency = 100, seconds_per_request = 0.5, now = 0)
+        self.assertEqual([w['requests'] for w in windows], [1000, 5000, 4000])
+        self.assertEqual([w['start'] for w in windows], [0, 1800, 5400])
+        self.assertEqual(windows[-1]['end'], 5400 + 4000 / 200)
+        self.assertEqual([w['items'] for w in windows], [100, 600, 1000])
+
+    def test_schedule_latency_bound(self):
+        budget = {'limit': 50000, 'remaining': 50000, 'reset': 3600, 'keys': 10}
+        windows = self.plan.schedule(budget, concurrency = 1, seconds_per_request = 0.5, now = 0)
+        self.assertEqual([w['requests'] for w in windows], [7200, 2800])
+        self.assertEqual(windows[-1]['end'], 3600 + 2800 * 0.5)
+
+    def test_report(self):
+        budget = {'limit': 5000, 'remaining': 5000, 'reset': None, 'keys': 1}
+        report = self.plan.report(budget, concurrency = 4, now = 0)
+        self.assertIn("10000 requests (9000 pages)\ttotal", report)
+        self.assertIn("in 2 rate limit windows", report)
+
+
+class MockServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = MockGitHubServer(commits_per_repo = 250, dirs_per_repo = 2, files_per_dir = 3,
+                                       missing_repos = ["a/missing"]).start()
+        set_api_url(self.server.url)
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        set_cassette(None)
+        set_api_url("https://api.github.com")
+        self.server.stop()
+        self.tmp_dir.cleanup()
+
+    def test_pagination(self):
+        commits = get_commits("a/b", "user", "key")
+        self.assertEqual(len(commits), 250)
+        self.assertEqual(len(set(c["sha"] for c in commits)), 250)
+        self.assertEqual(self.server.num_requests, 3)
+
+    def test_counts(self):
+        self.assertEqual(count_commits("a/b", "user", "key"), 250)
+        self.assertEqual(count_pull_requests("a/b", "user", "key"), 30)
+        self.assertEqual(count_contributors("a/b", "user", "key"), 5)
+        self.assertEqual(self.server.num_requests, 3)
+        self.assertRaises(ValueError, count_commits, "a/missing", "user", "key")
+
+    def test_redirect_followed(self):
+        server = MockGitHubServer(commits_per_repo = 5, renamed_repos = {"a/old": "a/new"}).start()
+        set_api_url(server.url)
+        try:
+            commits = get_commits("a/old", "user", "key")
+        finally:
+            server.stop()
+        self.assertEqual(len(commits), 5)
+
+    def test_rename_map(self):
+        server = MockGitHubServer(commits_per_repo = 250, renamed_repos = {"a/old": "a/new"}).start()
+        set_api_url(server.url)
+        status_cache = RepoStatusCache(os.path.join(self.tmp_dir.name, "status.db"))
+        set_repo_status(status_cache)
+        try:
+            commits = get_commits("a/old", "user", "key")
+            self.assertEqual(status_cache.renames(), {"a/old": "a/new"})
+            num_requests = server.num_requests
+            self.assertEqual(count_commits("a/old", "user", "key"), 250)
+            self.assertEqual(server.num_requests, num_requests + 1)
+        finally:
+            set_repo_status(None)
+            status_cache.close()
+            server.stop()
+        self.assertEqual(len(commits), 250)
+
+    def test_negative_cache(self):
+        path = os.path.join(self.tmp_dir.name, "status.db")
+        status_cache = RepoStatusCache(path)
+        set_repo_status(status_cache)
+        try:
+            self.assertRaises(ValueError, get_commits, "a/missing", "user", "key")
+            num_requests = self.server.num_requests
+            self.assertRaises(ValueError, get_commits, "a/missing", "user", "key")
+            self.assertRaises(ValueError, count_pull_requests, "a/missing", "user", "key")
+            self.assertEqual(self.server.num_requests, num_requests)
+            self.assertEqual(status_cache.stats()['skipped'], 2)
+        finally:
+            set_repo_status(None)
+            status_cache.close()
+        self.assertTrue(RepoStatusCache(path).is_missing("A/Missing"))
+        self.assertFalse(RepoStatusCache(path, ttl = 0).is_missing("a/missing"))
+
+    def test_file_info(self):
+        files = get_file_info("a/b", "user", "key")
+        self.assertEqual(len(files), 9)
+        self.assertIn("d1/file2.py", [f["path"] for f in files])
+
+    def test_file_info_tree(self):
+        fields = ["name", "path", "sha", "size", "type"]
+        files = get_file_info("a/b", "user", "key")
+        self.server.num_requests = 0
+        tree_files = get_file_info_tree("a/b", "user", "key", "master")
+        self.assertEqual(self.server.num_requests, 1)
+        self.assertEqual(sorted([f[field] for field in fields] for f in files),
+                         sorted([f[field] for field in fields] for f in tree_files))
+        self.assertEqual(set(files[0].keys()), set(tree_files[0].keys()))
+
+    def test_file_info_tree_default_branch(self):
+        self.server.default_branches["a/main"] = "main"
+        self.assertIsNone(curr_commit_master("a/main", "user", "key"))
+        self.assertRaises(ValueError, get_file_info_tree, "a/main", "user", "key", "master")
+        tree_files = get_file_info_tree("a/main", "user", "key")
+        self.assertEqual(len(tree_files), len(get_file_info("a/main", "user", "key")))
+        self.assertIn("/blob/main/", tree_files[0]["html_url"])
+        self.assertRaises(ValueError, get_file_info_tree, "a/missing", "user", "key")
+
+    def test_file_info_tree_truncated(self):
+        self.server.max_tree_entries = 4
+        tree_files = get_file_info_tree("a/b", "user", "key")
+        self.assertEqual(sorted(f["path"] for f in tree_files),
+                         sorted(f["path"] for f in get_file_info("a/b", "user", "key")))
+
+    def test_not_found(self):
+        self.assertRaises(ValueError, get_commits, "a/missing", "user", "key")
+
+    def test_initial_commits(self):
+        paths = [f["path"] for f in get_file_info("a/b", "user", "key")]
+        self.server.num_requests = 0
+        init_commits = get_initial_commits("a/b", paths, "user", "key")
+        # The walk stops once every file has been seen, within 10 commits of the oldest
+        self.assertLessEqual(self.server.num_requests, 3 + 10)
+        self.assertEqual(set(init_commits.keys()), set(paths))
+        self.assertEqual(get_initial_commits("a/b", ["not/in/repo.py"], "user", "key"), {})
+        for path in paths:
+            self.assertEqual(init_commits[path], get_initial_commit("a/b", path, "user", "key"))
+
+    def test_initial_commits_paginated_files(self):
+        paths = [f["path"] for f in get_file_info("a/b", "user", "key")]
+        init_commits = get_initial_commits("a/b", paths, "user", "key")
+        self.server.max_commit_files = 1
+        self.assertEqual(get_initial_commits("a/b", paths, "user", "key", parallel_pages = 4), init_commits)
+
+    def test_initial_commits_earliest_date(self):
+        # The second commit walked has an earlier committer date than the first
+        commits = [{"sha": "s1", "commit": {"committer": {"date": "2017-02-01T00:00:00Z"}}},
+                   {"sha": "s2", "commit": {"committer": {"date": "2017-01-01T00:00:00Z"}}},
+                   {"sha": "s3", "commit": {"committer": {"date": "2017-03-01T00:00:00Z"}}}]
+        files = {"s1": ["x.py"], "s2": ["x.py"], "s3": ["y.py"]}
+        walk, commit_files = gh_requests.iter_commits_oldest_first, gh_requests.iter_commit_files
+        gh_requests.iter_commits_oldest_first = lambda *args: iter(commits)
+        gh_requests.iter_commit_files = lambda repo_name, sha, u, k: files[sha]
+        try:
+            init_commits = get_initial_commits("a/b", ["x.py", "y.py"], "user", "key")
+        finally:
+            gh_requests.iter_commits_oldest_first, gh_requests.iter_commit_files = walk, commit_files
+        self.assertEqual(init_commits["x.py"].isoformat(), "2017-01-01T00:00:00+00:00")
+        self.assertEqual(init_commits["y.py"].isoformat(), "2017-03-01T00:00:00+00:00")
+
+    def test_new_commits(self):
+        commits = get_commits("a/b", "user", "key")
+        last = commits[5]
+        self.server.num_requests = 0
+        new_commits = list(iter_new_commits("a/b", "user", "key", last["sha"], last["commit"]["committer"]["date"]))
+        self.assertEqual([c["sha"] for c in new_commits], [c["sha"] for c in commits[:5]])
+        self.assertEqual(self.server.num_requests, 1)
+        self.assertEqual(list(iter_new_commits("a/b", "user", "key", commits[0]["sha"],
+                                               commits[0]["commit"]["committer"]["date"])), [])
+
+    def test_updated_pull_requests(self):
+        pulls = get_pull_requests("a/b", "user", "key")
+        self.server.num_requests = 0
+        updated = list(iter_updated_pull_requests("a/b", "user", "key", pulls[3]["updated_at"],
+                                                  seen_ids = {str(pulls[3]["id"])}))
+        self.assertEqual([pr["id"] for pr in updated], [pr["id"] for pr in pulls[:3]])
+        self.assertEqual(self.server.num_requests, 1)
+        # A pull request updated at the same time as the stored one is not skipped
+        updated = list(iter_updated_pull_requests("a/b", "user", "key", pulls[3]["updated_at"]))
+        self.assertEqual([pr["id"] for pr in updated], [pr["id"] for pr in pulls[:4]])
+
+    def test_updated_pull_requests_unchanged(self):
+        pulls = get_pull_requests("a/b", "user", "key")
+        # The rows a first sync stores, and a second sync from them
+        latest = max(pr["updated_at"] for pr in pulls)
+        seen_ids = {str(pr["id"]) for pr in pulls if pr["updated_at"] == latest}
+        self.assertEqual(list(iter_updated_pull_requests("a/b", "user", "key", latest, seen_ids = seen_ids)), [])
+
+    def test_initial_commit_last_page(self):
+        self.server.commits_per_repo = 2500
+        commits = gh_curl_response(get_commits_url("a/b", "d0/file1.py"), "user", "key")
+        self.assertEqual(len(commits), 250)
+        before = wire_stats.stats()['pages_skipped']
+        self.server.num_requests = 0
+        init_commit = get_initial_commit("a/b", "d0/file1.py", "user", "key")
+        self.assertEqual(self.server.num_requests, 2)
+        self.assertEqual(wire_stats.stats()['pages_skipped'] - before, 1)
+        self.assertEqual(init_commit.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                         min(c["commit"]["committer"]["date"] for c in commits))
+
+    def test_archive_contents(self):
+        files = get_file_info_tree("a/b", "user", "key")
+        # A file whose contents changed since the listing is not matched
+        changed = dict(files[1], sha = "0" * 40)
+        records = [files[0], changed] + files[2:]
+        self.server.num_requests = 0
+        contents = get_archive_contents("a/b", "abcdef1234", records, "user", "key")
+        # The tarball request and the redirected download
+        self.assertEqual(self.server.num_requests, 2)
+        self.assertEqual(len(contents), len(files) - 1)
+        self.assertNotIn((changed["path"], changed["sha"]), contents)
+        for record in files[2:]:
+            self.assertEqual(contents[(record["path"], record["sha"])],
+                             get_file_contents(record["git_url"], "user", "key"))
+        self.assertEqual(get_archive_contents("a/missing", "master", records, "user", "key"), {})
+
+    def test_not_modified(self):
+        cache = ResponseCache(os.path.join(self.tmp_dir.name, "cache.db"))
+        set_response_cache(cache)
+        try:
+            first = get_language_bytes("a/b", "user", "key")
+            memo.clear()
+            second = get_language_bytes("a/b", "user", "key")
+        finally:
+            set_response_cache(None)
+            cache.close()
+        self.assertEqual(first, second)
+        self.assertEqual(self.server.num_not_modified, 1)
+
+    def test_rate_limit(self):
+        server = MockGitHubServer(rate_limit = 2).start()
+        try:
+            statuses = [get_response("%s/repos/a/b" % server.url, "user:key").status for i in range(3)]
+            response = get_response("%s/repos/a/b" % server.url, "user:key")
+        finally:
+            server.stop()
+        self.assertEqual(statuses, [200, 200, 403])
+        self.assertEqual(response.headers["x-ratelimit-remaining"], "0")
+
+    def test_latency(self):
+        self.server.latency = 0.1
+        start = time.time()
+        get_response("%s/repos/a/b" % self.server.url, "user:key")
+        self.assertGreaterEqual(time.time() - start, 0.1)
+
+    def test_record_and_replay(self):
+        path = os.path.join(self.tmp_dir.name, "cassette.jsonl")
+        set_cassette(Cassette(path, 'record'))
+        recorded = get_commits("a/b", "user", "key")
+        set_cassette(Cassette(path, 'replay'))
+        self.server.stop()
+        self.assertEqual(get_commits("a/b", "user", "key"), recorded)
+        self.assertRaises(LookupError, get_commits, "a/other", "user", "key")
+        set_cassette(None)
+        # A mock server serving the cassette answers the recorded requests from it
+        self.server = MockGitHubServer(cassette_path = path, commits_per_repo = 1).start()
+        set_api_url(self.server.url)
+        self.assertEqual(get_commits("a/b", "user", "key"), recorded)
+
+
+class RequestMetricsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.metrics = RequestMetrics(buckets = (0.1, 1.0))
+        timings = {'namelookup': 0.01, 'connect': 0.02, 'appconnect': 0.05, 'starttransfer': 0.3, 'total': 0.5}
+        self.metrics.observe_request("commits", 200, 1000, timings, retries = 0, remaining = 4999)
+        timings = {'namelookup': 0.0, 'connect': 0.0, 'appconnect': 0.0, 'starttransfer': 0.04, 'total': 0.05}
+        self.metrics.observe_request("commits", 502, 10, timings, retries = 1, remaining = 4998)
+        self.metrics.observe_phase("bigquery_push", 2.0)
+
+    def test_snapshot(self):
+        snap = self.metrics.snapshot()
+        commits = snap['endpoints']['commits']
+        self.assertEqual(commits['latency']['count'], 2)
+        self.assertEqual(commits['latency']['buckets'], {'0.1': 1, '1.0': 2})
+        self.assertEqual(commits['statuses'], {'200': 1, '502': 1})
+        self.assertEqual(commits['bytes'], 1010)
+        self.assertEqual(commits['retried_requests'], 1)
+        self.assertAlmostEqual(commits['phases']['tls'], 0.03)
+        self.assertAlmostEqual(commits['phases']['server'], 0.25 + 0.04)
+        self.assertEqual(snap['phases']['bigquery_push']['buckets'], {'0.1': 0, '1.0': 0})
+        self.assertEqual(snap['rate_limit_remaining'], 4998)
+        self.assertEqual([r['status'] for r in snap['recent']], [200, 502])
+        json.loads(self.metrics.to_json())
+
+    def test_prometheus(self):
+        text = self.metrics.to_prometheus()
+        self.assertIn('gh_api_request_duration_seconds_bucket{endpoint="commits",le="+Inf"} 2', text)
+        self.assertIn('gh_api_requests_total{endpoint="commits",status="502"} 1', text)
+        self.assertIn('gh_api_phase_duration_seconds_count{phase="bigquery_push"} 1', text)
+        self.assertIn("gh_api_rate_limit_remaining 4998", text)
+
+    def test_transport_records_requests(self):
+        server = MockGitHubServer().start()
+        try:
+            before = len(gh_api_metrics.recent)
+            get_response("%s/repos/a/b/commits" % server.url, "user:key")
+            record = gh_api_metrics.recent[-1]
+        finally:
+            server.stop()
+        self.assertEqual(len(gh_api_metrics.recent), min(before + 1, gh_api_metrics.recent.maxlen))
+        self.assertEqual(record['endpoint'], "commits")
+        self.assertEqual(record['status'], 200)
+        self.assertEqual(record['remaining'], 4999)
+        self.assertGreater(record['bytes'], 0)
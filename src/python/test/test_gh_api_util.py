@@ -0,0 +1,88 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from util import gh_file_contents
+from util import gh_files_contents
+from util import write_gh_files_contents
+from util import gh_api_util
+
+
+class FakeContents(object):
+
+    def __init__(self, decoded, type = 'file'):
+        self.decoded = decoded
+        self.type = type
+
+
+class FakeRepository(object):
+
+    def __init__(self, files):
+        self.files = files
+        self.num_requests = 0
+
+    def file_contents(self, path, ref):
+        self.num_requests = self.num_requests + 1
+        return self.files.get(path)
+
+
+class FakeGitHub(object):
+
+    def __init__(self, files):
+        self.repo = FakeRepository(files)
+        self.num_lookups = 0
+
+    def repository(self, user, repo):
+        self.num_lookups = self.num_lookups + 1
+        return self.repo
+
+
+class GhApiUtilTest(unittest.TestCase):
+
+    def setUp(self):
+        self.gh = FakeGitHub({'a.py': FakeContents(b'x = 1\n'),
+                              'b/c.py': FakeContents('y = 2\n'),
+                              'link': FakeContents(b'', type = 'symlink')})
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_repository_cached(self):
+        self.assertEqual('x = 1\n', gh_file_contents(self.gh, 'u', 'r', 'master', 'a.py'))
+        self.assertEqual('y = 2\n', gh_file_contents(self.gh, 'u', 'r', 'master', 'b/c.py'))
+        self.assertEqual(1, self.gh.num_lookups)
+        self.assertEqual(2, self.gh.repo.num_requests)
+
+    def test_repository_cache_bounded(self):
+        max_cached = gh_api_util.max_cached_repositories
+        gh_api_util.max_cached_repositories = 2
+        try:
+            for repo in ['r1', 'r2', 'r1', 'r3', 'r1', 'r2']:
+                gh_file_contents(self.gh, 'u', repo, 'master', 'a.py')
+        finally:
+            gh_api_util.max_cached_repositories = max_cached
+        # r2 was evicted by r3, as the least recently used
+        self.assertEqual(4, self.gh.num_lookups)
+        self.assertLessEqual(len(gh_api_util._repositories), 2)
+
+    def test_files_contents(self):
+        contents = dict(gh_files_contents(self.gh, 'u', 'r', 'master', ['a.py', 'b/c.py', 'link']))
+        self.assertEqual({'a.py': 'x = 1\n', 'b/c.py': 'y = 2\n', 'link': None}, contents)
+        self.assertEqual(3, self.gh.repo.num_requests)
+
+    def test_write_files_contents(self):
+        written = write_gh_files_contents(self.gh, 'u', 'r', 'master', ['a.py', 'b/c.py', 'link'],
+                                          output_dir = self.dir)
+        self.assertEqual(['a.py', 'b/c.py', 'link'], [path for path, file in written])
+        written = dict(written)
+        self.assertIsNone(written['link'])
+        self.assertEqual(os.path.join(self.dir, 'u_r_b_c.py'), written['b/c.py'])
+        with open(written['a.py']) as f:
+            self.assertEqual('x = 1\n', f.read())
+        self.assertEqual(1, self.gh.num_lookups)
+
+
+if __name__ == '__main__':
+    unittest.main()
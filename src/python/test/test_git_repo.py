@@ -0,0 +1,94 @@
+import os
+import tempfile
+import unittest
+
+from gh_api import git_blob_sha
+from git_repo import GitError, clone_repo, cloned_repo, run_git, LocalRepo
+from git_repo.clone import git_env
+
+
+class LocalRepoTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.work = os.path.join(self.tmp_dir.name, "work")
+        self.env = dict(git_env(), GIT_AUTHOR_NAME = "Dev", GIT_AUTHOR_EMAIL = "dev@example.com",
+                        GIT_COMMITTER_NAME = "Dev", GIT_COMMITTER_EMAIL = "dev@example.com")
+        run_git(["init", "--quiet", self.work], env = self.env)
+        self.commit({"README.md": "readme\n", "src/a.py": "a = 1\n"}, "Initial commit", "2015-01-01T00:00:00Z")
+        self.commit({"src/b.py": "b = 2\n", "src/a.py": "a = 3\n"}, "Second commit\n\nWith a body", "2016-01-01T00:00:00Z")
+        self.commit({"docs/c.txt": b"\xff\xfe binary"}, "Third commit", "2017-01-01T00:00:00Z")
+        self.bare = clone_repo("o/r", os.path.join(self.tmp_dir.name, "bare.git"), url = self.work)
+        self.repo = LocalRepo(self.bare, "o/r")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def commit(self, files, message, date):
+        for path, content in files.items():
+            full_path = os.path.join(self.work, path)
+            os.makedirs(os.path.dirname(full_path), exist_ok = True)
+            with open(full_path, "wb") as f:
+                f.write(content.encode() if isinstance(content, str) else content)
+        env = dict(self.env, GIT_AUTHOR_DATE = date, GIT_COMMITTER_DATE = date)
+        run_git(["add", "-A"], cwd = self.work, env = env)
+        run_git(["commit", "--quiet", "-m", message], cwd = self.work, env = env)
+
+    def test_file_info(self):
+        head = self.repo.head_sha()
+        files = {f["path"]: f for f in self.repo.file_info()}
+        self.assertEqual(set(files.keys()), {"README.md", "src/a.py", "src/b.py", "docs/c.txt"})
+        a = files["src/a.py"]
+        self.assertEqual(a["name"], "a.py")
+        self.assertEqual(a["sha"], git_blob_sha(b"a = 3\n"))
+        self.assertEqual(a["size"], 6)
+        self.assertEqual(a["type"], "file")
+        self.assertIn("/repos/o/r/git/blobs/%s" % a["sha"], a["git_url"])
+        self.assertIn("blob/%s/src/a.py" % head, a["html_url"])
+
+    def test_contents(self):
+        files = self.repo.file_info()
+        missing = dict(files[0], sha = "0" * 40)
+        contents = self.repo.get_contents(files + [missing])
+        self.assertEqual(len(contents), len(files))
+        self.assertEqual(contents[("src/b.py", git_blob_sha(b"b = 2\n"))], "b = 2\n")
+        self.assertIsNone(contents[("docs/c.txt", git_blob_sha(b"\xff\xfe binary"))])
+
+    def test_commits(self):
+        commits = list(self.repo.iter_commits())
+        self.assertEqual([c["commit"]["message"] for c in commits],
+                         ["Third commit", "Second commit\n\nWith a body", "Initial commit"])
+        self.assertEqual(commits[2]["commit"]["committer"]["date"], "2015-01-01T00:00:00Z")
+        self.assertEqual(commits[0]["commit"]["author"]["email"], "dev@example.com")
+        self.assertEqual(commits[0]["sha"], self.repo.head_sha())
+
+    def test_initial_commits(self):
+        init_commits = self.repo.initial_commits(["src/a.py", "src/b.py", "docs/c.txt", "missing.py"])
+        self.assertEqual({path: t.year for path, t in init_commits.items()},
+                         {"src/a.py": 2015, "src/b.py": 2016, "docs/c.txt": 2017})
+
+    def test_initial_commit_added_in_merge(self):
+        run_git(["checkout", "--quiet", "-b", "side"], cwd = self.work, env = self.env)
+        self.commit({"side.py": "s = 1\n"}, "Side commit", "2018-01-01T00:00:00Z")
+        run_git(["checkout", "--quiet", "-"], cwd = self.work, env = self.env)
+        env = dict(self.env, GIT_AUTHOR_DATE = "2019-01-01T00:00:00Z", GIT_COMMITTER_DATE = "2019-01-01T00:00:00Z")
+        run_git(["merge", "--quiet", "--no-ff", "--no-commit", "side"], cwd = self.work, env = env)
+        self.commit({"merged.py": "m = 1\n"}, "Merge side", "2019-01-01T00:00:00Z")
+        repo = LocalRepo(clone_repo("o/r", os.path.join(self.tmp_dir.name, "merged.git"), url = self.work), "o/r")
+        # The walk does not list the files of merge commits
+        self.assertNotIn("merged.py", repo.initial_commits(["side.py", "merged.py"]))
+        self.assertEqual(repo.initial_commit("merged.py").year, 2019)
+        self.assertEqual(repo.initial_commit("side.py").year, 2018)
+        self.assertIsNone(repo.initial_commit("missing.py"))
+
+    def test_cloned_repo(self):
+        with cloned_repo("o/r", url = self.work, filter_blobs = True) as repo:
+            self.assertEqual(len(list(repo.iter_commits())), 3)
+            path = repo.path
+        self.assertFalse(os.path.exists(path))
+        self.assertRaises(GitError, clone_repo, "o/missing", os.path.join(self.tmp_dir.name, "missing.git"),
+                          url = os.path.join(self.tmp_dir.name, "does_not_exist"))
+
+
+if __name__ == '__main__':
+    unittest.main()
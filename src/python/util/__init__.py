@@ -1,6 +1,7 @@
 from .bigquery_util import run_bq_query
 from .bigquery_util import delete_bq_table
 from .bigquery_util import create_bq_table
+from .bigquery_util import create_bq_view
 from .bigquery_util import push_bq_records
 from .bigquery_util import run_query_and_save_results
 from .cloc_util import parse_cloc_response
@@ -8,8 +9,8 @@ from .cloc_util import rec_contents_comments_stripped
 from .file_util import write_file
 from .gsheets_util import get_repo_names
 from .python_util import curr_time_utc
+from .python_util import iso_time_utc
 from .gh_api_util import gh_file_contents
-from .gh_api_util import sleep_gh_rate_limit
 from .gh_api_util import gh_login
 from .gh_api_util import write_gh_file_contents
 from .bigquery_util import unique_vals
@@ -17,3 +18,10 @@ from .gh_api_util import gh_userpwd
 from .python_util import err_msg
 from .bigquery_util import max_record_size
 
+from .bigquery_util import mean_group_size
+from .gh_api_util import gh_repository
+from .gh_api_util import gh_files_contents
+from .gh_api_util import write_gh_files_contents
+from .bigquery_util import add_bq_columns
+from .bigquery_util import push_bq_counts
+from .bigquery_util import push_bq_batches
@@ -1,5 +1,8 @@
+from contextlib import suppress
 import time
 
+from .python_util import curr_time_utc
+
 max_record_size = 1000000
 
 def unique_vals(client, proj, dataset, table, col_name):
@@ -17,6 +20,26 @@ def unique_vals(client, proj, dataset, table, col_name):
     res = run_bq_query(client, "SELECT %s FROM [%s:%s.%s] GROUP BY %s ORDER BY %s" % (col_name, proj, dataset, table, col_name, col_name), 120)
     return [rec[col_name] for rec in res]
 
+def mean_group_size(client, proj, dataset, table, col_name, count_expr = "COUNT(*)"):
+    """ Returns the mean over values of a column of an aggregate of each value's records,
+    by default the number of records; returns None if the table does not exist or is empty
+
+    Args:
+        client: BigQuery-Python client
+        proj: Project name
+        dataset: Dataset name
+        table: Table name
+        col_name: Column name to group by
+        count_expr: Legacy SQL aggregate computed for each group
+    """
+    if not client.check_table(dataset, table):
+        return None
+    res = run_bq_query(client, "SELECT AVG(n) AS mean FROM (SELECT %s, %s AS n FROM [%s:%s.%s] GROUP BY %s)"
+                       % (col_name, count_expr, proj, dataset, table, col_name), 120)
+    if len(res) == 0:
+        return None
+    return res[0]["mean"]
+
 def run_bq_query(client, query, timeout):
     """ Returns the results of a BigQuery query
     
@@ -69,6 +92,45 @@ def create_bq_table(client, dataset, table, schema):
     if not exists:
         raise RuntimeError('Table creation failed: %s.%s' % (dataset, table))
 
+def add_bq_columns(client, dataset, table, schema):
+    """ Add the columns of a schema that an existing BigQuery table lacks, e.g. after a new
+    column was added to a script's schema. New columns must be NULLABLE; existing rows get null.
+    
+    Args:
+        client: BigQuery-Python client object with readonly set to false
+                (https://github.com/tylertreat/BigQuery-Python)
+        dataset: Dataset name
+        table: Table name
+        schema: List of dictionaries describing the schema, as for create_bq_table
+    
+    """
+    
+    existing = client.get_table_schema(dataset, table)
+    existing_names = {field['name'] for field in existing}
+    missing = [field for field in schema if field['name'] not in existing_names]
+    if len(missing) > 0:
+        print('Adding columns to table %s.%s: %s' % (dataset, table, ", ".join(field['name'] for field in missing)))
+        if not client.patch_table(dataset, table, existing + missing):
+            raise RuntimeError('Adding columns failed: %s.%s' % (dataset, table))
+
+def create_bq_view(client, dataset, view, query):
+    """ Create a BigQuery view if it does not exist
+    
+    Args:
+        client: BigQuery-Python client object with readonly set to false
+                (https://github.com/tylertreat/BigQuery-Python)
+        dataset: Dataset name
+        view: View name
+        query: Legacy SQL query defining the view
+    
+    """
+    
+    if client.check_table(dataset, view):
+        return
+    print('Creating view %s.%s' % (dataset, view))
+    if not client.create_view(dataset, view, query):
+        raise RuntimeError('View creation failed: %s.%s' % (dataset, view))
+
 def delete_bq_table(client, dataset, table):
     """ Delete a BigQuery table if it exists
     
@@ -131,6 +193,74 @@ def push_bq_records(client, dataset, table, records, sleep = 300, max_batch = 10
             time.sleep(sleep)
             push_bq_records(client, dataset, table, records, sleep, max_batch)
 
+
+def push_bq_batches(records, push, batch_size = 1000):
+    """ Push records from an iterable in batches as they arrive, so that at most batch_size
+    records are held in memory at a time
+    
+    Args:
+        records: Iterable of records, e.g. a generator reading pages from the GitHub API
+        push: Function that pushes a list of records, e.g. calling push_bq_records
+        batch_size: Number of records per push; the last push may have fewer
+    
+    Returns:
+        The number of records pushed
+    """
+    num_pushed = 0
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= batch_size:
+            push(batch)
+            num_pushed = num_pushed + len(batch)
+            batch = []
+    if len(batch) > 0:
+        push(batch)
+    return num_pushed + len(batch)
+
+
+def push_bq_counts(client, dataset, table, repos, count, column, map_fn, push_timer = suppress, batch_size = 100):
+    """ Write one count per repo to a BigQuery table with columns repo_name, the count
+    column and time_accessed, creating the table if necessary. Repos whose count raises
+    ValueError, i.e. that were not found, are skipped.
+    
+    Args:
+        client: BigQuery-Python client object with readonly set to false
+                (https://github.com/tylertreat/BigQuery-Python)
+        dataset: Dataset name
+        table: Table name
+        repos: List of repo names
+        count: Function from repo name to count
+        column: Name of the count column, e.g. 'commit_count'
+        map_fn: Function applying a function to each item of a list, returning a result or
+                an exception per item, e.g. gh_api.map_concurrently to count repos concurrently
+        push_timer: Function of no arguments returning a context manager around each push,
+                    e.g. to time it; by default the pushes are not wrapped
+        batch_size: Number of repos counted per push
+    """
+    schema = [
+        {'name': 'repo_name', 'type': 'STRING', 'mode': 'NULLABLE'},
+        {'name': column, 'type': 'INTEGER', 'mode': 'NULLABLE'},
+        {'name': 'time_accessed', 'type': 'STRING', 'mode': 'NULLABLE'}
+    ]
+    if not client.check_table(dataset, table):
+        create_bq_table(client, dataset, table, schema)
+    def get_count_record(repo_name):
+        return {'repo_name': repo_name, column: count(repo_name), 'time_accessed': curr_time_utc()}
+    for i in range(0, len(repos), batch_size):
+        batch = repos[i:i + batch_size]
+        records = []
+        for repo_name, result in zip(batch, map_fn(get_count_record, batch)):
+            if isinstance(result, ValueError):
+                print("Skipping repo %s: not found" % repo_name)
+            elif isinstance(result, Exception):
+                raise result
+            else:
+                records.append(result)
+        print("%s\tFinished %s repos. Pushing %s records." % (curr_time_utc(), i + len(batch), len(records)))
+        with push_timer():
+            push_bq_records(client, dataset, table, records)
+
     
 def run_query_and_save_results(client, query, res_dataset, res_table, timeout = 60):
     """ Run a query and save the results to a BigQuery table
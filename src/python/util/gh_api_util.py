@@ -1,5 +1,7 @@
+from collections import OrderedDict
 from getpass import getpass
-from time import sleep
+import os
+import threading
 
 import chardet
 from github3 import login
@@ -19,15 +21,6 @@ def gh_userpwd(gh_username, gh_oauth_key):
 # GitHub API rate limit
 api_rate_limit_per_hour = 5000
 
-# The number of seconds to wait between jobs if expecting to approach the rate limit
-sec_between_requests = 60 * 60 / api_rate_limit_per_hour
-
-def sleep_gh_rate_limit():
-    """ Sleep for an amount of time that, if done between GitHub API requests for a full hour,
-    will ensure the API rate limit is not exceeded.
-    """    
-    sleep(sec_between_requests + 0.05) 
-
 def gh_login():
     """ Get an authenticated GitHub object
     GitHub object (https://github3py.readthedocs.io/en/master/github.html#github3.github.GitHub)
@@ -40,25 +33,43 @@ def gh_login():
     password = getpass('GitHub password: ')
     return(login(username, password))
 
-def gh_file_contents(gh, user, repo, ref, path):
-    """ Returns the file_contents of a file as a string
+# Repository objects most recently looked up, keyed by (id of GitHub object, user, repo),
+# least recently used first
+_repositories = OrderedDict()
+_repositories_lock = threading.Lock()
+
+# Largest number of Repository objects kept
+max_cached_repositories = 128
+
+def gh_repository(gh, user, repo):
+    """ Returns the github3 Repository object for a repo, looking it up only once per GitHub object
+    while it is among the max_cached_repositories most recently used
     
     Args:
         gh: github3 "GitHub" object (https://github3py.readthedocs.io/en/master/github.html#github3.github.GitHub)
         user: GitHub username
         repo: Repository name
-        ref: Branch ref e.g. 'refs/heads/master'
-        path: File path within repo
-        
-    Returns:
-        If file type is 'file', returns the file contents as a string. 
-        Otherwise (file type is 'symlink' or 'submodule'), returns None.
-    
     """
-    
+    key = (id(gh), user, repo)
+    with _repositories_lock:
+        cached = _repositories.get(key)
+        if cached is not None:
+            _repositories.move_to_end(key)
+    # The GitHub object is kept with the repository so its id is not reused
+    if cached is not None and cached[0] is gh:
+        return cached[1]
     r = gh.repository(user, repo)
-    c = r.file_contents(path, ref) # github.py 1.0.0
-    #c = r.contents(path, ref) # github3.py 0.9
+    with _repositories_lock:
+        _repositories[key] = (gh, r)
+        _repositories.move_to_end(key)
+        while len(_repositories) > max_cached_repositories:
+            _repositories.popitem(last = False)
+    return r
+
+def decode_file_contents(c):
+    """ Returns the decoded contents of a github3 Contents object as a string,
+    or None if it is not a file
+    """
     if c is not None and c.type == 'file':
         dec = c.decoded
         if isinstance(dec, str):
@@ -72,6 +83,47 @@ def gh_file_contents(gh, user, repo, ref, path):
     else:
         return(None)
 
+def gh_file_contents(gh, user, repo, ref, path):
+    """ Returns the file_contents of a file as a string
+    
+    Args:
+        gh: github3 "GitHub" object (https://github3py.readthedocs.io/en/master/github.html#github3.github.GitHub)
+        user: GitHub username
+        repo: Repository name
+        ref: Branch ref e.g. 'refs/heads/master'
+        path: File path within repo
+        
+    Returns:
+        If file type is 'file', returns the file contents as a string. 
+        Otherwise (file type is 'symlink' or 'submodule'), returns None.
+    
+    """
+    
+    r = gh_repository(gh, user, repo)
+    c = r.file_contents(path, ref) # github.py 1.0.0
+    #c = r.contents(path, ref) # github3.py 0.9
+    return(decode_file_contents(c))
+
+def gh_files_contents(gh, user, repo, ref, paths):
+    """ Yields (path, contents) for many files in one repo, one file at a time
+    The repository is looked up once, so each file costs one request.
+    
+    Args:
+        gh: github3 "GitHub" object (https://github3py.readthedocs.io/en/master/github.html#github3.github.GitHub)
+        user: GitHub username
+        repo: Repository name
+        ref: Branch ref e.g. 'refs/heads/master'
+        paths: Iterable of file paths within repo
+        
+    Yields:
+        (path, contents) where contents is the file contents as a string if file type is 'file',
+        and None otherwise (file type is 'symlink' or 'submodule')
+    
+    """
+    r = gh_repository(gh, user, repo)
+    for path in paths:
+        yield path, decode_file_contents(r.file_contents(path, ref))
+
 def write_gh_file_contents(gh, user, repo, ref, path, output = None):
     """ Writes the file_contents of a file to disk
     
@@ -103,13 +155,34 @@ def write_gh_file_contents(gh, user, repo, ref, path, output = None):
     else:
         return(None)
 
-
-
-
-
-
-
-
-
-
-
+def write_gh_files_contents(gh, user, repo, ref, paths, output_dir = None):
+    """ Writes the file_contents of many files in one repo to disk as each is fetched
+    Only one file's contents are held in memory at a time.
+    
+    Args:
+        gh: github3 "GitHub" object (https://github3py.readthedocs.io/en/master/github.html#github3.github.GitHub)
+        user: GitHub username
+        repo: Repository name
+        ref: Branch ref e.g. 'refs/heads/master'
+        paths: Iterable of file paths within repo
+        output_dir: Directory to write to, created if necessary. If None, files are written
+                    to the /tmp/ directory. File names are as in write_gh_file_contents.
+        
+    Returns:
+        List of (path, file) where file is the path the output was written to if file type
+        is 'file', and None otherwise (file type is 'symlink' or 'submodule')
+    
+    """
+    written = []
+    if output_dir is None:
+        output_dir = '/tmp'
+    os.makedirs(output_dir, exist_ok = True)
+    for path, content in gh_files_contents(gh, user, repo, ref, paths):
+        if content is None:
+            written.append((path, None))
+            continue
+        file = os.path.join(output_dir, ('%s/%s/%s' % (user, repo, path)).replace('/', '_'))
+        with open(file, 'w') as f:
+            f.write(content)
+        written.append((path, file))
+    return written
@@ -4,6 +4,11 @@ def curr_time_utc():
     curr_time = time.gmtime(time.time())
     return time.strftime('%d %b %Y %H:%M:%S %Z', curr_time)
 
+def iso_time_utc(time_utc):
+    # Converts a time formatted by curr_time_utc to ISO 8601, as in GitHub API timestamps
+    parsed = time.strptime(time_utc.rsplit(' ', 1)[0], '%d %b %Y %H:%M:%S')
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', parsed)
+
 def err_msg(e):
     if hasattr(e, 'message'):
         return e.message